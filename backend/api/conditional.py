@@ -0,0 +1,110 @@
+from calendar import timegm
+from hashlib import md5
+
+from django.db.models import Count, IntegerField, Max, OuterRef, Subquery
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date, quote_etag
+from recipe.models import Favorite, ShoppingCart
+from users.models import Follow, User
+
+
+def make_etag(*parts, weak=False):
+    """Собирает ETag из частей версии ресурса."""
+    digest = md5(':'.join(map(str, parts)).encode()).hexdigest()
+    etag = quote_etag(digest)
+    return f'W/{etag}' if weak else etag
+
+
+def catalog_version(queryset):
+    """Версия справочника (теги, ингредиенты): количество записей
+    и время последнего изменения. Любое добавление, изменение
+    или удаление записи меняет хотя бы одно из значений."""
+    stats = queryset.order_by().aggregate(
+        count=Count('pk'), last_modified=Max('updated'))
+    last_modified = stats['last_modified']
+    return (
+        make_etag(queryset.model._meta.label, stats['count'], last_modified),
+        last_modified,
+    )
+
+
+def viewer_version(user):
+    """Версия состояния пользователя, от которого зависят признаки
+    is_favorited, is_in_shopping_cart и is_subscribed в ответах:
+    количество и максимальный id его записей в избранном, корзине
+    и подписках. Считается одним запросом."""
+    if user.is_anonymous:
+        return ()
+    annotations = {}
+    for name, model in (
+        ('favorites', Favorite),
+        ('shopping_cart', ShoppingCart),
+        ('follows', Follow),
+    ):
+        rows = model.objects.filter(
+            user=OuterRef('pk')).order_by().values('user')
+        annotations[f'{name}_count'] = Subquery(
+            rows.annotate(value=Count('pk')).values('value'),
+            output_field=IntegerField(),
+        )
+        annotations[f'{name}_last'] = Subquery(
+            rows.annotate(value=Max('pk')).values('value'),
+            output_field=IntegerField(),
+        )
+    return (user.pk, *User.objects.filter(pk=user.pk).annotate(
+        **annotations).values_list(*annotations).get())
+
+
+class ConditionalGetMixin:
+    """Добавляет к list и retrieve заголовки ETag и Last-Modified
+    и отвечает 304, если у клиента актуальная версия. Версия
+    вычисляется до сериализации, поэтому для 304 она не выполняется.
+    Наследники определяют get_list_version и get_object_version,
+    которые возвращают пару (etag, last_modified) или None.
+    Если ответ зависит от пользователя, vary_on_user добавляет
+    заголовок Vary: Authorization."""
+    vary_on_user = False
+
+    def get_list_version(self):
+        return None
+
+    def get_object_version(self):
+        return None
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request, self.get_list_version(), super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request, self.get_object_version(), super().retrieve,
+            *args, **kwargs)
+
+    def set_validators(self, response, etag, last_modified):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(
+                timegm(last_modified.utctimetuple()))
+        patch_cache_control(response, no_cache=True)
+        if self.vary_on_user:
+            patch_vary_headers(response, ('Authorization', ))
+
+    def conditional_response(self, request, version, handler,
+                             *args, **kwargs):
+        if version is None:
+            return handler(request, *args, **kwargs)
+        etag, last_modified = version
+        response = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=(
+                timegm(last_modified.utctimetuple())
+                if last_modified is not None else None
+            ),
+        )
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            self.set_validators(response, etag, last_modified)
+        return response
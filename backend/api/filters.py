@@ -1,27 +1,92 @@
+from core.utils import normalize_search_key, prefix_condition
+from django.db.models import Case, Count, IntegerField, When
 from django_filters import FilterSet
 from django_filters import rest_framework as filters
-from recipe.models import Ingredient, Recipe, Tag
-from rest_framework import filters as f
+from recipe.models import Recipe, get_tag_bits
+from recipe.search import search_recipes
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
 from users.models import User
 
 
-class IngredientFilter(f.SearchFilter):
-    """Фильтр для ингредиентов: поиск по названию."""
+class IngredientFilter(BaseFilterBackend):
+    """Фильтр для ингредиентов: автодополнение по названию.
+    Сначала идут ингредиенты, название которых начинается с запроса,
+    затем те, где запрос встречается внутри названия. При равенстве
+    выше ингредиенты, которые используются в большем числе рецептов.
+    Параметр limit ограничивает количество результатов."""
     search_param = 'name'
+    limit_param = 'limit'
+    max_limit = 50
 
-    class Meta:
-        model = Ingredient
-        fields = ('name',)
+    def get_limit(self, request):
+        limit = request.query_params.get(self.limit_param)
+        if not limit:
+            return None
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValidationError(
+                {self.limit_param: 'Должно быть целым числом.'})
+        if limit <= 0:
+            raise ValidationError(
+                {self.limit_param: 'Должно быть положительным числом.'})
+        return min(limit, self.max_limit)
+
+    def filter_queryset(self, request, queryset, view):
+        key = normalize_search_key(
+            request.query_params.get(self.search_param, ''))
+        if not key:
+            return queryset
+        limit = self.get_limit(request)
+        prefix = prefix_condition('search_name', key)
+        queryset = queryset.annotate(
+            recipes_count=Count('recipeingredientamount'))
+        ordering = ('-recipes_count', 'name')
+        if limit is None:
+            return queryset.filter(search_name__contains=key).annotate(
+                is_substring=Case(
+                    When(prefix, then=0),
+                    default=1,
+                    output_field=IntegerField(),
+                )
+            ).order_by('is_substring', *ordering)
+        ids = list(queryset.filter(prefix).order_by(
+            *ordering).values_list('pk', flat=True)[:limit])
+        if len(ids) < limit:
+            ids += queryset.filter(search_name__contains=key).exclude(
+                prefix).order_by(*ordering).values_list(
+                'pk', flat=True)[:limit - len(ids)]
+        return queryset.filter(pk__in=ids).order_by(Case(
+            *[When(pk=pk, then=position) for position, pk in enumerate(ids)],
+            output_field=IntegerField(),
+        ))
+
+
+def tag_choices():
+    return [(slug, slug) for slug in get_tag_bits()]
+
+
+TAGS_MODES = (
+    ('any', 'Любой из тегов'),
+    ('all', 'Все теги'),
+)
 
 
 class RecipeFilter(FilterSet):
     """Класс фильтра для модели Recipe. Позволяет производить
-    поиск рецептов по тегам, автору, наличию в списке
-    избранного и корзине покупок."""
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all(),
+    поиск рецептов по тегам (tags_mode=all — рецепты со всеми
+    выбранными тегами, по умолчанию — с любым из них), автору, наличию в списке
+    избранного и корзине покупок, а также полнотекстовый поиск
+    по названию и описанию: результаты поиска упорядочены
+    по релевантности."""
+    tags = filters.MultipleChoiceFilter(
+        choices=tag_choices,
+        method='filter_tags',
+    )
+    tags_mode = filters.ChoiceFilter(
+        choices=TAGS_MODES,
+        method='filter_tags_mode',
     )
     author = filters.ModelChoiceFilter(
         queryset=User.objects.all(),
@@ -32,14 +97,27 @@ class RecipeFilter(FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart'
     )
+    search = filters.CharFilter(
+        method='filter_search'
+    )
 
     class Meta:
         model = Recipe
         fields = (
-            'tags', 'author',
-            'is_favorited', 'is_in_shopping_cart',
+            'tags', 'tags_mode', 'author',
+            'is_favorited', 'is_in_shopping_cart', 'search',
         )
 
+    def filter_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        return queryset.with_tags(
+            value, match_all=self.form.cleaned_data.get('tags_mode') == 'all')
+
+    def filter_tags_mode(self, queryset, name, value):
+        """Режим учитывается в filter_tags."""
+        return queryset
+
     def filter_is_favorited(self, queryset, name, value):
         user = self.request.user
         if value and user.is_authenticated:
@@ -51,3 +129,6 @@ class RecipeFilter(FilterSet):
         if value and user.is_authenticated:
             return queryset.filter(shopping_cart__user=user)
         return queryset
+
+    def filter_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
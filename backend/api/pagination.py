@@ -1,8 +1,173 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from functools import partial
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+# Границы BigIntegerField: большие значения в курсоре не доходят до базы.
+MIN_INT = -2 ** 63
+MAX_INT = 2 ** 63 - 1
+
+
+class CountedPaginator(DjangoPaginator):
+    """Пагинатор с заранее известным количеством записей."""
+
+    def __init__(self, object_list, per_page, count, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.known_count = count
+
+    @cached_property
+    def count(self):
+        return self.known_count
 
 
 class RecipePagination(PageNumberPagination):
-    """Пагинатор для определения количества элементов на странице."""
+    """Пагинатор для определения количества элементов на странице.
+
+    Если в запросе есть параметр cursor, вместо номера страницы
+    используется курсор: выборка продолжается с позиции последней
+    записи предыдущей страницы по полям cursor_fields (по убыванию),
+    без OFFSET и без подсчёта количества записей. Новые записи,
+    добавленные между запросами, не сдвигают страницы. Пустой курсор
+    соответствует первой странице. Представление может задать свои
+    поля методом get_cursor_fields; последнее поле должно быть
+    уникальным.
+
+    В постраничном режиме количество записей берётся из метода
+    представления get_list_count, если он есть; он возвращает пару
+    (количество, точно ли оно посчитано), второе значение отдаётся
+    в поле count_exact.
+    """
     page_size = 6
     page_size_query_param = 'limit'
     max_page_size = 15
+    cursor_query_param = 'cursor'
+    cursor_fields = ('pub_date', 'id')
+    invalid_cursor_message = 'Неверный курсор.'
+
+    @property
+    def ignored_filter_params(self):
+        """Параметры запроса, которые не влияют на состав выборки."""
+        return (
+            self.page_query_param,
+            self.page_size_query_param,
+            self.cursor_query_param,
+        )
+
+    def is_cursor_request(self, request):
+        return self.cursor_query_param in request.query_params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_mode = self.is_cursor_request(request)
+        if not self.cursor_mode:
+            self.count_exact = True
+            if hasattr(view, 'get_list_count'):
+                count, self.count_exact = view.get_list_count(queryset)
+                self.django_paginator_class = partial(
+                    CountedPaginator, count=count)
+            return super().paginate_queryset(queryset, request, view)
+        self.request = request
+        fields = (
+            view.get_cursor_fields()
+            if hasattr(view, 'get_cursor_fields') else self.cursor_fields
+        )
+        page_size = self.get_page_size(request)
+        position = self.decode_cursor(
+            request.query_params[self.cursor_query_param], len(fields))
+        queryset = queryset.order_by(*(f'-{field}' for field in fields))
+        if position is not None:
+            position = self.clean_position(queryset, fields, position)
+            queryset = queryset.filter(self.seek_condition(fields, position))
+        results = list(queryset[:page_size + 1])
+        self.next_position = None
+        if len(results) > page_size:
+            results = results[:page_size]
+            last = results[-1]
+            self.next_position = [getattr(last, field) for field in fields]
+        return results
+
+    @staticmethod
+    def seek_condition(fields, position):
+        """Условие «кортеж полей меньше position» для сортировки
+        по убыванию: (a < a0) OR (a = a0 AND b < b0) ..."""
+        condition = Q()
+        for field, value in reversed(list(zip(fields, position))):
+            seek = Q(**{f'{field}__lt': value})
+            if condition:
+                seek |= Q(**{field: value}) & condition
+            condition = seek
+        return condition
+
+    @staticmethod
+    def get_field(queryset, name):
+        annotation = queryset.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        return queryset.model._meta.get_field(name)
+
+    def clean_position(self, queryset, fields, position):
+        """Приводит значения курсора к типам полей сортировки. Значение,
+        которое не приводится к типу поля или не помещается в целое
+        64-битное число, означает неверный курсор, а не ошибку базы."""
+        cleaned = []
+        for name, value in zip(fields, position):
+            try:
+                value = self.get_field(queryset, name).to_python(value)
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+            if value is None or (
+                isinstance(value, int) and not MIN_INT <= value <= MAX_INT
+            ):
+                raise NotFound(self.invalid_cursor_message)
+            cleaned.append(value)
+        return cleaned
+
+    def decode_cursor(self, cursor, length):
+        if not cursor:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != length:
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def encode_cursor(self, position):
+        # str() сохраняет микросекунды даты, в отличие от DjangoJSONEncoder.
+        data = json.dumps(position, default=str).encode()
+        return base64.urlsafe_b64encode(data).decode()
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super().get_next_link()
+        if self.next_position is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self.next_position),
+        )
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return Response(OrderedDict([
+                ('count', self.page.paginator.count),
+                ('count_exact', self.count_exact),
+                ('next', self.get_next_link()),
+                ('previous', self.get_previous_link()),
+                ('results', data),
+            ]))
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
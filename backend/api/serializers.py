@@ -1,6 +1,10 @@
-from core.utils import Base64ImageField
+from core.utils import (Base64ImageField, ImageVariantsField,
+                        set_prefetched_objects)
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
 from recipe.models import (Favorite, Ingredient, Recipe,
-                           RecipeIngredientAmount, ShoppingCart, Tag)
+                           RecipeIngredientAmount, ShoppingCart,
+                           ShoppingCartIngredient, Tag, get_tags_mask)
 from rest_framework import serializers, validators
 from users.serializers import CustomUserSerializer
 
@@ -10,7 +14,7 @@ class IngredientSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Ingredient
-        fields = '__all__'
+        exclude = ('search_name', )
 
 
 class RecipeIngredientAmountSerializer(serializers.ModelSerializer):
@@ -37,6 +41,7 @@ class RecipeIngredientAmountSerializer(serializers.ModelSerializer):
 class CreateRecipeIngredientAmountSerializer(serializers.ModelSerializer):
     """Сериализатор для создания рецепта."""
     id = serializers.IntegerField(write_only=True)
+    amount = serializers.IntegerField(min_value=1, max_value=32767)
 
     class Meta:
         model = RecipeIngredientAmount
@@ -52,7 +57,16 @@ class TagSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Tag
-        fields = '__all__'
+        fields = ('id', 'name', 'color', 'slug')
+
+    def validate(self, object):
+        """Новому тегу нужен свободный бит в маске тегов рецепта."""
+        if self.instance is None:
+            try:
+                Tag().clean()
+            except DjangoValidationError as error:
+                raise serializers.ValidationError(error.messages)
+        return object
 
 
 class GetRecipeSerializer(serializers.ModelSerializer):
@@ -68,6 +82,7 @@ class GetRecipeSerializer(serializers.ModelSerializer):
         source='ingredienttorecipe',
     )
     image = Base64ImageField(read_only=True)
+    image_variants = ImageVariantsField()
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
 
@@ -76,7 +91,8 @@ class GetRecipeSerializer(serializers.ModelSerializer):
         fields = (
             'id', 'name', 'text', 'tags',
             'author', 'ingredients', 'is_favorited',
-            'is_in_shopping_cart', 'image', 'cooking_time',
+            'is_in_shopping_cart', 'image', 'image_variants',
+            'cooking_time', 'favorites_count', 'in_carts_count',
         )
         read_only_fields = (
             'is_favorited',
@@ -85,7 +101,11 @@ class GetRecipeSerializer(serializers.ModelSerializer):
 
     def get_is_favorited(self, object):
         """Возвращает True, если рецепт находится в избранном,
-        в противном случае возвращает False."""
+        в противном случае возвращает False.
+        Использует аннотацию из RecipeViewSet.get_queryset, если она есть."""
+        annotated = getattr(object, 'is_favorited', None)
+        if annotated is not None:
+            return annotated
         user = self.context['request'].user
         if user.is_anonymous:
             return False
@@ -96,7 +116,11 @@ class GetRecipeSerializer(serializers.ModelSerializer):
 
     def get_is_in_shopping_cart(self, object):
         """Возвращает True, если рецепт находится в списке покупок,
-        в противном случае возвращает False."""
+        в противном случае возвращает False.
+        Использует аннотацию из RecipeViewSet.get_queryset, если она есть."""
+        annotated = getattr(object, 'is_in_shopping_cart', None)
+        if annotated is not None:
+            return annotated
         user = self.context['request'].user
 
         if user.is_anonymous:
@@ -109,9 +133,8 @@ class GetRecipeSerializer(serializers.ModelSerializer):
 
 class CreateRecipeSerializer(serializers.ModelSerializer):
     """Сериализатор для создания рецепта."""
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(),
-        many=True,
+    tags = serializers.ListField(
+        child=serializers.IntegerField(),
     )
     author = CustomUserSerializer(read_only=True)
     ingredients = CreateRecipeIngredientAmountSerializer(
@@ -126,68 +149,188 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
                   'name', 'image', 'text', 'cooking_time',
                   )
 
+    def validate_tags(self, tag_ids):
+        """Находит все теги одним запросом. Возвращает объекты Tag."""
+        tags = Tag.objects.in_bulk(tag_ids)
+        errors = [
+            [] if pk in tags else
+            [f'Недопустимый первичный ключ "{pk}" - объект не существует.']
+            for pk in tag_ids
+        ]
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return [tags[pk] for pk in dict.fromkeys(tag_ids)]
+
+    def validate_ingredients(self, ingredients):
+        """Проверяет все id ингредиентов одним запросом IN, ошибки
+        возвращаются для каждого элемента списка. Найденные ингредиенты
+        сохраняются, чтобы отрисовать ответ без повторных запросов."""
+        self.ingredient_objects = Ingredient.objects.in_bulk(
+            [ingredient['id'] for ingredient in ingredients])
+        errors = [
+            {} if ingredient['id'] in self.ingredient_objects else
+            {'id': [f'Ингредиент с id {ingredient["id"]} не найден.']}
+            for ingredient in ingredients
+        ]
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return ingredients
+
     def validate(self, object):
-        if not object.get('tags'):
+        """Проверяет рецепт. При частичном обновлении (PATCH)
+        проверяются только переданные поля."""
+        if not self.partial or 'tags' in object:
+            self.validate_tags_list(object.get('tags'))
+        if not self.partial or 'ingredients' in object:
+            self.validate_ingredients_list(object.get('ingredients'))
+        if not self.partial or 'cooking_time' in object:
+            self.validate_cooking_time_value(object.get('cooking_time'))
+        return object
+
+    @staticmethod
+    def validate_tags_list(tags):
+        if not tags:
             raise serializers.ValidationError(
                 'Должен быть указан хотя бы один тег.'
             )
-        tags_len = len(object.get('tags'))
-        if tags_len == 0:
-            raise serializers.ValidationError(
-                'Нельзя создать рецепт без тегов.'
-            )
-        if not object.get('ingredients'):
+
+    @staticmethod
+    def validate_ingredients_list(ingredients):
+        if not ingredients:
             raise serializers.ValidationError(
                 'Должен быть указан хотя бы один ингредиент.'
             )
         ingredient_set = set()
-        for ingredient in object.get('ingredients'):
+        for ingredient in ingredients:
             ingredient_id = ingredient.get('id')
             if ingredient_id in ingredient_set:
                 raise serializers.ValidationError(
                     'Найден дубликат ингредиента.'
                 )
             ingredient_set.add(ingredient_id)
-        if not object.get('cooking_time'):
+
+    @staticmethod
+    def validate_cooking_time_value(cooking_time):
+        if not cooking_time:
             raise serializers.ValidationError(
                 'Укажите время приготовления.')
-        if object['cooking_time'] <= 0:
+        if cooking_time <= 0:
             raise serializers.ValidationError({
                 'Время приготовления не может быть отрицательным.'
             })
-        return object
 
     def many_to_many_tag_ingredients(self, recipe, tags, ingredients):
-        recipe.tags.set(tags)
-        RecipeIngredientAmount.objects.bulk_create(
+        """Записывает связи нового рецепта с тегами и ингредиентами
+        и заполняет ими кеш prefetch_related рецепта."""
+        recipe.tags_mask = get_tags_mask(tags)
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe=recipe, tag=tag) for tag in tags)
+        amounts = RecipeIngredientAmount.objects.bulk_create(
             [RecipeIngredientAmount(
                 recipe=recipe,
-                ingredient_id=ingredient['id'],
+                ingredient=self.ingredient_objects[ingredient['id']],
                 amount=ingredient['amount']
             ) for ingredient in ingredients]
         )
+        set_prefetched_objects(
+            recipe, 'tags', sorted(tags, key=lambda tag: tag.name))
+        set_prefetched_objects(
+            recipe, 'ingredienttorecipe', list(reversed(amounts)))
+
+    def save(self, **kwargs):
+        """Закрывает временный файл изображения после сохранения:
+        хранилище перемещает его, и без явного закрытия удаление
+        уже перемещённого файла завершается ошибкой при сборке мусора."""
+        try:
+            return super().save(**kwargs)
+        finally:
+            image = self.validated_data.get('image')
+            if image is not None:
+                image.close()
 
     def create(self, validated_data):
-        """Создает новый объект рецепта."""
+        """Создает новый объект рецепта в одной транзакции. Маска тегов
+        записывается вместе с рецептом, а ответ строится по объектам
+        в памяти, без повторного чтения рецепта."""
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
         author = self.context.get('request').user
-        recipe = Recipe.objects.create(author=author, **validated_data)
-        self.many_to_many_tag_ingredients(recipe, tags, ingredients)
+        with transaction.atomic():
+            recipe = Recipe.objects.create(
+                author=author,
+                tags_mask=get_tags_mask(tags),
+                **validated_data,
+            )
+            self.many_to_many_tag_ingredients(recipe, tags, ingredients)
+        recipe.is_favorited = False
+        recipe.is_in_shopping_cart = False
         return recipe
 
     def update(self, instance, validated_data):
-        """Обновляет объект рецепта."""
-        tags = validated_data.pop('tags')
-        RecipeIngredientAmount.objects.filter(recipe=instance).delete()
-        ingredients = validated_data.pop('ingredients')
-        self.many_to_many_tag_ingredients(instance, tags, ingredients)
-        return super().update(instance, validated_data)
+        """Обновляет объект рецепта в одной транзакции. Теги
+        и ингредиенты сравниваются с сохранёнными, и в базу пишутся
+        только изменения. Если коллекция не передана (PATCH),
+        она не изменяется."""
+        tags = validated_data.pop('tags', None)
+        ingredients = validated_data.pop('ingredients', None)
+        if 'image' in validated_data:
+            instance.image_variants_ready = False
+        with transaction.atomic():
+            if tags is not None:
+                self.update_tags(instance, tags)
+            if ingredients is not None:
+                self.update_ingredients(instance, ingredients)
+            return super().update(instance, validated_data)
+
+    @staticmethod
+    def update_tags(recipe, tags):
+        """tags.set сам добавляет и удаляет только отличающиеся связи."""
+        recipe.tags.set(tags)
+        if get_tags_mask(tags) != recipe.tags_mask:
+            Recipe.objects.set_tags_mask(recipe, tags)
+
+    @staticmethod
+    def update_ingredients(recipe, ingredients):
+        stored = {
+            ingredient_id: (pk, amount)
+            for pk, ingredient_id, amount
+            in RecipeIngredientAmount.objects.filter(
+                recipe=recipe).values_list('pk', 'ingredient_id', 'amount')
+        }
+        new_amounts = {
+            ingredient['id']: ingredient['amount']
+            for ingredient in ingredients
+        }
+        removed = [
+            pk for ingredient_id, (pk, amount) in stored.items()
+            if ingredient_id not in new_amounts
+        ]
+        if removed:
+            RecipeIngredientAmount.objects.filter(pk__in=removed).delete()
+        changed = [
+            RecipeIngredientAmount(pk=stored[ingredient_id][0], amount=amount)
+            for ingredient_id, amount in new_amounts.items()
+            if ingredient_id in stored and stored[ingredient_id][1] != amount
+        ]
+        if changed:
+            RecipeIngredientAmount.objects.bulk_update(changed, ['amount'])
+        added = [
+            RecipeIngredientAmount(
+                recipe=recipe, ingredient_id=ingredient_id, amount=amount)
+            for ingredient_id, amount in new_amounts.items()
+            if ingredient_id not in stored
+        ]
+        if added:
+            RecipeIngredientAmount.objects.bulk_create(added)
+        ShoppingCartIngredient.objects.apply_recipe_change(
+            recipe,
+            {ingredient_id: amount
+             for ingredient_id, (pk, amount) in stored.items()},
+            new_amounts,
+        )
 
     def to_representation(self, instance):
-        return GetRecipeSerializer(instance, context={
-            'request': self.context.get('request')
-        }).data
+        return GetRecipeSerializer(instance, context=self.context).data
 
 
 class ShoppingCartSerializer(serializers.ModelSerializer):
@@ -0,0 +1,251 @@
+"""Потоковая выгрузка списка покупок в форматах txt, csv и pdf.
+
+Каждая функция принимает итератор строк агрегированного запроса
+с ключами ingredient__name, ingredient__measurement_unit и quantity
+и возвращает генератор фрагментов файла, поэтому документ никогда
+не собирается в памяти целиком.
+"""
+import csv
+from itertools import chain
+
+from core.fonts import FontError, load_font
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+TITLE = 'Купить:'
+
+
+def format_line(ingredient):
+    return (
+        f"{ingredient['ingredient__name']} "
+        f"({ingredient['ingredient__measurement_unit']}) - "
+        f"{ingredient['quantity']}"
+    )
+
+
+def render_txt(ingredients):
+    yield TITLE
+    for ingredient in ingredients:
+        yield '\n' + format_line(ingredient)
+
+
+class Echo:
+    """Псевдо-буфер для csv.writer: возвращает записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def render_csv(ingredients):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('Ингредиент', 'Единица измерения', 'Количество'))
+    for ingredient in ingredients:
+        yield writer.writerow((
+            ingredient['ingredient__name'],
+            ingredient['ingredient__measurement_unit'],
+            ingredient['quantity'],
+        ))
+
+
+class PdfWriter:
+    """Минимальный генератор PDF, который выводит документ постранично.
+
+    Текст выводится встроенным шрифтом TrueType с Unicode-таблицей
+    (составной шрифт Type0 с кодировкой Identity-H): строки записываются
+    номерами глифов, а таблица ToUnicode позволяет копировать и искать
+    текст. Объекты /Pages, ширины глифов и ToUnicode пишутся последними:
+    к этому моменту известны все страницы и использованные глифы.
+    """
+    PAGE_WIDTH = 595
+    PAGE_HEIGHT = 842
+    MARGIN = 50
+    FONT_SIZE = 12
+    LEADING = 16
+    LINES_PER_PAGE = (PAGE_HEIGHT - 2 * MARGIN) // LEADING
+    # Записей в одном блоке beginbfchar, больше не допускает формат CMap.
+    CMAP_BLOCK = 100
+
+    CATALOG = 1
+    PAGES = 2
+    FONT = 3
+    CID_FONT = 4
+    DESCRIPTOR = 5
+    FONT_FILE = 6
+    TO_UNICODE = 7
+
+    def __init__(self, font):
+        self.font = font
+        self.offsets = {}
+        self.position = 0
+        self.next_number = self.TO_UNICODE + 1
+        self.page_numbers = []
+        self.used_glyphs = {}
+
+    def emit(self, data):
+        self.position += len(data)
+        return data
+
+    def write_object(self, number, body):
+        self.offsets[number] = self.position
+        return self.emit(
+            b'%d 0 obj\n' % number + body + b'\nendobj\n'
+        )
+
+    def write_stream(self, number, content, dictionary=b''):
+        return self.write_object(
+            number,
+            b'<< /Length %d%s >>\nstream\n' % (len(content), dictionary)
+            + content + b'\nendstream',
+        )
+
+    def reserve(self):
+        number = self.next_number
+        self.next_number += 1
+        return number
+
+    def encode(self, text):
+        """Строка номеров глифов для Identity-H. Символы, которых нет
+        в шрифте, выводятся глифом .notdef."""
+        glyphs = []
+        for char in text:
+            glyph = self.font.glyphs.get(char, 0)
+            if glyph:
+                self.used_glyphs.setdefault(glyph, char)
+            glyphs.append(b'%04X' % glyph)
+        return b''.join(glyphs)
+
+    def write_page(self, lines):
+        content = b'BT /F1 %d Tf %d TL %d %d Td\n' % (
+            self.FONT_SIZE, self.LEADING,
+            self.MARGIN, self.PAGE_HEIGHT - self.MARGIN,
+        )
+        content += b''.join(
+            b'<' + self.encode(line) + b'> Tj T*\n' for line in lines
+        )
+        content += b'ET'
+        content_number = self.reserve()
+        page_number = self.reserve()
+        self.page_numbers.append(page_number)
+        yield self.write_stream(content_number, content)
+        yield self.write_object(
+            page_number,
+            b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] '
+            b'/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>'
+            % (self.PAGES, self.PAGE_WIDTH, self.PAGE_HEIGHT,
+               self.FONT, content_number),
+        )
+
+    def write_font_file(self):
+        font = self.font
+        yield self.write_stream(
+            self.FONT_FILE, font.compressed,
+            b' /Length1 %d /Filter /FlateDecode' % len(font.data),
+        )
+        yield self.write_object(
+            self.DESCRIPTOR,
+            b'<< /Type /FontDescriptor /FontName /%s /Flags 32 '
+            b'/FontBBox [%d %d %d %d] /ItalicAngle 0 /Ascent %d '
+            b'/Descent %d /CapHeight %d /StemV 80 /FontFile2 %d 0 R >>'
+            % (font.name.encode('ascii'), *font.bbox, font.ascent,
+               font.descent, font.ascent, self.FONT_FILE),
+        )
+
+    def to_unicode(self):
+        glyphs = sorted(self.used_glyphs.items())
+        blocks = []
+        for start in range(0, len(glyphs), self.CMAP_BLOCK):
+            block = glyphs[start:start + self.CMAP_BLOCK]
+            blocks.append(b'%d beginbfchar\n' % len(block) + b''.join(
+                b'<%04X> <%s>\n' % (
+                    glyph, char.encode('utf-16-be').hex().upper().encode())
+                for glyph, char in block
+            ) + b'endbfchar\n')
+        return (
+            b'/CIDInit /ProcSet findresource begin\n'
+            b'12 dict begin\nbegincmap\n'
+            b'/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) '
+            b'/Supplement 0 >> def\n'
+            b'/CMapName /Adobe-Identity-UCS def\n/CMapType 2 def\n'
+            b'1 begincodespacerange\n<0000> <FFFF>\nendcodespacerange\n'
+            + b''.join(blocks)
+            + b'endcmap\nCMapName currentdict /CMap defineresource pop\n'
+            b'end\nend'
+        )
+
+    def write_font(self):
+        font = self.font
+        name = font.name.encode('ascii')
+        widths = b' '.join(
+            b'%d [%d]' % (glyph, font.width(glyph))
+            for glyph in sorted(self.used_glyphs)
+        )
+        yield self.write_object(
+            self.CID_FONT,
+            b'<< /Type /Font /Subtype /CIDFontType2 /BaseFont /%s '
+            b'/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) '
+            b'/Supplement 0 >> /FontDescriptor %d 0 R /DW %d '
+            b'/W [%s] /CIDToGIDMap /Identity >>'
+            % (name, self.DESCRIPTOR, font.width(0), widths),
+        )
+        yield self.write_stream(self.TO_UNICODE, self.to_unicode())
+        yield self.write_object(
+            self.FONT,
+            b'<< /Type /Font /Subtype /Type0 /BaseFont /%s '
+            b'/Encoding /Identity-H /DescendantFonts [%d 0 R] '
+            b'/ToUnicode %d 0 R >>'
+            % (name, self.CID_FONT, self.TO_UNICODE),
+        )
+
+    def render(self, lines):
+        yield self.emit(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        yield self.write_object(
+            self.CATALOG, b'<< /Type /Catalog /Pages %d 0 R >>' % self.PAGES
+        )
+        yield from self.write_font_file()
+        page = []
+        for line in lines:
+            page.append(line)
+            if len(page) == self.LINES_PER_PAGE:
+                yield from self.write_page(page)
+                page = []
+        if page or not self.page_numbers:
+            yield from self.write_page(page)
+        yield from self.write_font()
+        kids = b' '.join(b'%d 0 R' % number for number in self.page_numbers)
+        yield self.write_object(
+            self.PAGES,
+            b'<< /Type /Pages /Kids [' + kids
+            + b'] /Count %d >>' % len(self.page_numbers),
+        )
+        xref = self.position
+        size = self.next_number
+        entries = [b'0000000000 65535 f \n']
+        entries.extend(
+            b'%010d 00000 n \n' % self.offsets[number]
+            for number in range(1, size)
+        )
+        yield self.emit(
+            b'xref\n0 %d\n' % size + b''.join(entries)
+            + b'trailer\n<< /Size %d /Root %d 0 R >>\n' % (size, self.CATALOG)
+            + b'startxref\n%d\n%%%%EOF\n' % xref
+        )
+
+
+def render_pdf(ingredients):
+    """Шрифт читается до начала выгрузки: если файла шрифта нет,
+    ошибка возникает до отправки заголовков ответа."""
+    try:
+        font = load_font(settings.SHOPPING_LIST_FONT)
+    except (OSError, FontError) as error:
+        raise ImproperlyConfigured(
+            f'Не удалось загрузить шрифт SHOPPING_LIST_FONT: {error}'
+        ) from error
+    lines = (format_line(ingredient) for ingredient in ingredients)
+    return PdfWriter(font).render(chain((TITLE, ), lines))
+
+
+FORMATS = {
+    'txt': ('text/plain; charset=utf-8', render_txt),
+    'csv': ('text/csv; charset=utf-8', render_csv),
+    'pdf': ('application/pdf', render_pdf),
+}
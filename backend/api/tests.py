@@ -0,0 +1,399 @@
+import base64
+import json
+import os
+import re
+import struct
+import tempfile
+import zlib
+
+from api.shopping_list import PdfWriter
+from core.fonts import load_font
+from django.core.cache import cache
+from django.test import TransactionTestCase, override_settings
+from recipe.models import (Ingredient, Recipe, RecipeIngredientAmount,
+                           ShoppingCartIngredient, Tag)
+from rest_framework.test import APIClient
+from users.models import User
+
+
+def create_recipe(author, tags=(), name='Рецепт', **kwargs):
+    recipe = Recipe.objects.create(
+        author=author, name=name, text='Описание', cooking_time=10,
+        **kwargs)
+    recipe.tags.set(tags)
+    Recipe.objects.set_tags_mask(recipe, tags)
+    return recipe
+
+
+class APITestCase(TransactionTestCase):
+    """Сброс поколений кеша выполняется после фиксации транзакции,
+    поэтому тесты выполняются без общей транзакции."""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='password', first_name='Иван', last_name='Петров')
+        self.user = User.objects.create_user(
+            username='user', email='user@example.com', password='password')
+        self.tag = Tag.objects.create(
+            name='Завтрак', color='#E26C2D', slug='breakfast')
+        self.ingredient = Ingredient.objects.create(
+            name='Мука', measurement_unit='г')
+        self.recipe = create_recipe(self.author, [self.tag])
+        RecipeIngredientAmount.objects.create(
+            recipe=self.recipe, ingredient=self.ingredient, amount=100)
+        self.anonymous = APIClient()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+
+class RecipeListVersionTests(APITestCase):
+    url = '/api/recipes/'
+
+    def revalidate(self):
+        etag = self.anonymous.get(self.url)['ETag']
+        return self.anonymous.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_not_modified(self):
+        self.assertEqual(self.revalidate().status_code, 304)
+
+    def test_favorite_changes_version(self):
+        etag = self.anonymous.get(self.url)['ETag']
+        response = self.client.post(f'{self.url}{self.recipe.pk}/favorite/')
+        self.assertEqual(response.status_code, 201)
+        response = self.anonymous.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['favorites_count'], 1)
+
+    def test_related_changes_change_version(self):
+        for change in (
+            lambda: User.objects.get(pk=self.author.pk).save(),
+            lambda: Tag.objects.get(pk=self.tag.pk).save(),
+            lambda: Ingredient.objects.get(pk=self.ingredient.pk).save(),
+        ):
+            with self.subTest(change=change):
+                etag = self.anonymous.get(self.url)['ETag']
+                change()
+                response = self.anonymous.get(
+                    self.url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+
+    def test_author_name_in_list(self):
+        etag = self.anonymous.get(self.url)['ETag']
+        self.author.first_name = 'Пётр'
+        self.author.save()
+        response = self.anonymous.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data['results'][0]['author']['first_name'], 'Пётр')
+
+
+class RecipeDetailVersionTests(APITestCase):
+
+    def test_author_change_changes_version(self):
+        url = f'/api/recipes/{self.recipe.pk}/'
+        etag = self.anonymous.get(url)['ETag']
+        self.assertEqual(
+            self.anonymous.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.author.last_name = 'Сидоров'
+        self.author.save()
+        response = self.anonymous.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['author']['last_name'], 'Сидоров')
+
+
+class RecipeCountTests(APITestCase):
+
+    def test_deleted_tag_count(self):
+        url = '/api/recipes/?tags=breakfast'
+        self.assertEqual(self.anonymous.get(url).data['count'], 1)
+        self.tag.delete()
+        Tag.objects.create(name='Завтрак', color='#E26C2D', slug='breakfast')
+        self.assertEqual(self.anonymous.get(url).data['count'], 0)
+
+
+class RecipeFilterTests(APITestCase):
+    url = '/api/recipes/'
+
+    def setUp(self):
+        super().setUp()
+        self.other = create_recipe(self.author, name='Другой рецепт')
+        self.client.post(f'{self.url}{self.recipe.pk}/favorite/')
+
+    def ids(self, client, query):
+        response = client.get(self.url, query)
+        self.assertEqual(response.status_code, 200)
+        return {recipe['id'] for recipe in response.data['results']}
+
+    def test_is_favorited(self):
+        self.assertEqual(
+            self.ids(self.client, {'is_favorited': 1}), {self.recipe.pk})
+
+    def test_is_favorited_false(self):
+        self.assertEqual(
+            self.ids(self.client, {'is_favorited': 0}),
+            {self.recipe.pk, self.other.pk})
+
+    def test_is_favorited_anonymous(self):
+        self.assertEqual(
+            self.ids(self.anonymous, {'is_favorited': 1}),
+            {self.recipe.pk, self.other.pk})
+
+
+class RecipeCursorTests(APITestCase):
+    url = '/api/recipes/'
+
+    def setUp(self):
+        super().setUp()
+        for number in range(3):
+            create_recipe(self.author, name=f'Рецепт {number}')
+
+    def get(self, position):
+        cursor = base64.urlsafe_b64encode(json.dumps(position).encode())
+        return self.anonymous.get(
+            self.url, {'cursor': cursor.decode(), 'limit': 2})
+
+    def test_pages(self):
+        response = self.anonymous.get(self.url, {'cursor': '', 'limit': 2})
+        self.assertEqual(len(response.data['results']), 2)
+        seen = [recipe['id'] for recipe in response.data['results']]
+        response = self.anonymous.get(response.data['next'])
+        self.assertEqual(response.status_code, 200)
+        seen += [recipe['id'] for recipe in response.data['results']]
+        self.assertEqual(
+            sorted(seen), sorted(Recipe.objects.values_list('pk', flat=True)))
+        self.assertIsNone(response.data['next'])
+
+    def test_invalid_values(self):
+        for position in (
+            ['2020-01-01T00:00:00+00:00', 10 ** 30],
+            ['2020-13-01T00:00:00+00:00', 1],
+            ['не дата', 1],
+            ['2020-01-01T00:00:00+00:00', 'id'],
+            ['2020-01-01T00:00:00+00:00', None],
+            [{}, 1],
+            ['2020-01-01T00:00:00+00:00'],
+        ):
+            with self.subTest(position=position):
+                self.assertEqual(self.get(position).status_code, 404)
+
+    def test_valid_position(self):
+        response = self.get(['2999-01-01T00:00:00+00:00', 10 ** 9])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 2)
+
+
+class TagSerializerTests(APITestCase):
+
+    def test_internal_fields_hidden(self):
+        for response in (
+            self.anonymous.get('/api/tags/').data[0],
+            self.anonymous.get(f'/api/tags/{self.tag.pk}/').data,
+            self.anonymous.get(
+                f'/api/recipes/{self.recipe.pk}/').data['tags'][0],
+        ):
+            with self.subTest(response=response):
+                self.assertEqual(
+                    set(response), {'id', 'name', 'color', 'slug'})
+
+
+def truetype_font(chars):
+    """Минимальный шрифт TrueType с глифом на каждый символ chars:
+    только таблицы, которые читает core.fonts. Глиф n имеет
+    ширину 500 + n."""
+    codes = sorted(set(map(ord, chars)))
+    count = len(codes) + 1
+    head = (
+        struct.pack('>IIIIHH', 0x00010000, 0, 0, 0x5F0F3CF5, 0, 2000)
+        + bytes(16) + struct.pack('>hhhh', 0, -400, 2000, 1600) + bytes(10)
+    )
+    hhea = (
+        struct.pack('>Ihh', 0x00010000, 1600, -400)
+        + bytes(26) + struct.pack('>H', count)
+    )
+    hmtx = b''.join(
+        struct.pack('>Hh', 2 * (500 + glyph), 0) for glyph in range(count))
+    ends = codes + [0xFFFF]
+    deltas = [(glyph - code) % 0x10000
+              for glyph, code in enumerate(codes, 1)] + [1]
+    segments = len(ends)
+    subtable = struct.pack(
+        f'>4H{segments}HH{segments}H{segments}H{segments}H',
+        2 * segments, 0, 0, 0, *ends, 0, *ends, *deltas, *[0] * segments)
+    subtable = struct.pack('>HHH', 4, 6 + len(subtable), 0) + subtable
+    cmap = struct.pack('>HHHHI', 0, 1, 3, 1, 12) + subtable
+    tables = {'cmap': cmap, 'head': head, 'hhea': hhea, 'hmtx': hmtx}
+    offset = 12 + 16 * len(tables)
+    directory = struct.pack('>IHHHH', 0x00010000, len(tables), 0, 0, 0)
+    data = b''
+    for tag, table in tables.items():
+        directory += struct.pack(
+            '>4sIII', tag.encode(), 0, offset + len(data), len(table))
+        data += table
+    return directory + data
+
+
+def read_pdf(content):
+    """Объекты PDF по таблице xref; потоки распакованы."""
+    xref = int(content.rsplit(b'startxref\n', 1)[1].split()[0])
+    entries = content[xref:].split(b'\n')
+    size = int(entries[1].split()[1])
+    objects = {}
+    for number in range(1, size):
+        offset = int(entries[2 + number][:10])
+        header = b'%d 0 obj\n' % number
+        assert content.startswith(header, offset), number
+        start = offset + len(header)
+        stream = re.match(
+            rb'<< /Length (\d+)([^>]*) >>\nstream\n', content[start:])
+        if stream:
+            start += stream.end()
+            data = content[start:start + int(stream[1])]
+            if b'/FlateDecode' in stream[2]:
+                data = zlib.decompress(data)
+            objects[number] = data
+        else:
+            objects[number] = content[
+                start:content.index(b'\nendobj', start)]
+    return objects
+
+
+def pdf_pages(content):
+    """Строки текста каждой страницы, декодированные по ToUnicode."""
+    objects = read_pdf(content)
+    font = next(
+        body for body in objects.values() if b'/Subtype /Type0' in body)
+    to_unicode = objects[int(re.search(rb'/ToUnicode (\d+)', font)[1])]
+    chars = {
+        glyph: bytes.fromhex(text.decode()).decode('utf-16-be')
+        for glyph, text in re.findall(
+            rb'<([0-9A-F]{4})> <([0-9A-F]+)>', to_unicode)
+    }
+    root = int(re.search(rb'/Root (\d+)', content)[1])
+    pages = objects[int(re.search(rb'/Pages (\d+)', objects[root])[1])]
+    result = []
+    for page in re.findall(rb'(\d+) 0 R', pages):
+        contents = int(re.search(
+            rb'/Contents (\d+)', objects[int(page)])[1])
+        result.append([
+            ''.join(
+                chars[line[index:index + 4]]
+                for index in range(0, len(line), 4)
+            )
+            for line in re.findall(rb'<([0-9A-F]*)> Tj', objects[contents])
+        ])
+    return result
+
+
+class ShoppingListPdfTests(APITestCase):
+    url = '/api/recipes/download_shopping_cart/'
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.font_path = os.path.join(directory.name, 'Test.ttf')
+        self.font = truetype_font('Купить: Мука(г)-0123456789')
+        with open(self.font_path, 'wb') as file:
+            file.write(self.font)
+
+    def download(self):
+        self.client.post(f'/api/recipes/{self.recipe.pk}/shopping_cart/')
+        with override_settings(SHOPPING_LIST_FONT=self.font_path):
+            response = self.client.get(self.url, {'format': 'pdf'})
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_cyrillic_text(self):
+        self.assertEqual(
+            pdf_pages(self.download()), [['Купить:', 'Мука (г) - 100']])
+
+    def test_font_embedded(self):
+        objects = read_pdf(self.download())
+        self.assertEqual(objects[PdfWriter.FONT_FILE], self.font)
+        widths = re.search(
+            rb'/W \[(.*?)\] /CIDToGIDMap', objects[PdfWriter.CID_FONT])
+        # Глиф «К» — первый из заглавных букв, ширина 500 + номер глифа.
+        glyph = sorted(set('Купить: Мука(г)-0123456789')).index('К') + 1
+        self.assertIn(b'%d [%d]' % (glyph, 500 + glyph), widths[1])
+
+    def test_pages(self):
+        lines = [str(number) for number in range(100)]
+        content = b''.join(
+            PdfWriter(load_font(self.font_path)).render(lines))
+        pages = pdf_pages(content)
+        self.assertEqual(len(pages), -(-100 // PdfWriter.LINES_PER_PAGE))
+        self.assertEqual(sum(pages, []), lines)
+
+
+class IngredientSearchVersionTests(APITestCase):
+    url = '/api/ingredients/'
+
+    def test_ranking_change_changes_version(self):
+        query = {'name': 'му'}
+        response = self.anonymous.get(self.url, query)
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        self.assertEqual(self.anonymous.get(
+            self.url, query, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        recipe = create_recipe(self.author, name='Хлеб')
+        RecipeIngredientAmount.objects.create(
+            recipe=recipe, ingredient=self.ingredient, amount=500)
+        response = self.anonymous.get(self.url, query, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class RecipeUpdateTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.milk = Ingredient.objects.create(
+            name='Молоко', measurement_unit='мл')
+        self.author_client = APIClient()
+        self.author_client.force_authenticate(self.author)
+        self.client.post(f'/api/recipes/{self.recipe.pk}/shopping_cart/')
+
+    def update(self, amounts):
+        response = self.author_client.patch(
+            f'/api/recipes/{self.recipe.pk}/',
+            {
+                'tags': [self.tag.pk],
+                'ingredients': [
+                    {'id': ingredient.pk, 'amount': amount}
+                    for ingredient, amount in amounts.items()
+                ],
+            },
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        return dict(
+            RecipeIngredientAmount.objects.filter(recipe=self.recipe)
+            .values_list('ingredient__name', 'pk'))
+
+    def totals(self):
+        return dict(
+            ShoppingCartIngredient.objects.filter(user=self.user)
+            .values_list('ingredient__name', 'amount'))
+
+    def test_only_changes_written(self):
+        before = self.update({self.ingredient: 100})
+        after = self.update({self.ingredient: 150, self.milk: 300})
+        self.assertEqual(after['Мука'], before['Мука'])
+        self.assertEqual(self.totals(), {'Мука': 150, 'Молоко': 300})
+        self.update({self.milk: 300})
+        self.assertEqual(self.totals(), {'Молоко': 300})
+
+
+class CatalogVersionTests(APITestCase):
+
+    def test_tags(self):
+        url = '/api/tags/'
+        etag = self.anonymous.get(url)['ETag']
+        self.assertEqual(
+            self.anonymous.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.tag.name = 'Обед'
+        self.tag.save()
+        response = self.anonymous.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]['name'], 'Обед')
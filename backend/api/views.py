@@ -1,23 +1,55 @@
+from api.conditional import (ConditionalGetMixin, catalog_version,
+                             make_etag, viewer_version)
 from api.filters import IngredientFilter, RecipeFilter
+from api.negotiation import IgnoreFormatContentNegotiation
 from api.pagination import RecipePagination
 from api.permissions import IsAuthorOrReadOnly
 from api.serializers import (CreateRecipeSerializer, FavoriteSerializer,
                              IngredientSerializer, ShoppingCartSerializer,
                              TagSerializer)
+from api.shopping_list import FORMATS
+from core.counts import (cached_count, cached_value, get_generation,
+                         normalize_params)
+from core.timing import ServerTimingMixin, timed
 from core.utils import check_and_delete_item
-from django.db.models import Sum
-from django.shortcuts import HttpResponse, get_object_or_404
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import BooleanField, Exists, F, Max, OuterRef, Value
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
-from recipe.models import (Favorite, Ingredient, Recipe,
-                           RecipeIngredientAmount, ShoppingCart, Tag)
+from recipe.models import (RECIPES_SCOPE, ROWS_SCOPE, Favorite, Ingredient,
+                           Recipe, ShoppingCart, ShoppingCartIngredient, Tag)
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import (IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
+from users.models import Follow
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class CatalogViewSetMixin(ConditionalGetMixin):
+    """Условные GET-запросы для справочников: версия списка
+    определяется версией всего справочника, версия записи —
+    временем её изменения."""
+
+    def get_list_version(self):
+        return catalog_version(self.get_queryset())
+
+    def get_object_version(self):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            updated = self.get_queryset().filter(**{
+                self.lookup_field: self.kwargs[lookup_url_kwarg]
+            }).values_list('updated', flat=True).first()
+        except (TypeError, ValueError):
+            return None
+        if updated is None:
+            return None
+        return make_etag(self.kwargs[lookup_url_kwarg], updated), updated
+
+
+class IngredientViewSet(ServerTimingMixin, CatalogViewSetMixin,
+                        viewsets.ReadOnlyModelViewSet):
     """Вьюсет для ингредиентов.
     Предоставляет возможность получения списка
     и детальной информации об ингредиентах."""
@@ -25,17 +57,29 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = IngredientSerializer
     permission_classes = (IsAuthenticatedOrReadOnly, )
     filter_backends = (IngredientFilter, )
-    search_fields = ('^name', )
+
+    def get_list_version(self):
+        """Порядок результатов поиска зависит и от того, в скольких
+        рецептах используется ингредиент, поэтому в версию поиска
+        входит поколение RECIPES_SCOPE, которое меняется при каждом
+        сохранении и удалении рецептов. Last-Modified для поиска
+        не отдаётся: время справочника не отражает изменение порядка."""
+        etag, last_modified = super().get_list_version()
+        if self.request.query_params.get(IngredientFilter.search_param):
+            return make_etag(etag, get_generation(RECIPES_SCOPE)), None
+        return etag, last_modified
 
 
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(ServerTimingMixin, CatalogViewSetMixin,
+                 viewsets.ModelViewSet):
     """Вьюсет для тегов."""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (IsAuthenticatedOrReadOnly, )
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ServerTimingMixin, ConditionalGetMixin,
+                    viewsets.ModelViewSet):
     """Вьюсет для модели Recipe. Предоставляет возможности просмотра,
     создания, изменения и удаления рецептов.
     Позволяет добавлять/удалять рецепты из избранного
@@ -49,6 +93,7 @@ class RecipeViewSet(viewsets.ModelViewSet):
     filterset_fields = ('tags',)
     permission_classes = (IsAuthorOrReadOnly, )
     pagination_class.page_size = 6
+    vary_on_user = True
 
     def get_serializer_class(self):
         if self.action == 'favorite' or self.action == 'shopping_cart':
@@ -56,60 +101,131 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return CreateRecipeSerializer
 
     def get_queryset(self):
-        queryset = Recipe.objects.all()
-        author = self.request.user
-        if self.request.GET.get('is_favorited'):
-            favorite_recipes_ids = Favorite.objects.filter(
-                user=author).values('recipe_id')
-
-            return queryset.filter(pk__in=favorite_recipes_ids)
-
-        if self.request.GET.get('is_in_shopping_cart'):
-            cart_recipes_ids = ShoppingCart.objects.filter(
-                user=author).values('recipe_id')
-            return queryset.filter(pk__in=cart_recipes_ids)
-        return queryset
+        """Фильтры по избранному и корзине применяет RecipeFilter."""
+        return Recipe.objects.with_related().annotate_user_flags(
+            self.request.user)
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context.update({'request': self.request})
         return context
 
+    def get_list_cache_key(self):
+        """Ключ кеша для сводных значений списка и поколения, при смене
+        которых они устаревают. Ключ — набор фильтров; фильтры
+        по избранному и корзине зависят ещё и от пользователя."""
+        params = self.request.query_params
+        scopes = [RECIPES_SCOPE]
+        user_id = None
+        if params.get('is_favorited') or params.get('is_in_shopping_cart'):
+            user_id = self.request.user.pk
+            scopes.append(f'user:{user_id}')
+        key = (
+            'recipes', user_id,
+            normalize_params(params, self.paginator.ignored_filter_params),
+        )
+        return key, scopes
+
+    def get_list_count(self, queryset):
+        """Количество рецептов для пагинатора из кеша."""
+        key, scopes = self.get_list_cache_key()
+        return cached_count(queryset, key, scopes)
+
+    def get_list_version(self):
+        """Версия страницы списка: время последнего изменения и количество
+        рецептов с учётом фильтров, а также состояние избранного, корзины
+        и подписок пользователя. Количество и время берутся из кеша
+        с теми же поколениями, что и у пагинатора, время — ещё и
+        с поколением ROWS_SCOPE, которое меняют счётчики рецептов.
+        При попадании в кеш запросы по выборке не выполняются.
+        Last-Modified отдаётся только анонимным пользователям:
+        изменение их отметок не меняет время рецептов. В режиме курсора
+        версия не считается: это потребовало бы того же прохода по всей
+        выборке, от которого курсор избавляет."""
+        if self.paginator.is_cursor_request(self.request):
+            return None
+        queryset = self.filter_queryset(self.get_queryset())
+        key, scopes = self.get_list_cache_key()
+        count, _ = cached_count(queryset, key, scopes)
+        last_modified = cached_value(
+            ('last_modified', key), [*scopes, ROWS_SCOPE],
+            lambda: queryset.using(DEFAULT_DB_ALIAS).aggregate(
+                last_modified=Max('updated'))['last_modified'],
+        )
+        user = self.request.user
+        return (
+            make_etag('recipes', count, last_modified, *viewer_version(user)),
+            last_modified if user.is_anonymous else None,
+        )
+
+    def get_object_version(self):
+        """Версия рецепта: время изменения и отметки пользователя
+        (в избранном, в корзине, подписка на автора), одним запросом."""
+        user = self.request.user
+        queryset = Recipe.objects.annotate_user_flags(user)
+        if user.is_anonymous:
+            is_subscribed = Value(False, output_field=BooleanField())
+        else:
+            is_subscribed = Exists(Follow.objects.filter(
+                user=user, following=OuterRef('author_id')))
+        try:
+            version = queryset.annotate(
+                is_subscribed=is_subscribed
+            ).filter(pk=self.kwargs['pk']).values_list(
+                'updated', 'is_favorited',
+                'is_in_shopping_cart', 'is_subscribed',
+            ).first()
+        except (TypeError, ValueError):
+            return None
+        if version is None:
+            return None
+        return (
+            make_etag('recipe', self.kwargs['pk'], *version),
+            version[0] if user.is_anonymous else None,
+        )
+
     @staticmethod
-    def send_file(ingredients):
-        """Выгружает ингредиенты из списка покупок в файл shopping_list.txt."""
-        shopping_list = 'Купить:'
-        for ingredient in ingredients:
-            shopping_list += (
-                f"\n{ingredient['ingredient__name']} "
-                f"({ingredient['ingredient__measurement_unit']}) - "
-                f"{ingredient['quantity']}")
-        file = 'shopping_list.txt'
-        response = HttpResponse(shopping_list, content_type='text/plain')
-        response['Content-Disposition'] = f'attachment; filename="{file}.txt"'
+    def send_file(ingredients, file_format):
+        """Отдаёт список покупок потоком в файле shopping_list.<формат>."""
+        content_type, render = FORMATS[file_format]
+        response = StreamingHttpResponse(
+            render(ingredients), content_type=content_type
+        )
+        file = f'shopping_list.{file_format}'
+        response['Content-Disposition'] = f'attachment; filename="{file}"'
         return response
 
     @action(
         methods=['get'],
         detail=False,
         permission_classes=(IsAuthenticated, ),
-        url_path='download_shopping_cart'
+        url_path='download_shopping_cart',
+        content_negotiation_class=IgnoreFormatContentNegotiation,
     )
     def download_shopping_cart(self, request):
         """Формирует список покупок из ингредиентов рецепта,
-        считает количество ингредиентов."""
+        считает количество ингредиентов.
+        Формат файла задаётся параметром format: txt (по умолчанию),
+        csv или pdf."""
         user = request.user
+        file_format = request.query_params.get('format', 'txt')
+        if file_format not in FORMATS:
+            return Response(
+                {'format': f'Допустимые форматы: {", ".join(FORMATS)}.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
         if not user.shopping_cart.exists():
             return Response(
                 'В вашей корзине нет рецептов.',
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        ingredients = RecipeIngredientAmount.objects.filter(
-            recipe__shopping_cart__user=user
+        ingredients = ShoppingCartIngredient.objects.filter(
+            user=user
         ).order_by('ingredient__name').values(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).annotate(quantity=Sum('amount'))
-        return self.send_file(ingredients)
+            'ingredient__name', 'ingredient__measurement_unit',
+            quantity=F('amount'),
+        )
+        return self.send_file(ingredients.iterator(), file_format)
 
     def add_or_delete_recipe(self,
                              request,
@@ -123,9 +239,9 @@ class RecipeViewSet(viewsets.ModelViewSet):
             'user': user.pk,
             'recipe': recipe.pk
         }
-        serializer = serializer_class(
+        serializer = timed(serializer_class(
             data=data, context=self.get_serializer_context()
-        )
+        ))
         item_list = model_class.objects.filter(user=user, recipe=recipe)
         if request.method == 'POST':
             if item_list.exists():
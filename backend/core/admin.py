@@ -0,0 +1,48 @@
+from core.utils import prefix_condition
+from django.db.models import Q
+
+# Наибольшее значение первичного ключа (integer в PostgreSQL).
+MAX_PK = 2 ** 31 - 1
+
+
+class IndexedSearchMixin:
+    """Поиск в списке объектов по началу строки вместо icontains
+    по всем полям.
+
+    Поля связанной модели (author__username) ищутся подзапросом по её
+    таблице. Число в строке поиска также ищется как id. Поиск не
+    учитывает регистр (istartswith): в PostgreSQL это условие
+    UPPER(поле::text) LIKE, для него миграции создают индексы
+    по выражению (recipe_recipe_name_upper_like,
+    users_user_username_upper_like, users_user_email_upper_like).
+    Если поле хранится в нормализованном виде, normalize_search_term
+    приводит строку к тому же виду, а normalized_search = True
+    включает условие prefix_condition, которое использует индекс поля.
+    """
+    normalized_search = False
+
+    def normalize_search_term(self, term):
+        return term
+
+    def search_condition(self, field, term):
+        if self.normalized_search:
+            return prefix_condition(field, term)
+        return Q(**{f'{field}__istartswith': term})
+
+    def get_search_results(self, request, queryset, search_term):
+        term = self.normalize_search_term(search_term.strip())
+        if not term:
+            return queryset, False
+        condition = Q()
+        if term.isdecimal() and int(term) <= MAX_PK:
+            condition = Q(pk=int(term))
+        for field in self.get_search_fields(request):
+            relation, _, related_field = field.rpartition('__')
+            if not relation:
+                condition |= self.search_condition(field, term)
+                continue
+            related_model = queryset.model._meta.get_field(
+                relation).related_model
+            condition |= Q(**{f'{relation}__in': related_model.objects.filter(
+                self.search_condition(related_field, term)).values('pk')})
+        return queryset.filter(condition), False
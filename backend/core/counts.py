@@ -0,0 +1,88 @@
+"""Кеш количества записей для постраничных ответов.
+
+Количество и другие сводные значения выборки хранятся в кеше Django
+под ключом, составленным из нормализованных параметров фильтрации
+и номеров поколений. Номер поколения увеличивается при записи данных,
+от которых зависит значение, и все ключи прежнего поколения перестают
+использоваться.
+"""
+import time
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+GENERATION_KEY = 'count:generation:{}'
+
+
+def get_generation(scope):
+    key = GENERATION_KEY.format(scope)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, time.time_ns(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generation(scope):
+    """Делает устаревшими все количества, зависящие от scope."""
+    key = GENERATION_KEY.format(scope)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def normalize_params(params, ignore=()):
+    """Параметры запроса в каноническом виде: порядок параметров
+    и повторяющихся значений не влияет на результат."""
+    return sorted(
+        (name, sorted(set(params.getlist(name))))
+        for name in params if name not in ignore
+    )
+
+
+def estimate_count(queryset):
+    """Оценка количества записей по плану запроса PostgreSQL.
+    Для других СУБД возвращает None."""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        return cursor.fetchone()[0][0]['Plan']['Plan Rows']
+
+
+def cached_value(key, scopes, compute):
+    """Значение compute() из кеша под ключом key в текущих
+    поколениях scopes. compute должна читать из основной базы:
+    значение из отстающей реплики осталось бы в кеше нового
+    поколения до истечения COUNT_CACHE_TIMEOUT."""
+    generations = [get_generation(scope) for scope in scopes]
+    cache_key = 'count:' + md5(
+        repr((key, generations)).encode()).hexdigest()
+    result = cache.get(cache_key)
+    if result is None:
+        # Значение хранится в кортеже, чтобы кешировался и None.
+        result = (compute(), )
+        cache.set(cache_key, result, settings.COUNT_CACHE_TIMEOUT)
+    return result[0]
+
+
+def cached_count(queryset, key, scopes):
+    """Возвращает пару (количество, точно ли оно посчитано).
+    Если оценка планировщика не меньше COUNT_ESTIMATE_THRESHOLD,
+    точный подсчёт не выполняется и отдаётся оценка."""
+    queryset = queryset.using(DEFAULT_DB_ALIAS)
+
+    def compute():
+        estimate = estimate_count(queryset)
+        if (
+            estimate is not None
+            and estimate >= settings.COUNT_ESTIMATE_THRESHOLD
+        ):
+            return estimate, False
+        return queryset.count(), True
+    return cached_value(key, scopes, compute)
@@ -0,0 +1,136 @@
+"""Чтение шрифта TrueType для встраивания в PDF.
+
+Из файла берутся только таблицы, нужные для вывода текста: cmap
+(соответствие символов глифам), hmtx (ширины глифов), head и hhea
+(размер кегельной площадки и метрики). Сам файл встраивается
+в документ целиком.
+"""
+import os
+import struct
+import zlib
+from functools import lru_cache
+
+
+class FontError(Exception):
+    """Файл не является поддерживаемым шрифтом TrueType."""
+
+
+class TrueTypeFont:
+    """Шрифт TrueType с метриками в единицах PDF (1/1000 кегля)."""
+
+    def __init__(self, data, name='Font'):
+        self.data = data
+        self.name = name
+        try:
+            self.tables = self.read_tables()
+            self.read_metrics()
+            self.glyphs = self.read_cmap()
+        except (KeyError, struct.error) as error:
+            raise FontError(f'Неверный файл шрифта: {error}') from error
+        self.compressed = zlib.compress(data)
+
+    def unpack(self, fmt, offset):
+        return struct.unpack_from('>' + fmt, self.data, offset)
+
+    def read_tables(self):
+        version, count = self.unpack('IH', 0)
+        if version not in (0x00010000, 0x74727565):
+            raise FontError('Поддерживаются только шрифты TrueType.')
+        tables = {}
+        for index in range(count):
+            tag, _, offset, length = self.unpack('4sIII', 12 + 16 * index)
+            tables[tag.decode('latin-1')] = offset
+        return tables
+
+    def scale(self, value):
+        return round(value * 1000 / self.units_per_em)
+
+    def read_metrics(self):
+        head = self.tables['head']
+        self.units_per_em, = self.unpack('H', head + 18)
+        self.bbox = [
+            self.scale(value) for value in self.unpack('hhhh', head + 36)
+        ]
+        hhea = self.tables['hhea']
+        ascent, descent = self.unpack('hh', hhea + 4)
+        self.ascent, self.descent = self.scale(ascent), self.scale(descent)
+        metrics_count, = self.unpack('H', hhea + 34)
+        hmtx = self.tables['hmtx']
+        self.widths = [
+            self.scale(self.unpack('H', hmtx + 4 * index)[0])
+            for index in range(metrics_count)
+        ]
+
+    def width(self, glyph):
+        """Ширина глифа; глифы после последней записи hmtx
+        имеют ширину последнего."""
+        return self.widths[min(glyph, len(self.widths) - 1)]
+
+    def read_cmap(self):
+        """Соответствие символов глифам из подтаблицы Unicode
+        формата 12 (все символы) или 4 (символы BMP)."""
+        cmap = self.tables['cmap']
+        _, count = self.unpack('HH', cmap)
+        subtables = {}
+        for index in range(count):
+            platform, encoding, offset = self.unpack(
+                'HHI', cmap + 4 + 8 * index)
+            subtables[platform, encoding] = cmap + offset
+        for key in ((3, 10), (0, 4), (3, 1), (0, 3)):
+            if key not in subtables:
+                continue
+            offset = subtables[key]
+            fmt, = self.unpack('H', offset)
+            if fmt == 12:
+                return self.read_cmap_12(offset)
+            if fmt == 4:
+                return self.read_cmap_4(offset)
+        raise FontError('В шрифте нет таблицы символов Unicode.')
+
+    def read_cmap_4(self, offset):
+        segments = self.unpack('H', offset + 6)[0] // 2
+        ends = offset + 14
+        starts = ends + 2 * segments + 2
+        deltas = starts + 2 * segments
+        range_offsets = deltas + 2 * segments
+        glyphs = {}
+        for index in range(segments):
+            end, = self.unpack('H', ends + 2 * index)
+            start, = self.unpack('H', starts + 2 * index)
+            delta, = self.unpack('H', deltas + 2 * index)
+            range_position = range_offsets + 2 * index
+            range_offset, = self.unpack('H', range_position)
+            for code in range(start, min(end, 0xFFFE) + 1):
+                if range_offset:
+                    glyph, = self.unpack(
+                        'H', range_position + range_offset
+                        + 2 * (code - start))
+                    if not glyph:
+                        continue
+                    glyph = (glyph + delta) & 0xFFFF
+                else:
+                    glyph = (code + delta) & 0xFFFF
+                if glyph:
+                    glyphs[chr(code)] = glyph
+        return glyphs
+
+    def read_cmap_12(self, offset):
+        count, = self.unpack('I', offset + 12)
+        glyphs = {}
+        for index in range(count):
+            start, end, glyph = self.unpack('III', offset + 16 + 12 * index)
+            for code in range(start, min(end, 0x10FFFF) + 1):
+                glyphs[chr(code)] = glyph + code - start
+        return glyphs
+
+
+@lru_cache(maxsize=4)
+def load_font(path):
+    """Шрифт из файла; прочитанный шрифт кешируется в процессе."""
+    with open(path, 'rb') as file:
+        data = file.read()
+    name = ''.join(
+        char for char in os.path.splitext(os.path.basename(path))[0]
+        if char.isascii() and char.isalnum()
+    )
+    return TrueTypeFont(data, name or 'Font')
@@ -0,0 +1,106 @@
+"""Уменьшенные копии изображений рецептов.
+
+Копии создаются вне потока запроса, в пуле процессов: функция
+generate_variants работает только с путями к файлам и не обращается
+к Django, поэтому её можно выполнять в отдельном процессе.
+"""
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from PIL import Image
+
+# Название копии: (максимальный размер стороны, формат Pillow).
+VARIANTS = {
+    'card': (480, 'JPEG'),
+    'card_webp': (480, 'WEBP'),
+    'detail': (1280, 'JPEG'),
+    'detail_webp': (1280, 'WEBP'),
+}
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp'}
+QUALITY = {'JPEG': 85, 'WEBP': 80}
+
+logger = logging.getLogger(__name__)
+_executor = None
+
+
+def variant_name(name, variant):
+    """Путь копии в хранилище: рядом с оригиналом, с суффиксом."""
+    size, image_format = VARIANTS[variant]
+    stem = os.path.splitext(name)[0]
+    return f'{stem}_{variant}.{EXTENSIONS[image_format]}'
+
+
+def generate_variants(source, targets):
+    """Создаёт копии изображения source. targets — список
+    (путь, максимальный размер, формат). Уже существующие копии
+    пропускаются, файлы записываются атомарно через os.replace."""
+    with Image.open(source) as image:
+        image.load()
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        for path, size, image_format in targets:
+            if os.path.exists(path):
+                continue
+            variant = image.copy()
+            variant.thumbnail((size, size), Image.LANCZOS)
+            temporary = f'{path}.tmp'
+            variant.save(
+                temporary, image_format, quality=QUALITY[image_format])
+            os.replace(temporary, path)
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.IMAGE_VARIANT_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+    return _executor
+
+
+def schedule_variants(image, on_done):
+    """Ставит в очередь создание копий изображения image (FieldFile).
+    on_done вызывается после успешного создания всех копий.
+    При IMAGE_VARIANT_WORKERS = 0 копии создаются сразу."""
+    name = image.name
+    targets = [
+        (image.storage.path(variant_name(name, variant)), size, image_format)
+        for variant, (size, image_format) in VARIANTS.items()
+    ]
+    source = image.storage.path(name)
+    if not settings.IMAGE_VARIANT_WORKERS:
+        generate_variants(source, targets)
+        on_done()
+        return
+
+    def callback(future):
+        error = future.exception()
+        if error is not None:
+            logger.error('Не удалось создать копии %s: %r', name, error)
+            return
+        # Обратный вызов выполняется в служебном потоке пула,
+        # у которого своё соединение с базой.
+        close_old_connections()
+        on_done()
+
+    get_executor().submit(
+        generate_variants, source, targets).add_done_callback(callback)
+
+
+def variant_urls(image, ready):
+    """Ссылки на копии изображения. Пока копии не готовы,
+    для всех размеров отдаётся оригинал."""
+    if not image:
+        return None
+    return {
+        variant: (
+            image.storage.url(variant_name(image.name, variant))
+            if ready else image.url
+        )
+        for variant in VARIANTS
+    }
@@ -0,0 +1,189 @@
+"""Профилирование отдельных запросов к API по просьбе сотрудника.
+
+Запрос профилируется, если в нём есть заголовок X-Profile или параметр
+profile, а пользователь — сотрудник (is_staff), вошедший по сессии или
+по токену DRF. Для остальных пользователей флаг ничего не меняет.
+
+Запрос выполняется под cProfile, а tracemalloc сравнивает снимки
+памяти до и после. Отчёт — дерево вызовов по суммарному времени
+и самые большие выделения памяти. Если задан PROFILING_DIR, отчёт
+и файл .prof для snakeviz сохраняются туда, а в ответ добавляется
+заголовок X-Profile-Report с именем отчёта; иначе вместо ответа
+отдаётся файл отчёта.
+
+Одновременно профилируется только один запрос: tracemalloc
+учитывает память всего процесса. Не больше PROFILING_RATE_LIMIT
+запросов в минуту, размер отчёта и файла .prof не больше
+PROFILING_MAX_BYTES, в каталоге хранится не больше
+PROFILING_MAX_FILES отчётов.
+Если профилирование сейчас невозможно, запрос выполняется как
+обычно, а в ответ добавляется заголовок X-Profile: skipped.
+"""
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+RATE_KEY = 'profiling:{}'
+TRACEMALLOC_FRAMES = 10
+
+_lock = threading.Lock()
+
+
+def get_staff_user(request):
+    """Сотрудник, отправивший запрос, или None. Аутентификация DRF
+    выполняется только для запросов с флагом профилирования."""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user if user.is_staff else None
+    drf_request = Request(request)
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        try:
+            result = authentication_class().authenticate(drf_request)
+        except exceptions.APIException:
+            return None
+        if result is not None:
+            return result[0] if result[0].is_staff else None
+    return None
+
+
+def allow_by_rate():
+    key = RATE_KEY.format(int(time.time() // 60))
+    cache.add(key, 0, 60)
+    try:
+        return cache.incr(key) <= settings.PROFILING_RATE_LIMIT
+    except ValueError:
+        return False
+
+
+def build_report(request, response, profiler, memory, duration):
+    stream = io.StringIO()
+    stream.write(
+        f'{request.method} {request.get_full_path()}\n'
+        f'Статус {response.status_code}, {duration * 1000:.1f} мс, '
+        f'{timezone.now().isoformat()}\n\n'
+    )
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE)
+    stats.print_stats(settings.PROFILING_TOP)
+    stats.print_callees(settings.PROFILING_TOP)
+    stream.write('Выделения памяти, по строкам кода:\n')
+    for difference in memory[:settings.PROFILING_TOP]:
+        stream.write(f'{difference}\n')
+    report = stream.getvalue().encode()
+    limit = settings.PROFILING_MAX_BYTES
+    if len(report) > limit:
+        marker = '\n[отчёт обрезан]\n'.encode()
+        report = report[:limit - len(marker)] + marker
+    return report
+
+
+def save_report(report, profiler):
+    """Сохраняет отчёт и статистику .prof в PROFILING_DIR, удаляя
+    самые старые отчёты сверх PROFILING_MAX_FILES. Статистика больше
+    PROFILING_MAX_BYTES не сохраняется, об этом пишется в отчёте."""
+    directory = settings.PROFILING_DIR
+    os.makedirs(directory, exist_ok=True)
+    name = timezone.now().strftime('%Y%m%d-%H%M%S-%f')
+    profiler.create_stats()
+    stats = marshal.dumps(profiler.stats)
+    limit = settings.PROFILING_MAX_BYTES
+    if len(stats) > limit:
+        note = (
+            f'\n[файл .prof не сохранён: {len(stats)} байт '
+            f'больше PROFILING_MAX_BYTES]\n'
+        ).encode()
+        report = report[:max(limit - len(note), 0)] + note
+    else:
+        with open(os.path.join(directory, f'{name}.prof'), 'wb') as file:
+            file.write(stats)
+    with open(os.path.join(directory, f'{name}.txt'), 'wb') as file:
+        file.write(report)
+    reports = sorted(
+        entry for entry in os.listdir(directory) if entry.endswith('.txt'))
+    for old in reports[:-settings.PROFILING_MAX_FILES]:
+        stem = os.path.splitext(old)[0]
+        for extension in ('.txt', '.prof'):
+            path = os.path.join(directory, stem + extension)
+            if os.path.exists(path):
+                os.remove(path)
+    return f'{name}.txt'
+
+
+class ProfilingMiddleware:
+    """Профилирует запросы к API с флагом X-Profile или ?profile,
+    отправленные сотрудниками. Включается настройкой PROFILING."""
+    path_prefix = '/api/'
+    header = 'HTTP_X_PROFILE'
+    query_param = 'profile'
+
+    def __init__(self, get_response):
+        if not settings.PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def is_requested(self, request):
+        return request.path.startswith(self.path_prefix) and (
+            self.header in request.META
+            or self.query_param in request.GET
+        )
+
+    def __call__(self, request):
+        if not self.is_requested(request) or get_staff_user(request) is None:
+            return self.get_response(request)
+        if not _lock.acquire(blocking=False):
+            return self.skip(request)
+        try:
+            if not allow_by_rate():
+                return self.skip(request)
+            return self.profile(request)
+        finally:
+            _lock.release()
+
+    def skip(self, request):
+        response = self.get_response(request)
+        response['X-Profile'] = 'skipped'
+        return response
+
+    def profile(self, request):
+        profiler = cProfile.Profile()
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        try:
+            before = tracemalloc.take_snapshot()
+            started = time.perf_counter()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            duration = time.perf_counter() - started
+            after = tracemalloc.take_snapshot()
+        finally:
+            if not tracing:
+                tracemalloc.stop()
+        memory = after.compare_to(before, 'lineno')
+        report = build_report(request, response, profiler, memory, duration)
+        if settings.PROFILING_DIR:
+            response['X-Profile-Report'] = save_report(report, profiler)
+            return response
+        response.close()
+        download = HttpResponse(
+            report, content_type='text/plain; charset=utf-8')
+        download['Content-Disposition'] = (
+            'attachment; filename="profile.txt"')
+        return download
@@ -0,0 +1,40 @@
+from time import perf_counter
+
+from django.db import connections
+
+
+class QueryTracker:
+    """Считает запросы к базе и время их выполнения.
+
+    Используется как контекстный менеджер: на время блока
+    подключается обёртка connection.execute_wrapper, поэтому
+    запросы учитываются и при DEBUG = False. С keep_queries=True
+    в queries сохраняются кортежи (sql, params, many, длительность),
+    many — признак executemany.
+    """
+
+    def __init__(self, using='default', keep_queries=False):
+        self.connection = connections[using]
+        self.count = 0
+        self.duration = 0.0
+        self.queries = [] if keep_queries else None
+        self._wrapper = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = perf_counter() - started
+            self.count += 1
+            self.duration += duration
+            if self.queries is not None:
+                self.queries.append((sql, params, many, duration))
+
+    def __enter__(self):
+        self._wrapper = self.connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
@@ -0,0 +1,155 @@
+"""Чтение из реплик базы данных.
+
+ReplicaMiddleware выбирает для безопасного (GET, HEAD, OPTIONS)
+запроса к API одну исправную реплику из DATABASE_REPLICAS, и все
+чтения этого запроса ReplicaRouter направляет в неё. Запись, а также
+всё, что выполняется вне таких запросов (админка, команды, фоновые
+задачи), идёт в основную базу.
+
+После изменяющего запроса клиент REPLICA_STICKY_SECONDS секунд читает
+из основной базы, чтобы сразу видеть свои изменения, пока реплика
+их догоняет. Клиент определяется по хешу заголовка Authorization
+или cookie сессии, отметка хранится в кеше Django. Изменяющий запрос
+и следующее чтение могут попасть в разные процессы, поэтому
+с репликами нужен общий кеш (CACHE_BACKEND).
+
+Исправность реплики проверяется запросом SELECT 1 не чаще раза
+в REPLICA_CHECK_INTERVAL секунд. Неисправная реплика, а также
+реплика, на которой запрос завершился ошибкой соединения,
+исключается до следующей проверки; если исправных нет, чтение идёт
+в основную базу. Если ошибка соединения с репликой возникла во view,
+view выполняется повторно с чтением из основной базы. Ошибка вне view
+(при потоковой отдаче списка покупок, в других middleware) по-прежнему
+завершает запрос с кодом 500.
+"""
+import hashlib
+import logging
+import random
+import time
+from contextvars import ContextVar
+
+from core.utils import is_shared_cache
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.db import (DEFAULT_DB_ALIAS, DatabaseError, InterfaceError,
+                       OperationalError, connections)
+
+STICKY_KEY = 'replica:sticky:{}'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+logger = logging.getLogger(__name__)
+_read_alias = ContextVar('read_alias', default=None)
+# Псевдоним реплики: (исправна ли, время последней проверки).
+_health = {}
+
+
+def check_replica(alias):
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute('SELECT 1')
+        return True
+    except DatabaseError as error:
+        logger.warning('Реплика %s недоступна: %s', alias, error)
+        connections[alias].close()
+        return False
+
+
+def is_healthy(alias):
+    healthy, checked = _health.get(alias, (True, None))
+    now = time.monotonic()
+    if checked is None or now - checked >= settings.REPLICA_CHECK_INTERVAL:
+        healthy = check_replica(alias)
+        _health[alias] = (healthy, now)
+    return healthy
+
+
+def mark_unhealthy(alias):
+    _health[alias] = (False, time.monotonic())
+
+
+def choose_replica():
+    """Случайная исправная реплика или None."""
+    replicas = [
+        alias for alias in settings.DATABASE_REPLICAS if is_healthy(alias)
+    ]
+    return random.choice(replicas) if replicas else None
+
+
+def sticky_key(request):
+    credentials = (
+        request.META.get('HTTP_AUTHORIZATION')
+        or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    )
+    if not credentials:
+        return None
+    return STICKY_KEY.format(hashlib.sha256(credentials.encode()).hexdigest())
+
+
+class ReplicaRouter:
+    """Направляет чтение в реплику, выбранную ReplicaMiddleware
+    для текущего запроса, а запись — в основную базу. Реплики
+    содержат те же данные, поэтому связи между объектами из разных
+    баз разрешены, а миграции применяются только к основной."""
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaMiddleware:
+    """Выбирает базу для чтения на время запроса к API.
+    Без настроенных реплик исключается из цепочки."""
+    path_prefix = '/api/'
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        if not is_shared_cache():
+            raise ImproperlyConfigured(
+                'Для чтения из реплик (DB_REPLICAS) нужен общий для всех '
+                'процессов кеш: укажите CACHE_BACKEND, отличный '
+                'от LocMemCache и DummyCache.'
+            )
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not request.path.startswith(self.path_prefix):
+            return self.get_response(request)
+        key = sticky_key(request)
+        if request.method not in SAFE_METHODS:
+            response = self.get_response(request)
+            if key is not None:
+                cache.set(key, True, settings.REPLICA_STICKY_SECONDS)
+            return response
+        if key is not None and cache.get(key):
+            return self.get_response(request)
+        token = _read_alias.set(choose_replica())
+        try:
+            return self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+
+    def process_exception(self, request, exception):
+        """Исключает реплику после ошибки соединения и повторяет view
+        с чтением из основной базы."""
+        alias = _read_alias.get()
+        if not alias or not isinstance(
+            exception, (OperationalError, InterfaceError)
+        ):
+            return None
+        mark_unhealthy(alias)
+        logger.warning(
+            'Чтение %s повторяется в основной базе после ошибки реплики '
+            '%s: %s', request.path, alias, exception)
+        _read_alias.set(None)
+        match = request.resolver_match
+        return match.func(request, *match.args, **match.kwargs)
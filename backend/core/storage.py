@@ -0,0 +1,87 @@
+import fcntl
+import hashlib
+import os
+from contextlib import contextmanager
+from functools import partial
+
+from core.images import VARIANTS, variant_name
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+
+
+class HashedImageStorage(FileSystemStorage):
+    """Хранилище изображений рецептов, адресуемое по содержимому.
+
+    Файл сохраняется под именем <каталог>/<ab>/<sha256>.<расширение>,
+    где ab — первые два символа хеша. Если такой файл уже есть,
+    повторная запись пропускается, поэтому одинаковые загрузки хранятся
+    один раз. Содержимое файла по такому пути никогда не меняется,
+    и nginx может отдавать его с бессрочным кешированием.
+
+    Файл, на который больше не ссылаются рецепты, удаляет delete_unused.
+    Рецепт, сохраняющий то же изображение, может проверку ссылок
+    опередить, но зафиксироваться позже удаления, поэтому после
+    фиксации транзакции сохранения файл записывается заново, если его
+    уже нет. Проверка ссылок с удалением и эта запись выполняются под
+    общей блокировкой файла LOCK_NAME, поэтому не перемежаются.
+    """
+    CHUNK_SIZE = 64 * 1024
+    LOCK_NAME = '.hashed-storage.lock'
+
+    @contextmanager
+    def lock(self):
+        """Блокировка хранилища, общая для процессов на этом сервере."""
+        os.makedirs(self.location, exist_ok=True)
+        with open(os.path.join(self.location, self.LOCK_NAME), 'a') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks(self.CHUNK_SIZE):
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        directory = os.path.dirname(name)
+        ext = os.path.splitext(name)[1].lower()
+        return os.path.join(directory, digest[:2], digest + ext)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        content.seek(0)
+        transaction.on_commit(
+            partial(self.restore, name, ContentFile(content.read())))
+        content.seek(0)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
+
+    def restore(self, name, content):
+        """Записывает файл заново, если его удалили до фиксации
+        транзакции, сохранившей ссылку на него."""
+        with self.lock():
+            if not self.exists(name):
+                super().save(name, content)
+
+    def delete_unused(self, name, is_used):
+        """Удаляет файл, если is_used() — проверка ссылок на него
+        в базе — возвращает False."""
+        with self.lock():
+            if not is_used():
+                self.delete(name)
+
+    def delete(self, name):
+        """Удаляет изображение вместе с его уменьшенными копиями."""
+        for variant in VARIANTS:
+            super().delete(variant_name(name, variant))
+        super().delete(name)
@@ -0,0 +1,253 @@
+import base64
+import cProfile
+import os
+import pstats
+import struct
+import tempfile
+import time
+import zlib
+from unittest import skipUnless
+
+from core import replicas
+from core.profiling import save_report
+from core.storage import HashedImageStorage
+from core.utils import Base64ImageField
+from django.contrib.admin.sites import AdminSite
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.db import (DEFAULT_DB_ALIAS, OperationalError, connection,
+                       transaction)
+from django.test import (Client, RequestFactory, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.urls import ResolverMatch
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from users.admin import UserAdmin
+from users.models import User
+
+
+def png_header(width, height):
+    """Заголовок PNG с заданными размерами, без данных изображения."""
+    def chunk(kind, data):
+        return (
+            struct.pack('>I', len(data)) + kind + data
+            + struct.pack('>I', zlib.crc32(kind + data))
+        )
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IEND', b'')
+
+
+def data_uri(content):
+    return 'data:image/png;base64,' + base64.b64encode(content).decode()
+
+
+@override_settings(RECIPE_IMAGE_MAX_PIXELS=1000 * 1000)
+class Base64ImageFieldTests(SimpleTestCase):
+
+    def assert_too_many_pixels(self, width, height):
+        with self.assertRaises(ValidationError) as context:
+            Base64ImageField().to_internal_value(
+                data_uri(png_header(width, height)))
+        self.assertEqual(context.exception.detail[0].code, 'too_many_pixels')
+
+    def test_too_many_pixels(self):
+        self.assert_too_many_pixels(2000, 1000)
+
+    def test_decompression_bomb(self):
+        """Pillow не открывает такой заголовок, но ответ тот же."""
+        self.assert_too_many_pixels(20000, 10000)
+
+
+class IndexedSearchMixinTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='Ivan', email='Ivan@example.com', password='password')
+
+    def search(self, term):
+        queryset, _ = UserAdmin(User, AdminSite()).get_search_results(
+            None, User.objects.all(), term)
+        return list(queryset)
+
+    def test_case_insensitive(self):
+        self.assertEqual(self.search('iva'), [self.user])
+        self.assertEqual(self.search('IVAN@'), [self.user])
+
+    def test_id(self):
+        self.assertEqual(self.search(str(self.user.pk)), [self.user])
+
+    def test_not_an_id(self):
+        self.assertEqual(self.search('²'), [])
+        self.assertEqual(self.search('9' * 30), [])
+
+    @skipUnless(connection.vendor == 'postgresql', 'индексы PostgreSQL')
+    def test_uses_upper_indexes(self):
+        """Поиск по имени и почте идёт по индексам из миграции
+        users.0003_user_upper_indexes."""
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        queryset, _ = UserAdmin(User, AdminSite()).get_search_results(
+            None, User.objects.all(), 'iva')
+        plan = queryset.explain()
+        self.assertIn('users_user_username_upper_like', plan)
+        self.assertIn('users_user_email_upper_like', plan)
+
+
+class HashedImageStorageTests(TransactionTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = HashedImageStorage(location=directory.name)
+
+    def test_deduplicated(self):
+        first = self.storage.save('image/a.png', ContentFile(b'image'))
+        second = self.storage.save('image/b.png', ContentFile(b'image'))
+        self.assertEqual(first, second)
+        self.assertEqual(os.listdir(os.path.dirname(
+            self.storage.path(first))), [os.path.basename(first)])
+
+    def test_restored_after_concurrent_release(self):
+        """Файл удалён, пока транзакция, сославшаяся на него,
+        ещё не зафиксирована: после фиксации он записывается заново."""
+        name = self.storage.save('image/a.png', ContentFile(b'image'))
+        with transaction.atomic():
+            self.assertEqual(
+                self.storage.save('image/b.png', ContentFile(b'image')), name)
+            self.storage.delete_unused(name, lambda: False)
+            self.assertFalse(self.storage.exists(name))
+        with self.storage.open(name) as file:
+            self.assertEqual(file.read(), b'image')
+
+    def test_used_file_kept(self):
+        name = self.storage.save('image/a.png', ContentFile(b'image'))
+        self.storage.delete_unused(name, lambda: True)
+        self.assertTrue(self.storage.exists(name))
+        self.storage.delete_unused(name, lambda: False)
+        self.assertFalse(self.storage.exists(name))
+
+
+@override_settings(SERVER_TIMING=True, SLOW_REQUEST_MS=0)
+class ServerTimingTests(TestCase):
+
+    def test_phases(self):
+        data = serializers.Serializer.data
+        response = Client().get('/api/tags/')
+        self.assertEqual(response.status_code, 200)
+        phases = [
+            metric.split(';')[0]
+            for metric in response['Server-Timing'].split(', ')
+        ]
+        self.assertEqual(
+            phases, ['db', 'serialize', 'view', 'render', 'total'])
+        self.assertIs(serializers.Serializer.data, data)
+
+    def test_disabled(self):
+        with self.settings(SERVER_TIMING=False):
+            response = Client().get('/api/tags/')
+        self.assertNotIn('Server-Timing', response)
+
+
+class SaveReportTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.profiler = cProfile.Profile()
+        self.profiler.runcall(sorted, range(1000))
+
+    def save(self, limit):
+        with self.settings(
+            PROFILING_DIR=self.directory, PROFILING_MAX_BYTES=limit,
+            PROFILING_MAX_FILES=10,
+        ):
+            name = save_report(b'report', self.profiler)
+        with open(os.path.join(self.directory, name), 'rb') as file:
+            return os.path.splitext(name)[0], file.read()
+
+    def test_stats_saved(self):
+        stem, report = self.save(1024 * 1024)
+        self.assertEqual(report, b'report')
+        stats = pstats.Stats(os.path.join(self.directory, f'{stem}.prof'))
+        self.assertTrue(stats.total_calls)
+
+    def test_stats_over_limit(self):
+        stem, report = self.save(120)
+        self.assertLessEqual(len(report), 120)
+        self.assertIn('.prof'.encode(), report)
+        self.assertFalse(
+            os.path.exists(os.path.join(self.directory, f'{stem}.prof')))
+
+
+class ReplicaMiddlewareTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(
+            DATABASE_REPLICAS=['replica1'],
+            REPLICA_CHECK_INTERVAL=3600,
+            CACHES={'default': {
+                'BACKEND':
+                    'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': directory.name,
+            }},
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(replicas._health.clear)
+        replicas._health['replica1'] = (True, time.monotonic())
+        self.middleware = replicas.ReplicaMiddleware(self.view)
+        self.factory = RequestFactory(HTTP_AUTHORIZATION='Token key')
+
+    @staticmethod
+    def view(request):
+        """Вместо ответа возвращает базу, из которой читал бы view."""
+        return replicas.ReplicaRouter().db_for_read(User)
+
+    def test_safe_request_reads_replica(self):
+        self.assertEqual(
+            self.middleware(self.factory.get('/api/recipes/')), 'replica1')
+        self.assertEqual(replicas.ReplicaRouter().db_for_read(User),
+                         DEFAULT_DB_ALIAS)
+
+    def test_other_paths_read_primary(self):
+        self.assertEqual(
+            self.middleware(self.factory.get('/admin/')), DEFAULT_DB_ALIAS)
+
+    def test_sticky_after_write(self):
+        self.middleware(self.factory.post('/api/recipes/'))
+        self.assertEqual(
+            self.middleware(self.factory.get('/api/recipes/')),
+            DEFAULT_DB_ALIAS)
+        self.assertEqual(
+            self.middleware(RequestFactory().get('/api/recipes/')),
+            'replica1')
+
+    def test_unhealthy_replica(self):
+        replicas.mark_unhealthy('replica1')
+        self.assertEqual(
+            self.middleware(self.factory.get('/api/recipes/')),
+            DEFAULT_DB_ALIAS)
+
+    def test_retry_on_primary(self):
+        request = self.factory.get('/api/recipes/')
+        request.resolver_match = ResolverMatch(self.view, (), {})
+        token = replicas._read_alias.set('replica1')
+        try:
+            with self.assertLogs('core.replicas', 'WARNING'):
+                result = self.middleware.process_exception(
+                    request, OperationalError())
+        finally:
+            replicas._read_alias.reset(token)
+        self.assertEqual(result, DEFAULT_DB_ALIAS)
+        self.assertFalse(replicas.is_healthy('replica1'))
+
+    def test_requires_shared_cache(self):
+        with self.settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }}):
+            with self.assertRaises(ImproperlyConfigured):
+                replicas.ReplicaMiddleware(self.view)
@@ -0,0 +1,201 @@
+"""Заголовок Server-Timing и журнал медленных запросов к API.
+
+ServerTimingMiddleware включается настройкой SERVER_TIMING. Когда она
+выключена, Django исключает middleware из цепочки (MiddlewareNotUsed),
+а timed возвращает сериализатор без обёртки, поэтому накладных
+расходов нет.
+
+Фазы ответа в заголовке, в миллисекундах:
+db — выполнение SQL-запросов (desc — их количество);
+serialize — чтение data сериализаторов, обёрнутых timed: их создают
+get_serializer вьюсетов с ServerTimingMixin и сами view;
+view — работа view, включая db и serialize;
+render — отрисовка ответа DRF в JSON;
+total — весь запрос после этого middleware.
+Потоковые ответы (список покупок) отдаются уже после заголовков,
+поэтому их генерация в total не входит.
+"""
+import logging
+import re
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+from core.queries import QueryTracker
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+_phases = ContextVar('server_timing_phases', default=None)
+# Строковые константы в плане запроса: в них могут оказаться
+# значения параметров (ключ токена, email, хеш пароля).
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+
+
+@contextmanager
+def timing(name):
+    """Добавляет время выполнения блока к фазе name текущего
+    запроса. Вне запроса с Server-Timing ничего не делает."""
+    phases = _phases.get()
+    if phases is None:
+        yield
+        return
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        phases[name] = phases.get(name, 0) + perf_counter() - started
+
+
+class TimedSerializer:
+    """Обёртка сериализатора, которая относит чтение data к фазе
+    serialize. Остальные атрибуты читаются и записываются
+    у самого сериализатора."""
+
+    def __init__(self, serializer):
+        object.__setattr__(self, 'serializer', serializer)
+
+    @property
+    def data(self):
+        with timing('serialize'):
+            return self.serializer.data
+
+    def __getattr__(self, name):
+        return getattr(self.serializer, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.serializer, name, value)
+
+
+def timed(serializer):
+    """Сериализатор, чтение data которого входит в фазу serialize.
+    Вне запроса с Server-Timing возвращает сам сериализатор."""
+    if _phases.get() is None:
+        return serializer
+    return TimedSerializer(serializer)
+
+
+class ServerTimingMixin:
+    """Оборачивает сериализаторы вьюсета в timed."""
+
+    def get_serializer(self, *args, **kwargs):
+        return timed(super().get_serializer(*args, **kwargs))
+
+
+def view_name(view_func, method):
+    """Имя для журнала: ViewSet.action для вьюсетов DRF,
+    иначе имя класса или функции."""
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return getattr(view_func, '__qualname__', repr(view_func))
+    actions = getattr(view_func, 'actions', None) or {}
+    action = actions.get(method.lower())
+    return f'{view_class.__name__}.{action}' if action else view_class.__name__
+
+
+def explain(connection, sql, params):
+    """План запроса SELECT или текст ошибки, если его не удалось
+    получить. Строковые константы в плане заменяются на '?'."""
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'{connection.ops.explain_query_prefix()} {sql}', params)
+            plan = '\n'.join(
+                ' '.join(map(str, row)) for row in cursor.fetchall())
+    except DatabaseError as error:
+        # Текст ошибки СУБД тоже может содержать значения параметров.
+        return f'EXPLAIN не выполнен: {type(error).__name__}'
+    return STRING_LITERAL.sub("'?'", plan)
+
+
+class ServerTimingMiddleware:
+    """Измеряет запросы к API и отдаёт фазы в заголовке Server-Timing.
+
+    Если запрос выполнялся дольше SLOW_REQUEST_MS, в журнал core.timing
+    пишется предупреждение с именем действия (RecipeViewSet.list)
+    и SLOW_REQUEST_QUERIES самыми долгими SQL-запросами с их планами.
+    Значения параметров в журнал не пишутся: среди них бывают ключ
+    токена, email и хеш пароля.
+    """
+    path_prefix = '/api/'
+
+    def __init__(self, get_response):
+        if not settings.SERVER_TIMING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_request = settings.SLOW_REQUEST_MS / 1000
+
+    def __call__(self, request):
+        if not request.path.startswith(self.path_prefix):
+            return self.get_response(request)
+        phases = {}
+        token = _phases.set(phases)
+        try:
+            with ExitStack() as stack:
+                trackers = [
+                    stack.enter_context(QueryTracker(
+                        alias, keep_queries=bool(self.slow_request)))
+                    for alias in connections
+                ]
+                started = perf_counter()
+                response = self.get_response(request)
+        finally:
+            _phases.reset(token)
+        finished = perf_counter()
+        total = finished - started
+        view_started = getattr(request, '_timing_view_started', None)
+        view_finished = getattr(request, '_timing_view_finished', finished)
+        if view_started is not None:
+            phases['view'] = view_finished - view_started
+            if view_finished != finished:
+                phases['render'] = finished - view_finished
+        phases['total'] = total
+        self.set_header(response, phases, trackers)
+        if self.slow_request and total >= self.slow_request:
+            self.log_slow_request(request, phases, trackers)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._timing_view = view_name(view_func, request.method)
+        request._timing_view_started = perf_counter()
+
+    def process_template_response(self, request, response):
+        request._timing_view_finished = perf_counter()
+        return response
+
+    @staticmethod
+    def set_header(response, phases, trackers):
+        count = sum(tracker.count for tracker in trackers)
+        duration = sum(tracker.duration for tracker in trackers)
+        metrics = [f'db;dur={duration * 1000:.1f};desc="{count} queries"']
+        metrics.extend(
+            f'{name};dur={phases[name] * 1000:.1f}'
+            for name in ('serialize', 'view', 'render', 'total')
+            if name in phases
+        )
+        response['Server-Timing'] = ', '.join(metrics)
+
+    @staticmethod
+    def log_slow_request(request, phases, trackers):
+        queries = sorted(
+            (
+                (duration, tracker.connection, sql, params, many)
+                for tracker in trackers
+                for sql, params, many, duration in tracker.queries
+            ),
+            key=lambda query: query[0],
+            reverse=True,
+        )[:settings.SLOW_REQUEST_QUERIES]
+        lines = [
+            f'Медленный запрос {getattr(request, "_timing_view", "-")} '
+            f'{request.method} {request.get_full_path()}: '
+            f'{phases["total"] * 1000:.0f} мс, SQL-запросов '
+            f'{sum(tracker.count for tracker in trackers)}.'
+        ]
+        for duration, connection, sql, params, many in queries:
+            lines.append(
+                f'[{connection.alias}] {duration * 1000:.1f} мс: {sql}')
+            if not many and sql.lstrip().upper().startswith('SELECT'):
+                lines.append(explain(connection, sql, params))
+        logger.warning('\n'.join(lines))
@@ -1,19 +1,136 @@
 import base64
+import binascii
 
-from django.core.files.base import ContentFile
+from core.images import variant_urls
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db import connection
+from django.db.models import Q
+from PIL import Image
 from rest_framework import serializers, status
 from rest_framework.response import Response
 
 
 class Base64ImageField(serializers.ImageField):
+    """Изображение в виде data URI. Строка base64 декодируется частями
+    во временный файл на диске, размер файла и количество пикселей
+    ограничены настройками RECIPE_IMAGE_MAX_BYTES
+    и RECIPE_IMAGE_MAX_PIXELS."""
+    CHUNK_SIZE = 64 * 1024
+    default_error_messages = {
+        'invalid_base64': 'Изображение должно быть закодировано в base64.',
+        'too_large': (
+            'Размер изображения не должен превышать {max_bytes} байт.'
+        ),
+        'too_many_pixels': (
+            'Изображение не должно содержать больше {max_pixels} пикселей.'
+        ),
+    }
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
             format, imgstr = data.split(';base64,')
             ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            data = self.decode(imgstr, 'temp.' + ext, format[len('data:'):])
+            self.check_pixels(data)
 
         return super().to_internal_value(data)
 
+    def decode(self, imgstr, name, content_type):
+        max_bytes = settings.RECIPE_IMAGE_MAX_BYTES
+        if len(imgstr) // 4 * 3 > max_bytes + 2:
+            self.fail('too_large', max_bytes=max_bytes)
+        file = TemporaryUploadedFile(name, content_type, 0, None)
+        pending = ''
+        for start in range(0, len(imgstr), self.CHUNK_SIZE):
+            chunk = pending + ''.join(
+                imgstr[start:start + self.CHUNK_SIZE].split())
+            usable = len(chunk) - len(chunk) % 4
+            pending = chunk[usable:]
+            try:
+                file.write(base64.b64decode(chunk[:usable], validate=True))
+            except binascii.Error:
+                self.fail('invalid_base64')
+            if file.tell() > max_bytes:
+                self.fail('too_large', max_bytes=max_bytes)
+        if pending:
+            self.fail('invalid_base64')
+        file.size = file.tell()
+        file.seek(0)
+        return file
+
+    def check_pixels(self, file):
+        """Проверяет размеры по заголовку файла, не декодируя пиксели."""
+        max_pixels = settings.RECIPE_IMAGE_MAX_PIXELS
+        try:
+            with Image.open(file) as image:
+                width, height = image.size
+        except Image.DecompressionBombError:
+            # Pillow отказывается открывать файлы больше
+            # 2 * MAX_IMAGE_PIXELS пикселей, не сообщая размер.
+            self.fail('too_many_pixels', max_pixels=max_pixels)
+        except OSError:
+            return
+        finally:
+            file.seek(0)
+        if width * height > max_pixels:
+            self.fail('too_many_pixels', max_pixels=max_pixels)
+
+
+class ImageVariantsField(serializers.Field):
+    """Ссылки на уменьшенные копии изображения рецепта."""
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        urls = variant_urls(recipe.image, recipe.image_variants_ready)
+        request = self.context.get('request')
+        if urls is None or request is None:
+            return urls
+        return {
+            variant: request.build_absolute_uri(url)
+            for variant, url in urls.items()
+        }
+
+
+class PreserveCountersMixin:
+    """Не перезаписывает счётчики при сохранении существующей записи:
+    их изменяют только атомарные обновления через F(), и значение,
+    прочитанное вместе с записью, к моменту сохранения может устареть."""
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (
+            not args and not self._state.adding
+            and kwargs.get('update_fields') is None
+            and not kwargs.get('force_insert')
+        ):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+                and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+
+def set_prefetched_objects(instance, name, objects):
+    """Заполняет кеш prefetch_related связи name готовыми объектами,
+    как это делает prefetch_related_objects, но без запроса."""
+    queryset = getattr(instance, name).get_queryset()
+    queryset._result_cache = list(objects)
+    queryset._prefetch_done = True
+    if not hasattr(instance, '_prefetched_objects_cache'):
+        instance._prefetched_objects_cache = {}
+    instance._prefetched_objects_cache[name] = queryset
+
 
 def check_and_delete_item(user, recipe, model_class, error_message):
     """Проверка наличия и удаления элемента для избранного и списка покупок."""
@@ -24,3 +141,26 @@ def check_and_delete_item(user, recipe, model_class, error_message):
         )
     model_class.objects.get(user=user, recipe=recipe).delete()
     return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+def normalize_search_key(value):
+    """Ключ для поиска: регистр не учитывается, ё заменяется на е,
+    пробелы схлопываются."""
+    return ' '.join(value.casefold().replace('ё', 'е').split())
+
+
+def prefix_condition(field, prefix):
+    """Условие «field начинается с prefix», которое использует индекс.
+    В PostgreSQL это LIKE по индексу varchar_pattern_ops, который Django
+    создаёт для CharField с db_index. В остальных СУБД — диапазон
+    [prefix, следующая строка), его поддерживает обычный b-tree индекс."""
+    if connection.vendor == 'postgresql':
+        return Q(**{f'{field}__startswith': prefix})
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return Q(**{f'{field}__gte': prefix, f'{field}__lt': upper})
+
+
+def is_shared_cache(alias='default'):
+    """Общий ли кеш alias для всех процессов. У LocMemCache в каждом
+    процессе свои данные, DummyCache ничего не хранит."""
+    return not isinstance(caches[alias], (LocMemCache, DummyCache))
@@ -32,12 +32,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.timing.ServerTimingMiddleware',
+    'core.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -74,6 +77,47 @@ DATABASES = {
     }
 }
 
+# Реплики для чтения запросами к API: через запятую хосты PostgreSQL
+# (host или host:port) или, если основная база SQLite, пути к файлам.
+DATABASE_REPLICAS = []
+for number, replica in enumerate(
+    filter(None, map(str.strip, os.getenv('DB_REPLICAS', '').split(','))),
+    start=1,
+):
+    replica_settings = {
+        **DATABASES['default'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    if replica_settings['ENGINE'].endswith('sqlite3'):
+        replica_settings['NAME'] = replica
+    else:
+        host, _, port = replica.partition(':')
+        replica_settings.update(
+            HOST=host,
+            PORT=port or replica_settings['PORT'],
+            OPTIONS={'connect_timeout': int(
+                os.getenv('DB_REPLICA_CONNECT_TIMEOUT', default=2))},
+        )
+    DATABASES[f'replica{number}'] = replica_settings
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['core.replicas.ReplicaRouter']
+# Сколько секунд после изменяющего запроса клиент читает
+# из основной базы.
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', default=10))
+# Как часто, в секундах, проверять исправность реплики.
+REPLICA_CHECK_INTERVAL = int(os.getenv('REPLICA_CHECK_INTERVAL', default=10))
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache',
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', default=''),
+    }
+}
+
 AUTH_USER_MODEL = 'users.User'
 
 CORS_ORIGIN_ALLOW_ALL = True
@@ -123,7 +167,7 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.CachedTokenAuthentication',
     ],
 }
 
@@ -140,3 +184,64 @@ DJOSER = {
         "user_list": ["rest_framework.permissions.IsAuthenticatedOrReadOnly"],
     },
 }
+
+# Максимальное значение параметра recipes_limit в списке подписок.
+SUBSCRIPTION_RECIPES_LIMIT_MAX = int(
+    os.getenv('SUBSCRIPTION_RECIPES_LIMIT_MAX', default=50)
+)
+
+# Ограничения на загружаемые изображения рецептов.
+RECIPE_IMAGE_MAX_BYTES = int(
+    os.getenv('RECIPE_IMAGE_MAX_BYTES', default=5 * 1024 * 1024)
+)
+RECIPE_IMAGE_MAX_PIXELS = int(
+    os.getenv('RECIPE_IMAGE_MAX_PIXELS', default=25_000_000)
+)
+
+# Шрифт TrueType с кириллицей, который встраивается в список покупок
+# в формате PDF.
+SHOPPING_LIST_FONT = os.getenv(
+    'SHOPPING_LIST_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+)
+
+# Число процессов, создающих уменьшенные копии изображений.
+# При 0 копии создаются сразу после сохранения рецепта.
+IMAGE_VARIANT_WORKERS = int(os.getenv('IMAGE_VARIANT_WORKERS', default=2))
+
+# Время хранения количества рецептов в кеше, в секундах. Кеш
+# сбрасывается при изменениях, но LocMemCache у каждого процесса свой:
+# при нескольких процессах нужен общий кеш (CACHE_BACKEND).
+COUNT_CACHE_TIMEOUT = int(os.getenv('COUNT_CACHE_TIMEOUT', default=60))
+# Начиная с этой оценки планировщика PostgreSQL количество
+# не считается точно.
+COUNT_ESTIMATE_THRESHOLD = int(
+    os.getenv('COUNT_ESTIMATE_THRESHOLD', default=10000)
+)
+
+# Заголовок Server-Timing для запросов к API. Выключенный middleware
+# исключается из цепочки и не замедляет запросы.
+SERVER_TIMING = os.getenv('SERVER_TIMING', default='False') == 'True'
+# Запросы дольше этого времени, в миллисекундах, пишутся в журнал
+# core.timing вместе с самыми долгими SQL-запросами и их планами.
+# 0 — не писать.
+SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', default=1000))
+SLOW_REQUEST_QUERIES = int(os.getenv('SLOW_REQUEST_QUERIES', default=3))
+
+# Профилирование запросов к API сотрудниками (заголовок X-Profile
+# или параметр profile). Отчёты сохраняются в PROFILING_DIR, если он
+# задан, иначе отдаются вместо ответа.
+PROFILING = os.getenv('PROFILING', default='False') == 'True'
+PROFILING_DIR = os.getenv('PROFILING_DIR', default='')
+PROFILING_RATE_LIMIT = int(os.getenv('PROFILING_RATE_LIMIT', default=6))
+PROFILING_MAX_BYTES = int(
+    os.getenv('PROFILING_MAX_BYTES', default=1024 * 1024)
+)
+PROFILING_MAX_FILES = int(os.getenv('PROFILING_MAX_FILES', default=50))
+PROFILING_TOP = int(os.getenv('PROFILING_TOP', default=40))
+
+# Время хранения токена с пользователем в кеше, в секундах.
+# Кеш токенов включается только с общим кешем (CACHE_BACKEND, например
+# Redis или Memcached): в LocMemCache у каждого процесса свои данные,
+# и отзыв токена не дошёл бы до остальных процессов.
+TOKEN_CACHE_TIMEOUT = int(os.getenv('TOKEN_CACHE_TIMEOUT', default=300))
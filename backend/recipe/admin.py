@@ -1,56 +1,89 @@
+from core.admin import IndexedSearchMixin
+from core.utils import normalize_search_key
 from django.contrib import admin
+from django.db.models import Prefetch
 from recipe.models import (Favorite, Ingredient, Recipe,
-                           RecipeIngredientAmount, ShoppingCart, Tag)
+                           RecipeIngredientAmount, ShoppingCart,
+                           ShoppingCartIngredient, Tag, get_recipe_amounts)
 
 
 class IngredientInLine(admin.TabularInline):
     model = RecipeIngredientAmount
     extra = 3
     min_num = 1
+    autocomplete_fields = ('ingredient', )
 
 
 @admin.register(Recipe)
-class RecipeAdmin(admin.ModelAdmin):
+class RecipeAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = (
         'name', 'author', 'cooking_time',
-        'get_favorites', 'get_ingredients',
+        'favorites_count', 'in_carts_count', 'get_ingredients',
     )
-    list_filter = ('author', 'name', 'tags', )
-    search_fields = ('author', 'name', 'tags', )
+    list_select_related = ('author', )
+    list_filter = ('tags', )
+    search_fields = ('name', 'author__username', 'author__email', )
+    autocomplete_fields = ('author', )
+    show_full_result_count = False
     inlines = (IngredientInLine, )
 
-    def get_favorites(self, object):
-        return object.favorites.count()
-    get_favorites.short_description = 'Избранное'
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related(
+            Prefetch('ingredients', Ingredient.objects.only('name')))
+
+    def save_model(self, request, obj, form, change):
+        if 'image' in form.changed_data:
+            obj.image_variants_ready = False
+        super().save_model(request, obj, form, change)
+
+    def save_related(self, request, form, formsets, change):
+        """Сохраняет теги и ингредиенты рецепта, обновляет маску тегов
+        и переносит изменение ингредиентов в итоги списков покупок."""
+        old_amounts = get_recipe_amounts(form.instance.pk) if change else {}
+        super().save_related(request, form, formsets, change)
+        Recipe.objects.set_tags_mask(
+            form.instance, form.cleaned_data['tags'])
+        ShoppingCartIngredient.objects.apply_recipe_change(
+            form.instance, old_amounts, get_recipe_amounts(form.instance.pk)
+        )
 
     def get_ingredients(self, object):
-        return ', '.join(object.ingredients.values_list('name', flat=True))
+        return ', '.join(
+            ingredient.name for ingredient in object.ingredients.all())
     get_ingredients.short_description = 'Ингредиенты'
 
 
 @admin.register(Ingredient)
-class IngredientAdmin(admin.ModelAdmin):
+class IngredientAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ('name', 'measurement_unit', 'id', )
-    list_filter = ('name', )
-    search_fields = ('name', )
+    list_filter = ('measurement_unit', )
+    search_fields = ('search_name', )
+    normalized_search = True
+    show_full_result_count = False
+
+    def normalize_search_term(self, term):
+        return normalize_search_key(term)
 
 
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
     list_display = ('name', 'color', 'slug', 'id', )
-    list_filter = ('name', )
     search_fields = ('name', )
 
 
 @admin.register(Favorite)
-class FavoriteAdmin(admin.ModelAdmin):
+class FavoriteAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ('user', 'recipe', )
-    list_filter = ('user', 'recipe', )
-    search_fields = ('user', 'recipe', )
+    list_select_related = ('user', 'recipe__author', )
+    search_fields = ('user__username', 'recipe__name', )
+    autocomplete_fields = ('user', 'recipe', )
+    show_full_result_count = False
 
 
 @admin.register(ShoppingCart)
-class ShoppingCartAdmin(admin.ModelAdmin):
+class ShoppingCartAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ('user', 'recipe', )
-    list_filter = ('user', )
-    search_fields = ('user', )
+    list_select_related = ('user', 'recipe__author', )
+    search_fields = ('user__username', 'recipe__name', )
+    autocomplete_fields = ('user', 'recipe', )
+    show_full_result_count = False
@@ -5,3 +5,6 @@ class RecipeConfig(AppConfig):
     name = 'recipe'
     verbose_name = 'recipe'
     verbose_name = 'Рецепты'
+
+    def ready(self):
+        import recipe.signals  # noqa: F401
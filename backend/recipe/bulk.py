@@ -0,0 +1,94 @@
+"""Массовое создание рецептов для команд импорта и генерации данных.
+
+bulk_create не вызывает сигналы, поэтому то, что для одиночного
+рецепта делают сигналы, здесь выполняется пакетно: связи с тегами
+и ингредиентами, полнотекстовый индекс, счётчики рецептов авторов
+сброс кеша количества рецептов и создание копий изображений.
+"""
+from collections import Counter, defaultdict
+from functools import partial
+
+from core.counts import bump_generation
+from core.images import schedule_variants
+from django.db import connections, transaction
+from django.db.models import F, Max
+from recipe.models import (RECIPES_SCOPE, Recipe, RecipeIngredientAmount,
+                           Tag, get_tags_mask)
+from recipe.search import index_recipes
+from users.models import User
+
+
+def assign_ids(recipes, using):
+    """Назначает id заранее, если СУБД не возвращает id из bulk_create
+    (SQLite). Вызывается внутри транзакции, которая на время импорта
+    блокирует запись в базу SQLite."""
+    if connections[using].features.can_return_ids_from_bulk_insert:
+        return
+    start = (Recipe.objects.using(using).aggregate(
+        last=Max('pk'))['last'] or 0) + 1
+    for offset, recipe in enumerate(recipes):
+        recipe.pk = start + offset
+
+
+def bulk_create_recipes(recipes, tags, ingredients, using='default'):
+    """Создаёт рецепты пакетом.
+
+    recipes — несохранённые объекты Recipe; tags — для каждого рецепта
+    список объектов Tag; ingredients — для каждого рецепта список пар
+    (id ингредиента, количество). Даты pub_date, заданные у объектов,
+    сохраняются, иначе ставится текущее время.
+    """
+    pub_dates = [recipe.pub_date for recipe in recipes]
+    for recipe, recipe_tags in zip(recipes, tags):
+        recipe.tags_mask = get_tags_mask(recipe_tags)
+    with transaction.atomic(using=using):
+        assign_ids(recipes, using)
+        Recipe.objects.using(using).bulk_create(recipes)
+        dated = []
+        for recipe, pub_date in zip(recipes, pub_dates):
+            if pub_date is not None:
+                recipe.pub_date = recipe.created = pub_date
+                dated.append(recipe)
+        if dated:
+            Recipe.objects.using(using).bulk_update(
+                dated, ['pub_date', 'created'])
+        Recipe.tags.through.objects.using(using).bulk_create(
+            Recipe.tags.through(recipe_id=recipe.pk, tag_id=tag.pk)
+            for recipe, recipe_tags in zip(recipes, tags)
+            for tag in recipe_tags
+        )
+        RecipeIngredientAmount.objects.using(using).bulk_create(
+            RecipeIngredientAmount(
+                recipe_id=recipe.pk,
+                ingredient_id=ingredient_id,
+                amount=amount,
+            )
+            for recipe, amounts in zip(recipes, ingredients)
+            for ingredient_id, amount in amounts
+        )
+        index_recipes(recipes, using)
+        by_count = defaultdict(list)
+        for author_id, count in Counter(
+            recipe.author_id for recipe in recipes
+        ).items():
+            by_count[count].append(author_id)
+        for count, author_ids in by_count.items():
+            User.objects.using(using).filter(pk__in=author_ids).update(
+                recipes_count=F('recipes_count') + count)
+        transaction.on_commit(
+            partial(bump_generation, RECIPES_SCOPE), using=using)
+        for recipe in recipes:
+            if recipe.image and not recipe.image_variants_ready:
+                on_done = partial(
+                    Recipe.objects.mark_image_variants_ready,
+                    recipe.pk, recipe.image.name,
+                )
+                transaction.on_commit(
+                    partial(schedule_variants, recipe.image, on_done),
+                    using=using,
+                )
+    return recipes
+
+
+def get_tags_by_slug(using='default'):
+    return {tag.slug: tag for tag in Tag.objects.using(using)}
@@ -0,0 +1,415 @@
+import base64
+import json
+import os
+import statistics
+import tempfile
+from collections import namedtuple
+from contextlib import ExitStack
+from io import BytesIO, StringIO
+from time import perf_counter
+from urllib.parse import urlencode
+
+from core.queries import QueryTracker
+from core.replicas import choose_replica
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Count
+from django.test.utils import (override_settings, setup_databases,
+                               setup_test_environment, teardown_databases,
+                               teardown_test_environment)
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from recipe.models import Ingredient, Recipe, Tag
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from users.models import User
+
+DEFAULT_BUDGETS = os.path.join(
+    settings.BASE_DIR, 'data', 'query_budgets.json')
+DATASET_PREFIX = 'bench'
+TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+)
+# Отдельный кеш во временном каталоге: команда очищает его перед
+# каждым запросом и не должна затрагивать общий кеш приложения.
+# Кеш в файлах общий для процессов, как требуют реплики и кеш токенов.
+BENCHMARK_CACHE_BACKEND = (
+    'django.core.cache.backends.filebased.FileBasedCache')
+
+WRITTEN_RECIPE_NAME = 'Рецепт для замера записи'
+
+# path — строка или функция, возвращающая путь перед запросом;
+# data — тело запроса JSON.
+Route = namedtuple('Route', 'name method path authenticated data')
+Route.__new__.__defaults__ = (None, )
+
+
+def sample_image():
+    """Небольшое изображение PNG в виде data URI."""
+    buffer = BytesIO()
+    Image.new('RGB', (64, 64), '#49B64E').save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()).decode()
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет маршруты API на тестовой базе с синтетическими данными: '
+        'количество SQL-запросов, время в базе и общее время ответа. '
+        'Кеш очищается перед каждым запросом. Завершается с ошибкой, '
+        'если маршрут выполняет больше запросов, чем записано '
+        'в файле бюджетов для используемой СУБД.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=2000,
+            help='Количество пользователей в тестовых данных.',
+        )
+        parser.add_argument(
+            '--recipes', type=int, default=20000,
+            help='Количество рецептов в тестовых данных.',
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Начальное значение генератора тестовых данных.',
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Сколько раз выполнить каждый маршрут.',
+        )
+        parser.add_argument(
+            '--route', action='append', default=[],
+            help='Замерить только маршруты, имя которых начинается '
+                 'с указанной строки. Можно указать несколько раз.',
+        )
+        parser.add_argument(
+            '--budgets', default=DEFAULT_BUDGETS,
+            help='Файл JSON с бюджетами запросов.',
+        )
+        parser.add_argument(
+            '--update-budgets', action='store_true',
+            help='Записать измеренное количество запросов как бюджет.',
+        )
+        parser.add_argument(
+            '--noinput', '--no-input', action='store_false',
+            dest='interactive',
+            help='Удалять оставшуюся тестовую базу без подтверждения.',
+        )
+        parser.add_argument(
+            '--report',
+            help='Путь к отчёту JSON для сравнения между коммитами, '
+                 '«-» — стандартный вывод.',
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        # Как и тестовый раннер, реплики с TEST MIRROR подключаются
+        # к тестовой основной базе.
+        old_config = setup_databases(
+            verbosity=0, interactive=options['interactive'])
+        try:
+            # Исправность реплик проверяется один раз до замеров,
+            # чтобы запрос проверки не попадал в замеры маршрутов.
+            # Изображения создаваемых рецептов сохраняются во временный
+            # каталог, их копии создаются сразу, в том же процессе.
+            with tempfile.TemporaryDirectory() as directory:
+                with override_settings(
+                    CACHES={'default': {
+                        'BACKEND': BENCHMARK_CACHE_BACKEND,
+                        'LOCATION': os.path.join(directory, 'cache'),
+                    }},
+                    REPLICA_CHECK_INTERVAL=float('inf'),
+                    MEDIA_ROOT=os.path.join(directory, 'media'),
+                    IMAGE_VARIANT_WORKERS=0,
+                ):
+                    choose_replica()
+                    self.create_dataset(options)
+                    results = self.run_routes(options)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+        self.finish(results, options)
+
+    def create_dataset(self, options):
+        started = perf_counter()
+        call_command('load_ingredients', stdout=StringIO())
+        for name, color, slug in TAGS:
+            Tag.objects.create(name=name, color=color, slug=slug)
+        call_command(
+            'generate_dataset',
+            users=options['users'],
+            recipes=options['recipes'],
+            seed=options['seed'],
+            prefix=DATASET_PREFIX,
+            stdout=StringIO(),
+        )
+        self.stderr.write(
+            f'Тестовые данные созданы за {perf_counter() - started:.2f} с.')
+
+    def get_routes(self):
+        """Маршруты из api/urls.py. Пользователь — самый активный
+        из созданных: у него больше всего рецептов в корзине,
+        в избранном и подписок. Рецепт и автор для переключателей
+        выбираются среди популярных, но ещё не добавленных им.
+        Рецепт, созданный маршрутом recipes:create, изменяется
+        и удаляется следующими за ним маршрутами."""
+        viewer = User.objects.annotate(
+            carts=Count('shopping_cart', distinct=True),
+            favorites_total=Count('favorites', distinct=True),
+            follows=Count('follower', distinct=True),
+        ).order_by('-carts', '-favorites_total', '-follows').first()
+        recipe = Recipe.objects.exclude(favorites__user=viewer).exclude(
+            shopping_cart__user=viewer).order_by('-favorites_count').first()
+        author = User.objects.exclude(pk=viewer.pk).exclude(
+            following__user=viewer).order_by('-followers_count').first()
+        tag = Tag.objects.order_by('slug').first()
+        ingredient = Ingredient.objects.order_by('name').first()
+        self.viewer = viewer
+        self.recipe_data = {
+            'tags': list(Tag.objects.values_list('pk', flat=True)[:2]),
+            'ingredients': [
+                {'id': pk, 'amount': amount}
+                for amount, pk in enumerate(Ingredient.objects.order_by(
+                    'pk').values_list('pk', flat=True)[:5], 1)
+            ],
+            'image': sample_image(),
+            'name': WRITTEN_RECIPE_NAME,
+            'text': 'Рецепт, создаваемый при замере.',
+            'cooking_time': 15,
+        }
+
+        def url(name, query=None, **kwargs):
+            path = reverse(f'api:{name}', kwargs=kwargs)
+            return f'{path}?{urlencode(query, doseq=True)}' if query else path
+
+        recipes = 'recipes-list'
+        return [
+            Route('recipes:list:anonymous', 'get', url(recipes), False),
+            Route('recipes:list', 'get', url(recipes), True),
+            Route('recipes:list:page', 'get',
+                  url(recipes, {'page': 3}), True),
+            Route('recipes:list:cursor', 'get',
+                  url(recipes, {'cursor': ''}), True),
+            Route('recipes:list:tags', 'get',
+                  url(recipes, {'tags': [slug for *_, slug in TAGS]}), True),
+            Route('recipes:list:tags_all', 'get', url(recipes, {
+                'tags': [slug for *_, slug in TAGS[:2]],
+                'tags_mode': 'all',
+            }), True),
+            Route('recipes:list:author', 'get',
+                  url(recipes, {'author': author.pk}), True),
+            Route('recipes:list:is_favorited', 'get',
+                  url(recipes, {'is_favorited': 1}), True),
+            Route('recipes:list:is_in_shopping_cart', 'get',
+                  url(recipes, {'is_in_shopping_cart': 1}), True),
+            Route('recipes:list:search', 'get',
+                  url(recipes, {'search': 'рецепт 1'}), True),
+            Route('recipes:detail:anonymous', 'get',
+                  url('recipes-detail', pk=recipe.pk), False),
+            Route('recipes:detail', 'get',
+                  url('recipes-detail', pk=recipe.pk), True),
+            Route('recipes:create', 'post', url(recipes), True,
+                  self.recipe_data),
+            Route('recipes:update', 'patch', self.written_recipe_path, True,
+                  {'cooking_time': 20, 'text': 'Изменённое описание.'}),
+            Route('recipes:delete', 'delete', self.written_recipe_path, True),
+            Route('recipes:favorite:add', 'post',
+                  url('recipes-favorite', pk=recipe.pk), True),
+            Route('recipes:favorite:remove', 'delete',
+                  url('recipes-favorite', pk=recipe.pk), True),
+            Route('recipes:shopping_cart:add', 'post',
+                  url('recipes-shopping-cart', pk=recipe.pk), True),
+            Route('recipes:shopping_cart:remove', 'delete',
+                  url('recipes-shopping-cart', pk=recipe.pk), True),
+            Route('recipes:download_shopping_cart:txt', 'get',
+                  url('recipes-download-shopping-cart'), True),
+            Route('recipes:download_shopping_cart:csv', 'get',
+                  url('recipes-download-shopping-cart', {'format': 'csv'}),
+                  True),
+            Route('recipes:download_shopping_cart:pdf', 'get',
+                  url('recipes-download-shopping-cart', {'format': 'pdf'}),
+                  True),
+            Route('tags:list', 'get', url('tags-list'), False),
+            Route('tags:detail', 'get', url('tags-detail', pk=tag.pk), False),
+            Route('ingredients:list:search', 'get', url(
+                'ingredients-list', {'name': ingredient.name[:3]}), False),
+            Route('ingredients:list:search_limit', 'get', url(
+                'ingredients-list',
+                {'name': ingredient.name[:3], 'limit': 10},
+            ), False),
+            Route('ingredients:detail', 'get',
+                  url('ingredients-detail', pk=ingredient.pk), False),
+            Route('users:list', 'get', url('users-list'), True),
+            Route('users:detail', 'get',
+                  url('users-detail', id=author.pk), True),
+            Route('users:me', 'get', url('users-me'), True),
+            Route('users:subscriptions', 'get',
+                  url('users-subscriptions'), True),
+            Route('users:subscriptions:recipes_limit', 'get',
+                  url('users-subscriptions', {'recipes_limit': 3}), True),
+            Route('users:subscribe:add', 'post',
+                  url('users-subscribe', id=author.pk), True),
+            Route('users:subscribe:remove', 'delete',
+                  url('users-subscribe', id=author.pk), True),
+        ]
+
+    def written_recipe_path(self):
+        """Путь к последнему рецепту, созданному маршрутом
+        recipes:create. Если его нет (маршрут не выбран --route),
+        рецепт создаётся запросом, который не замеряется."""
+        pk = Recipe.objects.filter(
+            author=self.viewer, name=WRITTEN_RECIPE_NAME,
+        ).order_by('-pk').values_list('pk', flat=True).first()
+        if pk is None:
+            pk = self.authenticated.post(
+                reverse('api:recipes-list'), self.recipe_data, format='json',
+            ).data['id']
+        return reverse('api:recipes-detail', kwargs={'pk': pk})
+
+    def run_routes(self, options):
+        routes = [
+            route for route in self.get_routes()
+            if not options['route'] or any(
+                route.name.startswith(prefix) for prefix in options['route'])
+        ]
+        if not routes:
+            raise CommandError('Нет маршрутов, подходящих под --route.')
+        anonymous = APIClient()
+        self.authenticated = APIClient()
+        token, _ = Token.objects.get_or_create(user=self.viewer)
+        self.authenticated.credentials(
+            HTTP_AUTHORIZATION=f'Token {token.key}')
+        measurements = {route.name: [] for route in routes}
+        paths = {}
+        # Маршруты выполняются по кругу, поэтому за добавлением
+        # в избранное и созданием рецепта всегда следует удаление.
+        for _ in range(options['repeat']):
+            for route in routes:
+                client = (
+                    self.authenticated if route.authenticated else anonymous)
+                path = route.path() if callable(route.path) else route.path
+                paths[route.name] = path
+                measurements[route.name].append(
+                    self.measure(client, route, path))
+        return [
+            self.summarize(route, paths[route.name], measurements[route.name])
+            for route in routes
+        ]
+
+    @staticmethod
+    def measure(client, route, path):
+        cache.clear()
+        with ExitStack() as stack:
+            # Запросы учитываются во всех базах, включая реплики.
+            trackers = [
+                stack.enter_context(QueryTracker(alias))
+                for alias in connections
+            ]
+            started = perf_counter()
+            response = getattr(client, route.method)(
+                path, route.data, format='json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+            wall = perf_counter() - started
+        return (
+            response.status_code,
+            sum(tracker.count for tracker in trackers),
+            sum(tracker.duration for tracker in trackers),
+            wall,
+        )
+
+    @staticmethod
+    def summarize(route, path, measurements):
+        statuses, counts, db_times, wall_times = zip(*measurements)
+        return {
+            'name': route.name,
+            'method': route.method.upper(),
+            'path': path,
+            'status': sorted(set(statuses)),
+            'queries': max(counts),
+            'db_ms': round(statistics.median(db_times) * 1000, 2),
+            'wall_ms': round(statistics.median(wall_times) * 1000, 2),
+        }
+
+    def finish(self, results, options):
+        vendor = connection.vendor
+        budgets_path = options['budgets']
+        budgets = {}
+        if os.path.exists(budgets_path):
+            with open(budgets_path, encoding='utf-8') as file:
+                budgets = json.load(file)
+        vendor_budgets = budgets.setdefault(vendor, {})
+        failed = []
+        for result in results:
+            result['budget'] = vendor_budgets.get(result['name'])
+            errors = [status for status in result['status'] if status >= 400]
+            if errors:
+                failed.append(f'{result["name"]}: статус {errors}')
+            elif (
+                result['budget'] is not None
+                and result['queries'] > result['budget']
+            ):
+                failed.append(
+                    f'{result["name"]}: {result["queries"]} запросов '
+                    f'при бюджете {result["budget"]}'
+                )
+        self.write_table(results)
+        if options['report']:
+            self.write_report(results, failed, options)
+        if options['update_budgets']:
+            vendor_budgets.update(
+                (result['name'], result['queries']) for result in results)
+            with open(budgets_path, 'w', encoding='utf-8') as file:
+                json.dump(budgets, file, indent=2, sort_keys=True)
+                file.write('\n')
+            self.stderr.write(self.style.SUCCESS(
+                f'Бюджеты записаны в {budgets_path}.'))
+            return
+        if failed:
+            raise CommandError(
+                'Превышены бюджеты или получены ошибки:\n'
+                + '\n'.join(failed))
+
+    def write_table(self, results):
+        width = max(len(result['name']) for result in results)
+        self.stderr.write(
+            f'{"Маршрут":<{width}}  Запросы  Бюджет  База, мс  Всего, мс')
+        for result in results:
+            budget = '-' if result['budget'] is None else result['budget']
+            line = (
+                f'{result["name"]:<{width}}  {result["queries"]:>7}  '
+                f'{budget:>6}  {result["db_ms"]:>8.2f}  '
+                f'{result["wall_ms"]:>9.2f}'
+            )
+            over = (
+                result['budget'] is not None
+                and result['queries'] > result['budget']
+            )
+            self.stderr.write(self.style.ERROR(line) if over else line)
+
+    def write_report(self, results, failed, options):
+        report = {
+            'created': timezone.now().isoformat(),
+            'vendor': connection.vendor,
+            'dataset': {
+                'users': options['users'],
+                'recipes': options['recipes'],
+                'seed': options['seed'],
+            },
+            'repeat': options['repeat'],
+            'routes': results,
+            'failed': failed,
+        }
+        content = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['report'] == '-':
+            self.stdout.write(content)
+            return
+        with open(options['report'], 'w', encoding='utf-8') as file:
+            file.write(content + '\n')
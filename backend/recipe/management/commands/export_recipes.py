@@ -0,0 +1,104 @@
+import json
+import os
+import shutil
+import sys
+
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch
+from recipe.models import Recipe, RecipeIngredientAmount
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгружает рецепты в формате JSON Lines: одна строка — один '
+        'рецепт с автором, тегами и ингредиентами. Рецепты читаются '
+        'пакетами по id, поэтому память не зависит от их количества.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            default='-',
+            help='Путь к файлу .jsonl, «-» — стандартный вывод.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Количество рецептов, читаемых за один запрос.',
+        )
+        parser.add_argument(
+            '--images-dir',
+            help='Каталог, в который копируются файлы изображений.',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if path == '-':
+            count = self.export_recipes(sys.stdout, options)
+        else:
+            with open(path, 'w', encoding='utf-8') as file:
+                count = self.export_recipes(file, options)
+        self.stderr.write(self.style.SUCCESS(f'Выгружено рецептов: {count}.'))
+
+    def iterate_recipes(self, batch_size):
+        queryset = Recipe.objects.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'ingredienttorecipe',
+                queryset=RecipeIngredientAmount.objects.select_related(
+                    'ingredient'),
+            ),
+        ).order_by('pk')
+        last_pk = 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                return
+            yield from batch
+            last_pk = batch[-1].pk
+
+    def export_recipes(self, file, options):
+        images_dir = options['images_dir']
+        count = 0
+        for recipe in self.iterate_recipes(options['batch_size']):
+            if images_dir and recipe.image:
+                self.copy_image(recipe.image, images_dir)
+            file.write(json.dumps(
+                self.serialize(recipe), ensure_ascii=False, default=str))
+            file.write('\n')
+            count += 1
+        return count
+
+    @staticmethod
+    def serialize(recipe):
+        return {
+            'name': recipe.name,
+            'text': recipe.text,
+            'cooking_time': recipe.cooking_time,
+            'pub_date': recipe.pub_date,
+            'author': {
+                'username': recipe.author.username,
+                'email': recipe.author.email,
+            },
+            'tags': [tag.slug for tag in recipe.tags.all()],
+            'ingredients': [
+                {
+                    'name': item.ingredient.name,
+                    'measurement_unit': item.ingredient.measurement_unit,
+                    'amount': item.amount,
+                }
+                for item in recipe.ingredienttorecipe.all()
+            ],
+            'image': recipe.image.name or None,
+        }
+
+    @staticmethod
+    def copy_image(image, images_dir):
+        target = os.path.join(images_dir, image.name)
+        if os.path.exists(target):
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with image.storage.open(image.name) as source:
+            with open(target, 'wb') as destination:
+                shutil.copyfileobj(source, destination)
@@ -0,0 +1,208 @@
+import random
+from datetime import timedelta
+from itertools import accumulate
+from time import perf_counter
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from recipe.bulk import bulk_create_recipes
+from recipe.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
+from users.models import Follow, User
+
+
+def zipf_cum_weights(size, skew):
+    """Накопленные веса закона Ципфа: элемент с номером i выбирается
+    с вероятностью, пропорциональной 1 / (i + 1) ** skew. При skew = 0
+    распределение равномерное."""
+    return list(accumulate(1 / (rank + 1) ** skew for rank in range(size)))
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу синтетическими данными для нагрузочных проверок: '
+        'пользователи, рецепты, подписки, избранное и списки покупок. '
+        'Популярность авторов и рецептов распределена по закону Ципфа, '
+        'при одном и том же --seed данные получаются одинаковыми.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=1000,
+            help='Количество пользователей.',
+        )
+        parser.add_argument(
+            '--recipes', type=int, default=10000,
+            help='Количество рецептов.',
+        )
+        parser.add_argument(
+            '--follows', type=int, default=10,
+            help='Наибольшее количество подписок пользователя.',
+        )
+        parser.add_argument(
+            '--favorites', type=int, default=20,
+            help='Наибольшее количество рецептов в избранном пользователя.',
+        )
+        parser.add_argument(
+            '--carts', type=int, default=5,
+            help='Наибольшее количество рецептов в списке покупок.',
+        )
+        parser.add_argument(
+            '--skew', type=float, default=1.0,
+            help='Показатель закона Ципфа, 0 — равномерное распределение.',
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Начальное значение генератора случайных чисел.',
+        )
+        parser.add_argument(
+            '--prefix', default='user',
+            help='Префикс имён создаваемых пользователей.',
+        )
+        parser.add_argument(
+            '--password', default='password',
+            help='Пароль всех создаваемых пользователей.',
+        )
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='За сколько дней до --now распределить даты рецептов.',
+        )
+        parser.add_argument(
+            '--now', default='2024-01-01T00:00:00+00:00',
+            help='Дата и время ISO 8601, от которых отсчитываются даты '
+                 'рецептов. Фиксирована, чтобы при одном --seed даты '
+                 'не зависели от времени запуска.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Размер пакета для bulk_create.',
+        )
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.skew = options['skew']
+        try:
+            self.now = parse_datetime(options['now'])
+        except ValueError:
+            self.now = None
+        if self.now is None:
+            raise CommandError(f'Неверная дата --now: {options["now"]}.')
+        if timezone.is_naive(self.now):
+            self.now = timezone.make_aware(self.now)
+        tags = list(Tag.objects.all())
+        ingredient_ids = list(Ingredient.objects.values_list('pk', flat=True))
+        if not tags or not ingredient_ids:
+            raise CommandError(
+                'Нет тегов или ингредиентов. Создайте теги и загрузите '
+                'ингредиенты командой load_ingredients.'
+            )
+        if User.objects.filter(
+            username__startswith=options['prefix']
+        ).exists():
+            raise CommandError(
+                f'Пользователи с префиксом «{options["prefix"]}» уже есть. '
+                'Укажите другой --prefix.'
+            )
+        started = perf_counter()
+        with transaction.atomic():
+            user_ids = self.create_users(options)
+            self.stdout.write(f'Пользователей: {len(user_ids)}.')
+            recipe_ids = self.create_recipes(
+                user_ids, tags, ingredient_ids, options)
+            self.stdout.write(f'Рецептов: {len(recipe_ids)}.')
+            for model, field, targets, limit in (
+                (Follow, 'following_id', user_ids, options['follows']),
+                (Favorite, 'recipe_id', recipe_ids, options['favorites']),
+                (ShoppingCart, 'recipe_id', recipe_ids, options['carts']),
+            ):
+                count = self.create_relations(
+                    model, field, user_ids, targets, limit)
+                self.stdout.write(f'{model._meta.verbose_name}: {count}.')
+        call_command('rebuild_counters', stdout=self.stdout)
+        call_command('rebuild_shopping_cart_totals', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {perf_counter() - started:.2f} с.'))
+
+    def create_users(self, options):
+        password = make_password(options['password'])
+        prefix = options['prefix']
+        user_ids = []
+        for start in range(0, options['users'], self.batch_size):
+            users = [
+                User(
+                    username=f'{prefix}{number}',
+                    email=f'{prefix}{number}@example.com',
+                    first_name=prefix,
+                    last_name=str(number),
+                    password=password,
+                )
+                for number in range(
+                    start, min(start + self.batch_size, options['users']))
+            ]
+            User.objects.bulk_create(users)
+            user_ids.extend(User.objects.filter(
+                username__in=[user.username for user in users]
+            ).order_by('pk').values_list('pk', flat=True))
+        return user_ids
+
+    def create_recipes(self, user_ids, tags, ingredient_ids, options):
+        author_weights = zipf_cum_weights(len(user_ids), self.skew)
+        period = int(timedelta(days=options['days']).total_seconds())
+        recipe_ids = []
+        for start in range(0, options['recipes'], self.batch_size):
+            size = min(self.batch_size, options['recipes'] - start)
+            authors = self.random.choices(
+                user_ids, cum_weights=author_weights, k=size)
+            recipes, recipe_tags, amounts = [], [], []
+            for offset, author_id in enumerate(authors):
+                number = start + offset
+                recipes.append(Recipe(
+                    author_id=author_id,
+                    name=f'Рецепт {number}',
+                    text=f'Описание рецепта {number}.',
+                    cooking_time=self.random.randint(1, 240),
+                    pub_date=self.now - timedelta(
+                        seconds=self.random.randrange(period)),
+                ))
+                recipe_tags.append(self.random.sample(
+                    tags, self.random.randint(1, min(3, len(tags)))))
+                amounts.append([
+                    (ingredient_id, self.random.randint(1, 1000))
+                    for ingredient_id in self.random.sample(
+                        ingredient_ids,
+                        self.random.randint(1, min(10, len(ingredient_ids))),
+                    )
+                ])
+            bulk_create_recipes(recipes, recipe_tags, amounts)
+            recipe_ids.extend(recipe.pk for recipe in recipes)
+        return recipe_ids
+
+    def create_relations(self, model, field, user_ids, targets, limit):
+        """Для каждого пользователя выбирает до limit объектов: чем меньше
+        номер объекта, тем чаще он выбирается. Повторы и ссылки
+        пользователя на самого себя отбрасываются."""
+        if not targets or limit <= 0:
+            return 0
+        weights = zipf_cum_weights(len(targets), self.skew)
+        relations = []
+        count = 0
+        for user_id in user_ids:
+            chosen = set(self.random.choices(
+                targets, cum_weights=weights,
+                k=self.random.randint(0, limit),
+            ))
+            chosen.discard(user_id if field == 'following_id' else None)
+            relations.extend(
+                model(user_id=user_id, **{field: target})
+                for target in chosen
+            )
+            if len(relations) >= self.batch_size:
+                model.objects.bulk_create(relations)
+                count += len(relations)
+                relations = []
+        model.objects.bulk_create(relations)
+        return count + len(relations)
@@ -0,0 +1,177 @@
+import json
+import os
+import sys
+from itertools import islice
+from time import perf_counter
+
+from django.contrib.auth.hashers import make_password
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+from recipe.bulk import bulk_create_recipes, get_tags_by_slug
+from recipe.models import Ingredient, Recipe
+from users.models import User
+
+
+def read_lines(file):
+    """Разбирает файл JSON Lines построчно, пропуская пустые строки."""
+    for number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except json.JSONDecodeError as error:
+            raise CommandError(f'Строка {number}: {error}.')
+
+
+def batches(items, size):
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает рецепты из файла JSON Lines, созданного командой '
+        'export_recipes. Рецепты читаются и записываются пакетами '
+        'через bulk_create, весь импорт выполняется в одной транзакции.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            default='-',
+            help='Путь к файлу .jsonl, «-» — стандартный ввод.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Количество рецептов, записываемых за один пакет.',
+        )
+        parser.add_argument(
+            '--images-dir',
+            help='Каталог с файлами изображений, выгруженными '
+                 'export_recipes --images-dir.',
+        )
+        parser.add_argument(
+            '--create-authors',
+            action='store_true',
+            help='Создавать отсутствующих авторов без пароля.',
+        )
+
+    def handle(self, *args, **options):
+        self.images_dir = options['images_dir']
+        self.create_authors = options['create_authors']
+        self.tags = get_tags_by_slug()
+        self.ingredients = self.get_ingredients()
+        started = perf_counter()
+        count = 0
+        path = options['path']
+        file = sys.stdin if path == '-' else open(path, encoding='utf-8')
+        try:
+            with transaction.atomic():
+                for batch in batches(read_lines(file), options['batch_size']):
+                    count += self.import_batch(batch)
+        finally:
+            if file is not sys.stdin:
+                file.close()
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено рецептов: {count} '
+            f'за {perf_counter() - started:.2f} с.'
+        ))
+
+    def import_batch(self, batch):
+        authors = self.get_authors(batch)
+        recipes, tags, amounts = [], [], []
+        for number, item in batch:
+            try:
+                recipe_tags = [self.tags[slug] for slug in item['tags']]
+            except KeyError as error:
+                raise CommandError(
+                    f'Строка {number}: тег {error} не найден.')
+            recipe_amounts = []
+            for ingredient in item['ingredients']:
+                key = (ingredient['name'], ingredient['measurement_unit'])
+                if key not in self.ingredients:
+                    raise CommandError(
+                        f'Строка {number}: ингредиент «{key[0]}, {key[1]}» '
+                        'не найден. Загрузите его командой load_ingredients.'
+                    )
+                recipe_amounts.append(
+                    (self.ingredients[key], ingredient['amount']))
+            pub_date = item.get('pub_date')
+            recipes.append(Recipe(
+                author=authors[item['author']['username']],
+                name=item['name'],
+                text=item['text'],
+                cooking_time=item['cooking_time'],
+                pub_date=parse_datetime(pub_date) if pub_date else None,
+                image=self.get_image(number, item.get('image')),
+            ))
+            tags.append(recipe_tags)
+            amounts.append(recipe_amounts)
+        bulk_create_recipes(recipes, tags, amounts)
+        return len(recipes)
+
+    def get_authors(self, batch):
+        authors = {item['author']['username']: item['author']
+                   for _, item in batch}
+        found = User.objects.in_bulk(authors, field_name='username')
+        missing = [
+            User(
+                username=username,
+                email=author['email'],
+                password=make_password(None),
+            )
+            for username, author in authors.items() if username not in found
+        ]
+        if missing and not self.create_authors:
+            raise CommandError(
+                'Авторы не найдены: '
+                + ', '.join(user.username for user in missing)
+                + '. Используйте --create-authors.'
+            )
+        if missing:
+            User.objects.bulk_create(missing)
+            found.update(User.objects.in_bulk(
+                [user.username for user in missing], field_name='username'))
+        return found
+
+    @staticmethod
+    def get_ingredients():
+        """Словарь {(название, единица измерения): id} всех ингредиентов.
+        Справочник загружается один раз: условие OR по каждой паре
+        из пакета превышает предел глубины выражения SQLite."""
+        return {
+            (name, measurement_unit): pk
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                'pk', 'name', 'measurement_unit').iterator()
+        }
+
+    def get_image(self, number, name):
+        """Без --images-dir ссылка на изображение сохраняется, только
+        если файл уже есть в хранилище. Файлы из каталога сохраняются
+        через хранилище, которое не пишет повторно одинаковые файлы."""
+        if not name:
+            return None
+        field = Recipe._meta.get_field('image')
+        if not self.images_dir:
+            if field.storage.exists(name):
+                return name
+            self.stderr.write(
+                f'Строка {number}: изображение {name} не найдено.')
+            return None
+        path = os.path.join(self.images_dir, name)
+        if not os.path.exists(path):
+            raise CommandError(
+                f'Строка {number}: файл изображения {path} не найден.')
+        with open(path, 'rb') as file:
+            return field.storage.save(
+                field.generate_filename(None, os.path.basename(name)),
+                File(file),
+            )
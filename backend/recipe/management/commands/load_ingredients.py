@@ -1,22 +1,163 @@
 import csv
+import json
+import os
+from time import perf_counter
 
-from django.core.management.base import BaseCommand
+from core.utils import normalize_search_key
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
 from recipe.models import Ingredient
 
+CHUNK_SIZE = 64 * 1024
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if row:
+            yield row[0], row[1]
+
+
+def read_json(file):
+    """Разбирает JSON-массив объектов по одному, читая файл частями,
+    чтобы не загружать его в память целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    eof = False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position < len(buffer) and not started:
+            if buffer[position] != '[':
+                raise CommandError('Ожидается JSON-массив ингредиентов.')
+            started = True
+            position += 1
+            continue
+        if position < len(buffer) and buffer[position] == ']':
+            return
+        try:
+            if position == len(buffer):
+                raise json.JSONDecodeError('', buffer, position)
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise CommandError('Файл JSON обрывается.')
+            chunk = file.read(CHUNK_SIZE)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield item['name'], item['measurement_unit']
+
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+}
+
 
 class Command(BaseCommand):
+    help = (
+        'Загружает ингредиенты из CSV или JSON. Новые пары '
+        '(название, единица измерения) добавляются, существующие '
+        'обновляются только при изменении, весь импорт выполняется '
+        'в одной транзакции.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            default='./data/ingredients.csv',
+            help='Путь к файлу .csv или .json.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Размер пакета для bulk_create/bulk_update.',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Посчитать изменения, ничего не записывая в базу.',
+        )
 
     def handle(self, *args, **options):
-        self.import_ingredients()
-        print('Ингредиенты загружены.')
-
-    def import_ingredients(self, file='ingredients.csv'):
-        print(f'Загрузка {file}...')
-        file_path = f'./data/{file}'
-        with open(file_path, newline='', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            for row in reader:
-                status, created = Ingredient.objects.update_or_create(
-                    name=row[0],
-                    measurement_unit=row[1]
-                )
+        path = options['path']
+        reader = READERS.get(os.path.splitext(path)[1].lower())
+        if reader is None:
+            raise CommandError('Поддерживаются только файлы .csv и .json.')
+        self.batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+        self.stdout.write(f'Загрузка {path}...')
+        started = perf_counter()
+        self.write_time = 0
+        with open(path, newline='', encoding='utf-8') as file:
+            with transaction.atomic():
+                counts = self.import_ingredients(reader(file))
+        total_time = perf_counter() - started
+        prefix = 'Без записи в базу: ' if self.dry_run else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}добавлено {counts["inserted"]}, '
+            f'обновлено {counts["updated"]}, '
+            f'без изменений {counts["unchanged"]}. '
+            f'Запись: {self.write_time:.2f} с, всего: {total_time:.2f} с.'
+        ))
+
+    def import_ingredients(self, rows):
+        existing = {
+            (name, measurement_unit): (pk, search_name)
+            for pk, name, measurement_unit, search_name
+            in Ingredient.objects.values_list(
+                'pk', 'name', 'measurement_unit', 'search_name').iterator()
+        }
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        seen = set()
+        to_create = []
+        to_update = []
+        now = timezone.now()
+        for name, measurement_unit in rows:
+            key = (name.strip(), measurement_unit.strip())
+            if key in seen:
+                continue
+            seen.add(key)
+            search_name = normalize_search_key(key[0])
+            if key not in existing:
+                to_create.append(Ingredient(
+                    name=key[0],
+                    measurement_unit=key[1],
+                    search_name=search_name,
+                ))
+                counts['inserted'] += 1
+            elif existing[key][1] != search_name:
+                to_update.append(Ingredient(
+                    pk=existing[key][0],
+                    search_name=search_name,
+                    updated=now,
+                ))
+                counts['updated'] += 1
+            else:
+                counts['unchanged'] += 1
+            if len(to_create) >= self.batch_size:
+                self.flush(Ingredient.objects.bulk_create, to_create)
+                to_create = []
+            if len(to_update) >= self.batch_size:
+                self.flush(self.bulk_update, to_update)
+                to_update = []
+        self.flush(Ingredient.objects.bulk_create, to_create)
+        self.flush(self.bulk_update, to_update)
+        return counts
+
+    @staticmethod
+    def bulk_update(ingredients):
+        Ingredient.objects.bulk_update(
+            ingredients, ['search_name', 'updated'])
+
+    def flush(self, write, ingredients):
+        if self.dry_run or not ingredients:
+            return
+        started = perf_counter()
+        write(ingredients)
+        self.write_time += perf_counter() - started
@@ -0,0 +1,86 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from recipe.models import Favorite, Recipe, ShoppingCart
+from users.models import Follow, User
+
+# Счётчик: (модель, поле счётчика, связанная модель, поле связи).
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe_id'),
+    (Recipe, 'in_carts_count', ShoppingCart, 'recipe_id'),
+    (User, 'recipes_count', Recipe, 'author_id'),
+    (User, 'followers_count', Follow, 'following_id'),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет счётчики рецептов и пользователей с данными '
+        'и исправляет расходящиеся.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только сверить счётчики, ничего не изменяя.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Количество записей, обрабатываемых за один проход.',
+        )
+
+    def handle(self, *args, **options):
+        for model, field, related_model, related_field in COUNTERS:
+            ids = model.objects.order_by('pk').values_list('pk', flat=True)
+            batch = []
+            mismatched = 0
+            for pk in ids.iterator():
+                batch.append(pk)
+                if len(batch) == options['batch_size']:
+                    mismatched += self.process_batch(
+                        model, field, related_model, related_field,
+                        batch, options['check'])
+                    batch = []
+            if batch:
+                mismatched += self.process_batch(
+                    model, field, related_model, related_field,
+                    batch, options['check'])
+            action = 'Расхождений' if options['check'] else 'Исправлено'
+            self.stdout.write(
+                f'{model._meta.label}.{field}: {action} {mismatched}.')
+
+    @staticmethod
+    def live_counts(related_model, related_field, ids):
+        return dict(
+            related_model.objects.filter(**{f'{related_field}__in': ids})
+            .order_by().values(related_field)
+            .annotate(count=Count('pk'))
+            .values_list(related_field, 'count')
+        )
+
+    def process_batch(self, model, field, related_model, related_field,
+                      ids, check):
+        """Строки с расхождениями блокируются до пересчёта, поэтому
+        параллельные изменения счётчика через F() не теряются."""
+        with transaction.atomic():
+            live = self.live_counts(related_model, related_field, ids)
+            stored = dict(
+                model.objects.filter(pk__in=ids).values_list('pk', field))
+            mismatched = [
+                pk for pk in ids if live.get(pk, 0) != stored.get(pk, 0)
+            ]
+            if check or not mismatched:
+                return len(mismatched)
+            locked = list(
+                model.objects.select_for_update()
+                .filter(pk__in=mismatched).values_list('pk', flat=True)
+            )
+            live = self.live_counts(related_model, related_field, locked)
+            model.objects.bulk_update(
+                [model(pk=pk, **{field: live.get(pk, 0)}) for pk in locked],
+                [field],
+            )
+        return len(mismatched)
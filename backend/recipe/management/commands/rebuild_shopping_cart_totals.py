@@ -0,0 +1,104 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+from recipe.models import (RecipeIngredientAmount, ShoppingCart,
+                           ShoppingCartIngredient)
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет итоги списков покупок с данными корзины '
+        'и пересобирает расходящиеся.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только сверить итоги, ничего не изменяя.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Количество пользователей, обрабатываемых за один проход.',
+        )
+
+    def handle(self, *args, **options):
+        user_ids = (
+            User.objects.filter(pk__in=ShoppingCart.objects.values('user_id'))
+            | User.objects.filter(
+                pk__in=ShoppingCartIngredient.objects.values('user_id'))
+        ).order_by('pk').values_list('pk', flat=True)
+        batch_size = options['batch_size']
+        batch = []
+        mismatched = 0
+        for user_id in user_ids:
+            batch.append(user_id)
+            if len(batch) == batch_size:
+                mismatched += self.process_batch(batch, options['check'])
+                batch = []
+        if batch:
+            mismatched += self.process_batch(batch, options['check'])
+        if options['check']:
+            self.stdout.write(
+                f'Пользователей с расхождениями: {mismatched}.')
+        else:
+            self.stdout.write(f'Пересобрано итогов: {mismatched}.')
+
+    @staticmethod
+    def live_totals(user_ids):
+        """Итоги, посчитанные по корзине запросом GROUP BY."""
+        totals = {}
+        rows = RecipeIngredientAmount.objects.filter(
+            recipe__shopping_cart__user_id__in=user_ids
+        ).order_by().values(
+            'recipe__shopping_cart__user_id', 'ingredient_id'
+        ).annotate(total=Sum('amount'))
+        for row in rows:
+            user_totals = totals.setdefault(
+                row['recipe__shopping_cart__user_id'], {})
+            user_totals[row['ingredient_id']] = row['total']
+        return totals
+
+    @staticmethod
+    def stored_totals(user_ids, lock):
+        """Сохранённые итоги. С lock строки итогов и корзин блокируются
+        до конца транзакции: добавление и удаление рецептов в корзине
+        меняют те же строки итогов и ждут пересборки, поэтому
+        их изменения не теряются при перезаписи итогов."""
+        totals = {}
+        rows = ShoppingCartIngredient.objects.filter(user_id__in=user_ids)
+        if lock:
+            rows = rows.select_for_update()
+            list(ShoppingCart.objects.select_for_update().filter(
+                user_id__in=user_ids).values_list('pk', flat=True))
+        for user_id, ingredient_id, amount in rows.values_list(
+            'user_id', 'ingredient_id', 'amount'
+        ):
+            totals.setdefault(user_id, {})[ingredient_id] = amount
+        return totals
+
+    def process_batch(self, user_ids, check):
+        with transaction.atomic():
+            stored = self.stored_totals(user_ids, lock=not check)
+            live = self.live_totals(user_ids)
+            mismatched = [
+                user_id for user_id in user_ids
+                if live.get(user_id, {}) != stored.get(user_id, {})
+            ]
+            if check or not mismatched:
+                return len(mismatched)
+            ShoppingCartIngredient.objects.filter(
+                user_id__in=mismatched).delete()
+            ShoppingCartIngredient.objects.bulk_create(
+                ShoppingCartIngredient(
+                    user_id=user_id,
+                    ingredient_id=ingredient_id,
+                    amount=amount,
+                )
+                for user_id in mismatched
+                for ingredient_id, amount in live.get(user_id, {}).items()
+            )
+        return len(mismatched)
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.19 on 2026-10-18 17:08
+
+from django.db import migrations, models
+
+
+def fill_search_name(apps, schema_editor):
+    Ingredient = apps.get_model('recipe', 'Ingredient')
+    ingredients = list(Ingredient.objects.only('id', 'name'))
+    for ingredient in ingredients:
+        ingredient.search_name = ' '.join(
+            ingredient.name.casefold().replace('ё', 'е').split())
+    Ingredient.objects.bulk_update(
+        ingredients, ['search_name'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0003_shoppingcartingredient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='search_name',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=200, verbose_name='Ключ поиска'),
+        ),
+        migrations.RunPython(fill_search_name, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.2.19 on 2026-10-18 17:14
+
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0005_recipe_image_variants_ready'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(db_index=True, default=None, help_text='Добавьте фотографию рецепта', null=True, storage=core.storage.HashedImageStorage(), upload_to='recipes/image/', verbose_name='Изображение рецепта'),
+        ),
+    ]
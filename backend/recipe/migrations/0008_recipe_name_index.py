@@ -0,0 +1,18 @@
+# Generated by Django 2.2.19 on 2026-10-18 17:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0007_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='name',
+            field=models.CharField(db_index=True, help_text='Добавьте название рецепта', max_length=200, verbose_name='Название рецепта'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+from django.db import migrations
+
+TABLE = 'recipe_search_index'
+
+
+def normalize(value):
+    return ' '.join(value.casefold().replace('ё', 'е').split())
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            f'CREATE TABLE {TABLE} ('
+            'recipe_id integer PRIMARY KEY '
+            'REFERENCES recipe_recipe (id) ON DELETE CASCADE, '
+            'document tsvector NOT NULL)'
+        )
+        schema_editor.execute(
+            f'CREATE INDEX {TABLE}_document ON {TABLE} USING GIN (document)'
+        )
+        insert = (
+            f'INSERT INTO {TABLE} (recipe_id, document) VALUES '
+            "(%s, setweight(to_tsvector('russian', %s), 'A') || "
+            "setweight(to_tsvector('russian', %s), 'B'))"
+        )
+    else:
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE {TABLE} USING fts5('
+            "name, text, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        insert = f'INSERT INTO {TABLE} (rowid, name, text) VALUES (%s, %s, %s)'
+    Recipe = apps.get_model('recipe', 'Recipe')
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(insert, [
+            (pk, normalize(name), normalize(text))
+            for pk, name, text
+            in Recipe.objects.values_list('pk', 'name', 'text').iterator()
+        ])
+
+
+def drop_search_index(apps, schema_editor):
+    schema_editor.execute(f'DROP TABLE {TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0008_recipe_name_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
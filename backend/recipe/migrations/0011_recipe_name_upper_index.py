@@ -0,0 +1,31 @@
+from django.db import migrations
+
+# Индекс для поиска в админке по началу названия без учёта регистра:
+# Django в PostgreSQL переводит name__istartswith
+# в UPPER("name"::text) LIKE UPPER(%s), а обычный индекс по name
+# для такого выражения не подходит.
+INDEX = 'recipe_recipe_name_upper_like'
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            f'CREATE INDEX {INDEX} ON recipe_recipe '
+            '((UPPER(name::text)) text_pattern_ops)'
+        )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX {INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0010_tag_bits'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -1,6 +1,15 @@
+from functools import partial
+
 from colorfield.fields import ColorField
+from core.counts import bump_generation
+from core.storage import HashedImageStorage
+from core.utils import PreserveCountersMixin, normalize_search_key
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import (DEFAULT_DB_ALIAS, connections, models, router,
+                       transaction)
+from django.utils import timezone
 from users.models import User
 
 
@@ -15,6 +24,13 @@ class Ingredient(models.Model):
         'Единицы измерения',
         max_length=200,
     )
+    search_name = models.CharField(
+        'Ключ поиска',
+        db_index=True,
+        default='',
+        editable=False,
+        max_length=200,
+    )
     created = models.DateTimeField(
         'Добавлен',
         auto_now_add=True,
@@ -32,6 +48,10 @@ class Ingredient(models.Model):
     def __str__(self):
         return f'{self.name} {self.measurement_unit}'
 
+    def save(self, *args, **kwargs):
+        self.search_name = normalize_search_key(self.name)
+        super().save(*args, **kwargs)
+
 
 class Tag(models.Model):
     """Модель для тегов."""
@@ -52,6 +72,11 @@ class Tag(models.Model):
         verbose_name='Слаг',
         unique=True,
     )
+    bit = models.PositiveSmallIntegerField(
+        'Бит в маске тегов рецепта',
+        unique=True,
+        editable=False,
+    )
     created = models.DateTimeField(
         'Добавлен',
         auto_now_add=True,
@@ -69,9 +94,213 @@ class Tag(models.Model):
     def __str__(self):
         return self.name
 
+    def get_free_bit(self):
+        """Наименьший бит в Recipe.tags_mask, не занятый другими тегами,
+        или None, если заняты все."""
+        used = set(Tag.objects.values_list('bit', flat=True))
+        return next(
+            (bit for bit in range(TAG_BITS) if bit not in used), None)
+
+    def clean(self):
+        if self.bit is None and self.get_free_bit() is None:
+            raise ValidationError(f'Нельзя создать больше {TAG_BITS} тегов.')
+
+    def save(self, *args, **kwargs):
+        """Новому тегу назначается свободный бит в Recipe.tags_mask.
+        Наличие свободного бита проверяет clean()."""
+        if self.bit is None:
+            self.bit = self.get_free_bit()
+        super().save(*args, **kwargs)
+
+
+# Количество бит в Recipe.tags_mask (BigIntegerField без знакового бита).
+TAG_BITS = 63
+TAG_BITS_CACHE_KEY = 'recipe:tag_bits'
+TAG_BITS_CACHE_TIMEOUT = 60
+# Поколения кеша (core.counts): RECIPES_SCOPE меняется при изменении
+# состава рецептов (создание, удаление, теги), ROWS_SCOPE — при
+# изменении строк рецептов без изменения состава (счётчики, копии
+# изображений, связанные данные). Количество зависит только от первого.
+RECIPES_SCOPE = 'recipes'
+ROWS_SCOPE = 'recipes:rows'
+
+
+def get_tag_bits():
+    """Словарь {slug: бит} из кеша. Сбрасывается при изменении тегов;
+    таймаут ограничивает устаревание в кешах других процессов.
+    Заполняется из основной базы, в реплике нового тега может ещё
+    не быть."""
+    bits = cache.get(TAG_BITS_CACHE_KEY)
+    if bits is None:
+        bits = dict(Tag.objects.using(DEFAULT_DB_ALIAS).values_list(
+            'slug', 'bit'))
+        cache.set(TAG_BITS_CACHE_KEY, bits, TAG_BITS_CACHE_TIMEOUT)
+    return bits
+
+
+def get_tags_mask(tags):
+    mask = 0
+    for tag in tags:
+        mask |= 1 << tag.bit
+    return mask
+
+
+class RecipeQuerySet(models.QuerySet):
+    """Набор запросов для рецептов."""
+
+    def with_related(self):
+        """Загружает автора, теги и ингредиенты рецептов
+        фиксированным числом запросов."""
+        return self.select_related('author').prefetch_related(
+            'tags',
+            models.Prefetch(
+                'ingredienttorecipe',
+                queryset=RecipeIngredientAmount.objects.select_related(
+                    'ingredient'),
+            ),
+        )
+
+    def latest_for_authors(self, author_ids, limit=None):
+        """Возвращает не более limit последних рецептов каждого из авторов
+        одним запросом: рецепты ранжируются оконной функцией ROW_NUMBER
+        внутри каждого автора в порядке Meta.ordering."""
+        queryset = self.filter(author_id__in=author_ids)
+        if limit is None or not author_ids:
+            return queryset
+        quote = connections[self.db].ops.quote_name
+        table = quote(self.model._meta.db_table)
+        placeholders = ', '.join(['%s'] * len(author_ids))
+        ranked = (
+            f'SELECT {quote("id")} FROM ('
+            f'SELECT {quote("id")}, ROW_NUMBER() OVER ('
+            f'PARTITION BY {quote("author_id")} '
+            f'ORDER BY {quote("pub_date")} DESC, {quote("name")}'
+            f') AS {quote("row_number")} '
+            f'FROM {table} WHERE {quote("author_id")} IN ({placeholders})'
+            f') {quote("ranked")} WHERE {quote("row_number")} <= %s'
+        )
+        return queryset.extra(
+            where=[f'{table}.{quote("id")} IN ({ranked})'],
+            params=(*author_ids, limit),
+        )
+
+    @staticmethod
+    def touch_rows():
+        """Делает устаревшими закешированные версии списков рецептов
+        после update(), который меняет строки рецептов в обход save()
+        и сигналов."""
+        transaction.on_commit(partial(bump_generation, ROWS_SCOPE))
+
+    def touch(self):
+        """Обновляет время изменения рецептов, чьё представление
+        в API изменилось вместе со связанными данными: автором,
+        тегами, ингредиентами."""
+        updated = self.update(updated=timezone.now())
+        if updated:
+            self.touch_rows()
+        return updated
+
+    def mark_image_variants_ready(self, pk, name):
+        """Отмечает, что копии изображения name рецепта pk созданы,
+        если изображение за это время не заменили."""
+        updated = self.filter(pk=pk, image=name).update(
+            image_variants_ready=True, updated=timezone.now())
+        if updated:
+            self.touch_rows()
+        return updated
+
+    def delete(self):
+        """Удаляет рецепты, предварительно убрав их из корзин
+        и избранного пакетно (delete_user_marks)."""
+        with transaction.atomic(using=self.db):
+            self.delete_user_marks()
+            return super().delete()
+
+    def delete_user_marks(self):
+        """Убирает рецепты из корзин и избранного без сигналов на каждую
+        строку: при каскадном удалении популярного рецепта сигнал
+        pre_delete корзины выполнил бы запросы для каждой корзины.
+        Итоги списков покупок уменьшаются одним apply_recipe_change
+        на рецепт, кеш количества сбрасывается для каждого
+        пользователя, счётчики удаляемых рецептов не обновляются."""
+        user_ids = set()
+        for recipe_id in self.values_list('pk', flat=True):
+            ShoppingCartIngredient.objects.apply_recipe_change(
+                recipe_id, get_recipe_amounts(recipe_id), {})
+        for model in (Favorite, ShoppingCart):
+            marks = model.objects.using(self.db).filter(recipe__in=self)
+            user_ids.update(marks.values_list('user_id', flat=True))
+            marks._raw_delete(self.db)
+        for user_id in user_ids:
+            transaction.on_commit(
+                partial(bump_generation, f'user:{user_id}'), using=self.db)
+
+    def release_image(self, name):
+        """Удаляет файл изображения, если на него больше не ссылается
+        ни один рецепт. Одно изображение может принадлежать нескольким
+        рецептам: хранилище не записывает одинаковые файлы повторно.
+        Ссылки проверяются в основной базе под блокировкой хранилища."""
+        if name:
+            self.model._meta.get_field('image').storage.delete_unused(
+                name,
+                self.using(DEFAULT_DB_ALIAS).filter(image=name).exists,
+            )
 
-class Recipe(models.Model):
+    def change_counter(self, pk, field, delta):
+        """Атомарно изменяет счётчик рецепта и время его изменения:
+        счётчики входят в ответ API и в его версию для условных
+        запросов. Счётчик не уменьшается ниже нуля, расхождения
+        исправляет команда rebuild_counters."""
+        queryset = self.filter(pk=pk)
+        if delta < 0:
+            queryset = queryset.filter(**{f'{field}__gte': -delta})
+        updated = queryset.update(**{
+            field: models.F(field) + delta,
+            'updated': timezone.now(),
+        })
+        if updated:
+            self.touch_rows()
+        return updated
+
+    def set_tags_mask(self, recipe, tags):
+        """Сохраняет маску тегов рецепта без вызова save()."""
+        recipe.tags_mask = get_tags_mask(tags)
+        return self.filter(pk=recipe.pk).update(tags_mask=recipe.tags_mask)
+
+    def with_tags(self, slugs, match_all=False):
+        """Рецепты с любым (или со всеми) из тегов slugs: одно условие
+        на маску строки рецепта, без соединения с тегами и DISTINCT."""
+        bits = get_tag_bits()
+        mask = 0
+        for slug in slugs:
+            mask |= 1 << bits[slug]
+        queryset = self.annotate(
+            tags_match=models.F('tags_mask').bitand(mask))
+        if match_all:
+            return queryset.filter(tags_match=mask)
+        return queryset.filter(tags_match__gt=0)
+
+    def annotate_user_flags(self, user):
+        """Добавляет к рецептам признаки is_favorited
+        и is_in_shopping_cart для переданного пользователя."""
+        if user.is_anonymous:
+            return self.annotate(
+                is_favorited=models.Value(
+                    False, output_field=models.BooleanField()),
+                is_in_shopping_cart=models.Value(
+                    False, output_field=models.BooleanField()),
+            )
+        return self.annotate(
+            is_favorited=models.Exists(Favorite.objects.filter(
+                user=user, recipe=models.OuterRef('pk'))),
+            is_in_shopping_cart=models.Exists(ShoppingCart.objects.filter(
+                user=user, recipe=models.OuterRef('pk'))),
+        )
+
+
+class Recipe(PreserveCountersMixin, models.Model):
     """Модель рецептов."""
+    counter_fields = ('favorites_count', 'in_carts_count')
     author = models.ForeignKey(
         User,
         verbose_name='Автор рецепта',
@@ -82,13 +311,21 @@ class Recipe(models.Model):
         'Название рецепта',
         max_length=200,
         help_text='Добавьте название рецепта',
+        db_index=True,
     )
     image = models.ImageField(
         'Изображение рецепта',
         help_text='Добавьте фотографию рецепта',
         upload_to='recipes/image/',
+        storage=HashedImageStorage(),
         null=True,
         default=None,
+        db_index=True,
+    )
+    image_variants_ready = models.BooleanField(
+        'Копии изображения созданы',
+        default=False,
+        editable=False,
     )
     text = models.TextField(
         'Описание рецепта',
@@ -105,12 +342,28 @@ class Recipe(models.Model):
         verbose_name='Теги рецептов',
         related_name='recipes',
     )
+    tags_mask = models.BigIntegerField(
+        'Маска тегов',
+        default=0,
+        editable=False,
+        help_text='Сумма 2 ** Tag.bit по тегам рецепта',
+    )
     cooking_time = models.PositiveSmallIntegerField(
         verbose_name='Время приготовления',
         help_text='Введите время приготовления в минутах',
         default=1,
         validators=[MinValueValidator(1)],
     )
+    favorites_count = models.PositiveIntegerField(
+        'В избранном',
+        default=0,
+        editable=False,
+    )
+    in_carts_count = models.PositiveIntegerField(
+        'В списках покупок',
+        default=0,
+        editable=False,
+    )
     pub_date = models.DateTimeField(
         'Дата публикации',
         auto_now_add=True,
@@ -125,6 +378,8 @@ class Recipe(models.Model):
         auto_now=True,
     )
 
+    objects = RecipeQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
@@ -133,6 +388,25 @@ class Recipe(models.Model):
     def __str__(self):
         return f'{self.name} {self.author}'
 
+    def delete(self, using=None, keep_parents=False):
+        using = using or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            type(self).objects.using(using).filter(
+                pk=self.pk).delete_user_marks()
+            return super().delete(using, keep_parents)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Запоминает загруженные изображение и автора: после замены
+        изображения освобождается старый файл, после смены автора
+        пересчитываются счётчики рецептов."""
+        instance = super().from_db(db, field_names, values)
+        if 'image' in field_names:
+            instance._loaded_image = instance.image.name
+        if 'author_id' in field_names:
+            instance._loaded_author_id = instance.author_id
+        return instance
+
 
 class FavoriteShoppingList(models.Model):
     user = models.ForeignKey(
@@ -217,3 +491,93 @@ class RecipeIngredientAmount(models.Model):
         return (
             f'{self.ingredient.name} :: {self.ingredient.measurement_unit}'
             f' - {self.amount}')
+
+
+class ShoppingCartIngredientManager(models.Manager):
+
+    def apply(self, user_ids, amounts):
+        """Прибавляет amounts ({id ингредиента: изменение количества})
+        к итогам списка покупок пользователей user_ids.
+        Строки с нулевым количеством удаляются."""
+        amounts = {
+            ingredient_id: amount
+            for ingredient_id, amount in amounts.items() if amount
+        }
+        user_ids = list(user_ids)
+        if not user_ids or not amounts:
+            return
+        self.bulk_create(
+            [self.model(user_id=user_id, ingredient_id=ingredient_id, amount=0)
+             for user_id in user_ids for ingredient_id in amounts],
+            ignore_conflicts=True,
+        )
+        rows = self.filter(user_id__in=user_ids, ingredient_id__in=amounts)
+        rows.update(amount=models.F('amount') + models.Case(
+            *[models.When(ingredient_id=ingredient_id, then=amount)
+              for ingredient_id, amount in amounts.items()],
+            default=0,
+            output_field=models.IntegerField(),
+        ))
+        rows.filter(amount__lte=0).delete()
+
+    def apply_recipe_change(self, recipe, old_amounts, new_amounts):
+        """Переносит изменение ингредиентов рецепта в списки покупок
+        всех пользователей, у которых этот рецепт в корзине."""
+        amounts = {
+            ingredient_id: (
+                new_amounts.get(ingredient_id, 0)
+                - old_amounts.get(ingredient_id, 0)
+            )
+            for ingredient_id in {*old_amounts, *new_amounts}
+        }
+        if not any(amounts.values()):
+            return
+        self.apply(
+            ShoppingCart.objects.filter(recipe=recipe).values_list(
+                'user_id', flat=True),
+            amounts,
+        )
+
+
+class ShoppingCartIngredient(models.Model):
+    """Итоговое количество ингредиента в списке покупок пользователя.
+    Обновляется при добавлении и удалении рецептов из корзины и при
+    изменении ингредиентов рецептов, которые в ней лежат."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_ingredients',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Ингредиент',
+    )
+    amount = models.IntegerField(
+        verbose_name='Количество',
+    )
+
+    objects = ShoppingCartIngredientManager()
+
+    class Meta:
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Ингредиенты в списке покупок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_cart_ingredient',
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient} - {self.amount}'
+
+
+def get_recipe_amounts(recipe_id):
+    """Количество каждого ингредиента в рецепте: {id ингредиента: amount}."""
+    return dict(
+        RecipeIngredientAmount.objects.filter(recipe_id=recipe_id)
+        .order_by().values_list('ingredient_id', 'amount')
+    )
@@ -0,0 +1,122 @@
+"""Полнотекстовый поиск рецептов по названию и описанию.
+
+Индекс хранится в отдельной таблице SEARCH_TABLE, которую создаёт
+миграция 0009_recipe_search_index. В PostgreSQL это столбец tsvector
+с GIN-индексом и русской конфигурацией, название весит больше описания.
+В SQLite — виртуальная таблица FTS5, rowid которой равен id рецепта.
+Индекс обновляется сигналами при сохранении и удалении рецепта.
+Текст и запрос приводятся к одному виду normalize_search_key,
+поэтому «свекла» находит «Свёкла».
+"""
+from core.utils import normalize_search_key
+from django.db import connections
+
+SEARCH_TABLE = 'recipe_search_index'
+SEARCH_CONFIG = 'russian'
+POSTGRES_DOCUMENT = (
+    f"setweight(to_tsvector('{SEARCH_CONFIG}', %s), 'A') || "
+    f"setweight(to_tsvector('{SEARCH_CONFIG}', %s), 'B')"
+)
+POSTGRES_QUERY = f"plainto_tsquery('{SEARCH_CONFIG}', %s)"
+
+
+def fts5_query(query):
+    """Запрос FTS5, в котором каждое слово — отдельная фраза,
+    поэтому спецсимволы синтаксиса FTS5 не интерпретируются."""
+    return ' '.join(
+        '"{}"'.format(word.replace('"', '""')) for word in query.split())
+
+
+def index_recipe(recipe, using='default'):
+    connection = connections[using]
+    document = (
+        recipe.pk,
+        normalize_search_key(recipe.name),
+        normalize_search_key(recipe.text),
+    )
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                f'INSERT INTO {SEARCH_TABLE} (recipe_id, document) '
+                f'VALUES (%s, {POSTGRES_DOCUMENT}) '
+                'ON CONFLICT (recipe_id) '
+                'DO UPDATE SET document = EXCLUDED.document',
+                document,
+            )
+            return
+        cursor.execute(
+            f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', (recipe.pk, ))
+        cursor.execute(
+            f'INSERT INTO {SEARCH_TABLE} (rowid, name, text) '
+            'VALUES (%s, %s, %s)',
+            document,
+        )
+
+
+def index_recipes(recipes, using='default'):
+    """Добавляет в индекс новые рецепты, созданные через bulk_create."""
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        sql = (
+            f'INSERT INTO {SEARCH_TABLE} (recipe_id, document) '
+            f'VALUES (%s, {POSTGRES_DOCUMENT})'
+        )
+    else:
+        sql = (
+            f'INSERT INTO {SEARCH_TABLE} (rowid, name, text) '
+            'VALUES (%s, %s, %s)'
+        )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            (
+                recipe.pk,
+                normalize_search_key(recipe.name),
+                normalize_search_key(recipe.text),
+            )
+            for recipe in recipes
+        ])
+
+
+def unindex_recipe(pk, using='default'):
+    connection = connections[using]
+    column = 'recipe_id' if connection.vendor == 'postgresql' else 'rowid'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {SEARCH_TABLE} WHERE {column} = %s', (pk, ))
+
+
+def search_recipes(queryset, query):
+    """Оставляет рецепты, подходящие под запрос, и добавляет
+    релевантность search_rank: чем больше, тем выше рецепт."""
+    query = normalize_search_key(query)
+    if not query:
+        return queryset
+    connection = connections[queryset.db]
+    quote = connection.ops.quote_name
+    recipe_id = f'{quote(queryset.model._meta.db_table)}.{quote("id")}'
+    if connection.vendor == 'postgresql':
+        where = (
+            f'{recipe_id} IN (SELECT recipe_id FROM {SEARCH_TABLE} '
+            f'WHERE document @@ {POSTGRES_QUERY})'
+        )
+        rank = (
+            f'(SELECT ts_rank(document, {POSTGRES_QUERY}) '
+            f'FROM {SEARCH_TABLE} WHERE recipe_id = {recipe_id})'
+        )
+    else:
+        query = fts5_query(query)
+        where = (
+            f'{recipe_id} IN (SELECT rowid FROM {SEARCH_TABLE} '
+            f'WHERE {SEARCH_TABLE} MATCH %s)'
+        )
+        # bm25 тем меньше, чем выше релевантность.
+        rank = (
+            f'(SELECT -bm25({SEARCH_TABLE}, 2.0, 1.0) FROM {SEARCH_TABLE} '
+            f'WHERE {SEARCH_TABLE} MATCH %s AND rowid = {recipe_id})'
+        )
+    return queryset.extra(
+        select={'search_rank': rank},
+        select_params=(query, ),
+        where=[where],
+        params=(query, ),
+    ).order_by('-search_rank', '-pub_date')
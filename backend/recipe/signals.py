@@ -0,0 +1,207 @@
+from functools import partial
+
+from core.counts import bump_generation
+from core.images import schedule_variants
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+from django.utils import timezone
+from recipe.models import (RECIPES_SCOPE, TAG_BITS_CACHE_KEY, Favorite,
+                           Ingredient, Recipe, ShoppingCart,
+                           ShoppingCartIngredient, Tag, get_recipe_amounts)
+from recipe.search import index_recipe, unindex_recipe
+from users.models import User
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_shopping_cart_totals(sender, instance, created, **kwargs):
+    """Добавляет ингредиенты рецепта в итоги списка покупок."""
+    if created:
+        ShoppingCartIngredient.objects.apply(
+            [instance.user_id], get_recipe_amounts(instance.recipe_id)
+        )
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def remove_from_shopping_cart_totals(sender, instance, **kwargs):
+    """Вычитает ингредиенты рецепта из итогов списка покупок.
+    При удалении рецепта корзины убирает RecipeQuerySet.delete_user_marks
+    одним запросом на рецепт; этот сигнал остаётся для удаления
+    отдельных корзин и каскадного удаления рецептов вместе с автором.
+    Используется pre_delete: при каскаде ингредиенты рецепта
+    ещё не удалены."""
+    amounts = get_recipe_amounts(instance.recipe_id)
+    ShoppingCartIngredient.objects.apply(
+        [instance.user_id],
+        {ingredient_id: -amount for ingredient_id, amount in amounts.items()},
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def create_image_variants(sender, instance, raw=False, **kwargs):
+    """После фиксации транзакции ставит в очередь создание
+    уменьшенных копий нового изображения рецепта."""
+    if raw or not instance.image or instance.image_variants_ready:
+        return
+    on_done = partial(
+        Recipe.objects.mark_image_variants_ready,
+        instance.pk, instance.image.name,
+    )
+    transaction.on_commit(
+        partial(schedule_variants, instance.image, on_done))
+
+
+@receiver(post_save, sender=Recipe)
+def release_replaced_image(sender, instance, raw=False, **kwargs):
+    """Освобождает прежний файл изображения после его замены."""
+    loaded = getattr(instance, '_loaded_image', None)
+    instance._loaded_image = instance.image.name
+    if raw or not loaded or loaded == instance.image.name:
+        return
+    transaction.on_commit(partial(Recipe.objects.release_image, loaded))
+
+
+@receiver(post_delete, sender=Recipe)
+def release_deleted_image(sender, instance, **kwargs):
+    """Освобождает файл изображения удалённого рецепта."""
+    if instance.image:
+        transaction.on_commit(
+            partial(Recipe.objects.release_image, instance.image.name))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(post_delete, sender=Tag)
+def invalidate_recipe_counts(sender, action=None, **kwargs):
+    """Сбрасывает кеш количества рецептов, в том числе после удаления
+    тега: его бит снимается с рецептов. Поколение меняется после
+    фиксации транзакции, иначе параллельный запрос мог бы сохранить
+    в новом поколении количество, посчитанное по старым данным."""
+    if action is None or action.startswith('post_'):
+        transaction.on_commit(partial(bump_generation, RECIPES_SCOPE))
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+def invalidate_user_recipe_counts(sender, instance, **kwargs):
+    """Сбрасывает кеш количества рецептов в избранном
+    и в корзине пользователя."""
+    transaction.on_commit(
+        partial(bump_generation, f'user:{instance.user_id}'))
+
+
+COUNTER_FIELDS = {
+    Favorite: 'favorites_count',
+    ShoppingCart: 'in_carts_count',
+}
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+def increment_recipe_counter(sender, instance, created, raw=False, **kwargs):
+    """Увеличивает счётчик рецепта в избранном или в списках покупок."""
+    if created and not raw:
+        Recipe.objects.change_counter(
+            instance.recipe_id, COUNTER_FIELDS[sender], 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+def decrement_recipe_counter(sender, instance, **kwargs):
+    Recipe.objects.change_counter(
+        instance.recipe_id, COUNTER_FIELDS[sender], -1)
+
+
+def change_recipes_count(author_id, delta):
+    User.objects.filter(
+        pk=author_id, recipes_count__gte=-delta,
+    ).update(recipes_count=F('recipes_count') + delta)
+
+
+@receiver(post_save, sender=Recipe)
+def update_author_recipes_count(sender, instance, created, raw=False,
+                                **kwargs):
+    """Пересчитывает счётчики рецептов автора, в том числе
+    при передаче рецепта другому автору."""
+    loaded = getattr(instance, '_loaded_author_id', None)
+    instance._loaded_author_id = instance.author_id
+    if raw:
+        return
+    if created:
+        change_recipes_count(instance.author_id, 1)
+    elif loaded is not None and loaded != instance.author_id:
+        change_recipes_count(loaded, -1)
+        change_recipes_count(instance.author_id, 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_author_recipes_count(sender, instance, **kwargs):
+    change_recipes_count(instance.author_id, -1)
+
+
+@receiver(post_save, sender=Recipe)
+def update_search_index(sender, instance, raw=False, using='default',
+                        update_fields=None, **kwargs):
+    """Обновляет полнотекстовый индекс при изменении названия
+    или описания рецепта."""
+    if update_fields is None or {'name', 'text'} & set(update_fields):
+        index_recipe(instance, using)
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_from_search_index(sender, instance, using='default', **kwargs):
+    unindex_recipe(instance.pk, using)
+
+
+@receiver(post_save, sender=User)
+def touch_author_recipes(sender, instance, created, raw=False,
+                         update_fields=None, **kwargs):
+    """Автор входит в ответ с рецептом, поэтому его изменение меняет
+    версию рецептов для условных запросов. Время входа в ответ
+    не входит."""
+    if created or raw or update_fields == frozenset(('last_login', )):
+        return
+    Recipe.objects.filter(author=instance).touch()
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def touch_related_recipes(sender, instance, created, raw=False, **kwargs):
+    """Изменение тега или ингредиента меняет версию рецептов с ним."""
+    if created or raw:
+        return
+    field = 'tags' if sender is Tag else 'ingredients'
+    Recipe.objects.filter(**{field: instance}).touch()
+
+
+@receiver(pre_delete, sender=Ingredient)
+def touch_recipes_before_ingredient_delete(sender, instance, **kwargs):
+    """Строки ингредиента в рецептах удаляются каскадом, без сигналов,
+    поэтому рецепты отмечаются до удаления."""
+    Recipe.objects.filter(ingredients=instance).touch()
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def reset_tag_bits(sender, **kwargs):
+    cache.delete(TAG_BITS_CACHE_KEY)
+
+
+@receiver(post_delete, sender=Tag)
+def clear_tag_bit(sender, instance, **kwargs):
+    """Снимает бит удалённого тега с рецептов, чтобы его можно было
+    назначить новому тегу. Тег пропадает из ответа с рецептом,
+    поэтому меняется и время изменения рецептов."""
+    bit = 1 << instance.bit
+    updated = Recipe.objects.annotate(
+        has_tag=F('tags_mask').bitand(bit),
+    ).filter(has_tag=bit).update(
+        tags_mask=F('tags_mask') - bit, updated=timezone.now())
+    if updated:
+        Recipe.objects.touch_rows()
@@ -0,0 +1,250 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from recipe.models import (Favorite, Ingredient, Recipe,
+                           RecipeIngredientAmount, ShoppingCart,
+                           ShoppingCartIngredient, Tag, get_tags_mask)
+from users.models import Follow, User
+
+
+def call(name, *args):
+    output = StringIO()
+    call_command(name, *args, stdout=output, stderr=StringIO())
+    return output.getvalue()
+
+
+class ShoppingCartTotalsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        cls.flour = Ingredient.objects.create(
+            name='Мука', measurement_unit='г')
+        cls.milk = Ingredient.objects.create(
+            name='Молоко', measurement_unit='мл')
+
+    def create_recipe(self, amounts):
+        recipe = Recipe.objects.create(
+            author=self.author, name='Рецепт', text='Описание',
+            cooking_time=10)
+        RecipeIngredientAmount.objects.bulk_create(
+            RecipeIngredientAmount(
+                recipe=recipe, ingredient=ingredient, amount=amount)
+            for ingredient, amount in amounts.items()
+        )
+        return recipe
+
+    def create_users(self, count):
+        return [
+            User.objects.create_user(
+                username=f'user{number}', email=f'user{number}@example.com',
+                password='pass')
+            for number in range(count)
+        ]
+
+    def totals(self, user):
+        return dict(
+            ShoppingCartIngredient.objects.filter(user=user)
+            .values_list('ingredient__name', 'amount'))
+
+    def test_add_and_remove(self):
+        user, = self.create_users(1)
+        pancakes = self.create_recipe({self.flour: 200, self.milk: 300})
+        bread = self.create_recipe({self.flour: 500})
+        ShoppingCart.objects.create(user=user, recipe=pancakes)
+        cart = ShoppingCart.objects.create(user=user, recipe=bread)
+        self.assertEqual(self.totals(user), {'Мука': 700, 'Молоко': 300})
+        cart.delete()
+        self.assertEqual(self.totals(user), {'Мука': 200, 'Молоко': 300})
+
+    def delete_recipe_queries(self, carts):
+        recipe = self.create_recipe({self.flour: 200, self.milk: 300})
+        kept = self.create_recipe({self.flour: 50})
+        users = self.create_users(carts)
+        for user in users:
+            ShoppingCart.objects.create(user=user, recipe=recipe)
+            ShoppingCart.objects.create(user=user, recipe=kept)
+        with CaptureQueriesContext(connection) as queries:
+            recipe.delete()
+        for user in users:
+            self.assertEqual(self.totals(user), {'Мука': 50})
+        return len(queries)
+
+    def test_recipe_delete_is_set_based(self):
+        queries = self.delete_recipe_queries(2)
+        ShoppingCart.objects.all().delete()
+        User.objects.exclude(pk=self.author.pk).delete()
+        self.assertEqual(self.delete_recipe_queries(6), queries)
+
+    def test_queryset_delete(self):
+        user, = self.create_users(1)
+        recipe = self.create_recipe({self.flour: 200})
+        ShoppingCart.objects.create(user=user, recipe=recipe)
+        Recipe.objects.filter(pk=recipe.pk).delete()
+        self.assertEqual(self.totals(user), {})
+        self.assertFalse(ShoppingCart.objects.exists())
+
+
+class RebuildShoppingCartTotalsTests(TestCase):
+
+    def setUp(self):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        self.user = User.objects.create_user(
+            username='user', email='user@example.com', password='pass')
+        self.flour = Ingredient.objects.create(
+            name='Мука', measurement_unit='г')
+        recipe = Recipe.objects.create(
+            author=author, name='Рецепт', text='Описание', cooking_time=10)
+        RecipeIngredientAmount.objects.create(
+            recipe=recipe, ingredient=self.flour, amount=200)
+        ShoppingCart.objects.create(user=self.user, recipe=recipe)
+        ShoppingCartIngredient.objects.filter(user=self.user).update(
+            amount=1)
+
+    def rebuild(self, *args):
+        return call('rebuild_shopping_cart_totals', *args)
+
+    def amount(self):
+        return ShoppingCartIngredient.objects.get(
+            user=self.user, ingredient=self.flour).amount
+
+    def test_check(self):
+        self.assertIn('расхождениями: 1', self.rebuild('--check'))
+        self.assertEqual(self.amount(), 1)
+
+    def test_rebuild(self):
+        self.assertIn('Пересобрано итогов: 1', self.rebuild())
+        self.assertEqual(self.amount(), 200)
+        self.assertIn('расхождениями: 0', self.rebuild('--check'))
+
+
+class CounterTests(TestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        self.user = User.objects.create_user(
+            username='user', email='user@example.com', password='pass')
+        self.recipe = Recipe.objects.create(
+            author=self.author, name='Рецепт', text='Описание',
+            cooking_time=10)
+
+    def counters(self):
+        self.recipe.refresh_from_db()
+        return self.recipe.favorites_count, self.recipe.in_carts_count
+
+    def test_favorites_and_carts(self):
+        favorite = Favorite.objects.create(user=self.user, recipe=self.recipe)
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipe)
+        self.assertEqual(self.counters(), (1, 1))
+        favorite.delete()
+        self.assertEqual(self.counters(), (0, 1))
+
+    def test_recipes_count(self):
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 1)
+        self.recipe.author = self.user
+        self.recipe.save()
+        self.author.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual(
+            (self.author.recipes_count, self.user.recipes_count), (0, 1))
+        self.recipe.delete()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.recipes_count, 0)
+
+    def test_rebuild_counters(self):
+        Favorite.objects.create(user=self.user, recipe=self.recipe)
+        Follow.objects.create(user=self.user, following=self.author)
+        Recipe.objects.update(favorites_count=5)
+        User.objects.update(followers_count=3, recipes_count=0)
+        self.assertIn('Recipe.favorites_count: Расхождений 1',
+                      call('rebuild_counters', '--check'))
+        call('rebuild_counters', '--batch-size', '1')
+        self.assertEqual(self.counters(), (1, 0))
+        self.assertEqual(
+            dict(User.objects.values_list(
+                'username', 'followers_count')),
+            {'author': 1, 'user': 0})
+        self.assertEqual(
+            User.objects.get(pk=self.author.pk).recipes_count, 1)
+        self.assertNotRegex(
+            call('rebuild_counters', '--check'), r'Расхождений [1-9]')
+
+
+class ExportImportTests(TestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        self.tag = Tag.objects.create(
+            name='Завтрак', color='#E26C2D', slug='breakfast')
+        self.flour = Ingredient.objects.create(
+            name='Мука', measurement_unit='г')
+        recipe = Recipe.objects.create(
+            author=self.author, name='Блины', text='Описание',
+            cooking_time=20)
+        recipe.tags.set([self.tag])
+        Recipe.objects.set_tags_mask(recipe, [self.tag])
+        RecipeIngredientAmount.objects.create(
+            recipe=recipe, ingredient=self.flour, amount=200)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'recipes.jsonl')
+
+    def test_round_trip(self):
+        call('export_recipes', '--path', self.path)
+        with open(self.path, encoding='utf-8') as file:
+            exported = [json.loads(line) for line in file]
+        self.assertEqual(exported[0]['ingredients'], [
+            {'name': 'Мука', 'measurement_unit': 'г', 'amount': 200}])
+        Recipe.objects.all().delete()
+        call('import_recipes', '--path', self.path)
+        recipe = Recipe.objects.get()
+        self.assertEqual(recipe.name, 'Блины')
+        self.assertEqual(list(recipe.tags.all()), [self.tag])
+        self.assertEqual(
+            list(recipe.ingredienttorecipe.values_list(
+                'ingredient', 'amount')),
+            [(self.flour.pk, 200)])
+        self.assertEqual(recipe.tags_mask, get_tags_mask([self.tag]))
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 1)
+
+    def test_unknown_author(self):
+        call('export_recipes', '--path', self.path)
+        Recipe.objects.all().delete()
+        self.author.delete()
+        with self.assertRaises(CommandError):
+            call('import_recipes', '--path', self.path)
+        call('import_recipes', '--path', self.path, '--create-authors')
+        self.assertEqual(Recipe.objects.get().author.username, 'author')
+
+
+class GenerateDatasetTests(TestCase):
+
+    def test_consistent_data(self):
+        Tag.objects.create(name='Завтрак', color='#E26C2D', slug='breakfast')
+        for name in ('Мука', 'Молоко', 'Яйца'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+        call(
+            'generate_dataset', '--users', '5', '--recipes', '12',
+            '--follows', '2', '--favorites', '3', '--carts', '2',
+        )
+        self.assertEqual(User.objects.count(), 5)
+        self.assertEqual(Recipe.objects.count(), 12)
+        self.assertNotRegex(
+            call('rebuild_counters', '--check'), r'Расхождений [1-9]')
+        self.assertIn(
+            'расхождениями: 0',
+            call('rebuild_shopping_cart_totals', '--check'))
+        with self.assertRaises(CommandError):
+            call('generate_dataset', '--users', '1', '--recipes', '1')
@@ -1,25 +1,31 @@
+from core.admin import IndexedSearchMixin
 from django.contrib import admin
 from users.models import Follow, User
 
 
 @admin.register(User)
-class UserAdmin(admin.ModelAdmin):
+class UserAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = (
         'username',
         'email',
+        'recipes_count',
+        'followers_count',
     )
     list_filter = (
-        'username',
-        'email',
+        'is_staff',
+        'is_active',
     )
     search_fields = (
         'username',
         'email',
     )
+    show_full_result_count = False
 
 
 @admin.register(Follow)
-class FollowAdmin(admin.ModelAdmin):
+class FollowAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ('user', 'following', )
-    list_filter = ('user', )
-    search_fields = ('user', )
+    list_select_related = ('user', 'following', )
+    search_fields = ('user__username', 'following__username', )
+    autocomplete_fields = ('user', 'following', )
+    show_full_result_count = False
@@ -0,0 +1,85 @@
+import hashlib
+
+from core.utils import is_shared_cache
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+TOKEN_CACHE_KEY = 'auth:token:{}'
+# Запись-метка отозванного токена: пока она в кеше, токен
+# не кешируется заново, даже если параллельный запрос успел
+# прочитать его из базы до отзыва.
+REVOKED = 'revoked'
+REVOKED_TIMEOUT = 30
+
+
+def token_cache_key(key):
+    """Ключ кеша по хешу токена, чтобы сам токен не попадал в кеш."""
+    return TOKEN_CACHE_KEY.format(hashlib.sha256(key.encode()).hexdigest())
+
+
+def revoke_cached_token(key):
+    cache.set(token_cache_key(key), REVOKED, REVOKED_TIMEOUT)
+
+
+def revoke_user_tokens(user_ids):
+    """Убирает из кеша токены пользователей. Вызывается сигналом
+    при сохранении пользователя; после QuerySet.update(), который
+    сигналов не отправляет (например, update(is_active=False)),
+    его нужно вызвать явно, иначе токен из кеша действует
+    до TOKEN_CACHE_TIMEOUT секунд."""
+    from rest_framework.authtoken.models import Token
+
+    if not is_shared_cache():
+        return
+    for key in Token.objects.filter(user__in=user_ids).values_list(
+        'key', flat=True
+    ):
+        revoke_cached_token(key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication, который хранит токен вместе с пользователем
+    в кеше Django на TOKEN_CACHE_TIMEOUT секунд, поэтому запрос
+    Token JOIN User выполняется только при промахе кеша.
+
+    Запись удаляется сигналами при удалении токена (выход через
+    auth/token/logout) и при сохранении пользователя (смена пароля,
+    деактивация), а после QuerySet.update() — вызовом
+    revoke_user_tokens. Отзыв должен дойти до всех процессов,
+    поэтому кеш используется, только если он общий (is_shared_cache);
+    с LocMemCache каждый запрос читает токен из базы.
+    request.user — тот же объект User, что и у TokenAuthentication.
+    Токен читается из основной базы: в реплике он может быть ещё
+    не создан или не удалён.
+    """
+
+    def authenticate_credentials(self, key):
+        if not is_shared_cache():
+            return self.check_user(self.get_token(key))
+        cache_key = token_cache_key(key)
+        token = cache.get(cache_key)
+        if token is None or token == REVOKED:
+            revoked = token == REVOKED
+            token = self.get_token(key)
+            if not revoked and token.user.is_active:
+                cache.add(cache_key, token, settings.TOKEN_CACHE_TIMEOUT)
+        return self.check_user(token)
+
+    def get_token(self, key):
+        model = self.get_model()
+        try:
+            return model.objects.using(
+                DEFAULT_DB_ALIAS).select_related('user').get(key=key)
+        except model.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+    @staticmethod
+    def check_user(token):
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.'))
+        return token.user, token
@@ -0,0 +1,36 @@
+from django.db import migrations
+
+# Индексы для поиска в админке по началу имени и почты без учёта
+# регистра: Django в PostgreSQL переводит username__istartswith
+# в UPPER("username"::text) LIKE UPPER(%s), а обычный индекс по полю
+# для такого выражения не подходит.
+INDEXES = {
+    'users_user_username_upper_like': 'username',
+    'users_user_email_upper_like': 'email',
+}
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for index, column in INDEXES.items():
+            schema_editor.execute(
+                f'CREATE INDEX {index} ON users_user '
+                f'((UPPER({column}::text)) text_pattern_ops)'
+            )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for index in INDEXES:
+            schema_editor.execute(f'DROP INDEX {index}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -1,11 +1,13 @@
+from core.utils import PreserveCountersMixin
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.validators import UnicodeUsernameValidator
 from django.core.exceptions import ValidationError
 from django.db import models
 
 
-class User(AbstractUser):
+class User(PreserveCountersMixin, AbstractUser):
     """Модель пользователя."""
+    counter_fields = ('recipes_count', 'followers_count')
 
     first_name = models.CharField(
         'Имя',
@@ -26,6 +28,16 @@ class User(AbstractUser):
         max_length=200,
         unique=True,
     )
+    recipes_count = models.PositiveIntegerField(
+        'Количество рецептов',
+        default=0,
+        editable=False,
+    )
+    followers_count = models.PositiveIntegerField(
+        'Количество подписчиков',
+        default=0,
+        editable=False,
+    )
 
     class Meta:
         verbose_name = 'Пользователь'
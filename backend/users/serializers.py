@@ -1,5 +1,4 @@
-from django.db.models import Count
-from django.shortcuts import get_object_or_404
+from core.utils import ImageVariantsField
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from recipe.models import Recipe
 from rest_framework import serializers, validators
@@ -22,9 +21,20 @@ class CustomUserSerializer(UserSerializer):
 
     def get_is_subscribed(self, obj):
         request = self.context.get('request')
-        if self.context.get('request').user.is_anonymous:
+        if request is None or request.user.is_anonymous:
             return False
-        return obj.following.filter(user=request.user).exists()
+        return obj.pk in self.get_following_ids(request.user)
+
+    def get_following_ids(self, user):
+        """Возвращает id авторов, на которых подписан пользователь.
+        Запрос выполняется один раз и сохраняется в контексте,
+        общем для всех вложенных сериализаторов."""
+        if 'following_ids' not in self.context:
+            self.context['following_ids'] = set(
+                Follow.objects.filter(user=user).values_list(
+                    'following_id', flat=True)
+            )
+        return self.context['following_ids']
 
 
 class CreateUserSerializer(UserCreateSerializer):
@@ -40,6 +50,7 @@ class CreateUserSerializer(UserCreateSerializer):
 
 class FollowRecipeSerializer(serializers.ModelSerializer):
     """Сериализатор подписок."""
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
@@ -47,6 +58,7 @@ class FollowRecipeSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'image_variants',
             'cooking_time',
         )
 
@@ -55,29 +67,27 @@ class GetFollowSerializer(serializers.ModelSerializer):
     """Сериализатор для показа списока подписок пользователя."""
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
 
     def get_is_subscribed(self, obj):
+        annotated = getattr(obj, 'is_subscribed', None)
+        if annotated is not None:
+            return annotated
         request = self.context.get('request')
         if request.user.is_anonymous:
             return False
         follow = Follow.objects.filter(following=obj, user=request.user)
         return follow.exists()
 
-    def get_recipes_count(self, author):
-        """Количество рецептов в виде целого числа."""
-        amount = (
-            Recipe.objects.filter(author=author).aggregate(count=Count('id'))
-        )
-        return amount['count']
-
     def get_recipes(self, obj):
+        """Рецепты автора. UserViewSet.subscriptions загружает их заранее
+        для всей страницы и сохраняет в атрибуте limited_recipes."""
         request = self.context['request']
-        limit = request.GET.get('recipes_limit')
-        author = get_object_or_404(User, id=obj.pk)
-        recipes = author.recipes.all()
-        if limit:
-            recipes = recipes[:int(limit)]
+        recipes = getattr(obj, 'limited_recipes', None)
+        if recipes is None:
+            limit = self.context.get('recipes_limit')
+            recipes = obj.recipes.all()
+            if limit is not None:
+                recipes = recipes[:limit]
         serializer = FollowRecipeSerializer(
             recipes,
             many=True,
@@ -89,7 +99,7 @@ class GetFollowSerializer(serializers.ModelSerializer):
         model = User
         fields = ('id', 'email', 'username',
                   'first_name', 'last_name', 'is_subscribed',
-                  'recipes', 'recipes_count', )
+                  'recipes', 'recipes_count', 'followers_count', )
 
 
 class FollowSerializer(serializers.ModelSerializer):
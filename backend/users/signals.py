@@ -0,0 +1,40 @@
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from users.authentication import revoke_cached_token, revoke_user_tokens
+from users.models import Follow, User
+
+
+@receiver(post_save, sender=Follow)
+def increment_followers_count(sender, instance, created, raw=False,
+                              **kwargs):
+    """Увеличивает счётчик подписчиков автора."""
+    if created and not raw:
+        User.objects.filter(pk=instance.following_id).update(
+            followers_count=F('followers_count') + 1)
+
+
+@receiver(post_delete, sender=Follow)
+def decrement_followers_count(sender, instance, **kwargs):
+    User.objects.filter(
+        pk=instance.following_id, followers_count__gt=0,
+    ).update(followers_count=F('followers_count') - 1)
+
+
+@receiver(post_delete, sender=Token)
+def revoke_deleted_token(sender, instance, **kwargs):
+    """Убирает из кеша токен, удалённый при выходе пользователя."""
+    revoke_cached_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+def revoke_user_token(sender, instance, created, raw=False,
+                      update_fields=None, **kwargs):
+    """Убирает из кеша токен пользователя после изменения его данных:
+    пароля, признака is_active и остальных полей, которые
+    отдаются из request.user. Время входа при этом не важно.
+    QuerySet.update() сигнал не отправляет, см. revoke_user_tokens."""
+    if created or raw or update_fields == frozenset(('last_login', )):
+        return
+    revoke_user_tokens([instance.pk])
@@ -0,0 +1,102 @@
+import tempfile
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from users.authentication import revoke_user_tokens
+from users.models import Follow, User
+
+
+def create_users(count, prefix='user'):
+    return [
+        User.objects.create_user(
+            username=f'{prefix}{number}',
+            email=f'{prefix}{number}@example.com',
+            password='password',
+        )
+        for number in range(count)
+    ]
+
+
+class FollowersCountTests(TestCase):
+
+    def test_follow_and_unfollow(self):
+        user, author = create_users(2)
+        follow = Follow.objects.create(user=user, following=author)
+        author.refresh_from_db()
+        self.assertEqual(author.followers_count, 1)
+        follow.delete()
+        author.refresh_from_db()
+        self.assertEqual(author.followers_count, 0)
+
+
+class SubscriptionCursorTests(TestCase):
+    url = '/api/users/subscriptions/'
+
+    def setUp(self):
+        self.user, *self.authors = create_users(5)
+        for author in self.authors:
+            Follow.objects.create(user=self.user, following=author)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_pages_newest_first(self):
+        response = self.client.get(self.url, {'cursor': '', 'limit': 3})
+        self.assertEqual(response.status_code, 200)
+        ids = [author['id'] for author in response.data['results']]
+        response = self.client.get(response.data['next'])
+        ids += [author['id'] for author in response.data['results']]
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(
+            ids, [author.pk for author in reversed(self.authors)])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {'cursor': 'не курсор'})
+        self.assertEqual(response.status_code, 404)
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    url = '/api/users/me/'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': directory.name,
+        }})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user, = create_users(1)
+        token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def token_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return sum('authtoken_token' in query['sql'] for query in queries)
+
+    def test_cached(self):
+        self.assertEqual(self.token_queries(), 1)
+        self.assertEqual(self.token_queries(), 0)
+
+    def test_revoked_on_save(self):
+        self.token_queries()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_revoked_after_update(self):
+        self.token_queries()
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        revoke_user_tokens([self.user.pk])
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_revoked_on_logout(self):
+        self.token_queries()
+        Token.objects.filter(user=self.user).delete()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
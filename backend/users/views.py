@@ -1,15 +1,22 @@
+from collections import defaultdict
+
 from api.pagination import RecipePagination
+from core.timing import ServerTimingMixin, timed
+from django.conf import settings
+from django.db.models import BooleanField, F, Value
 from django.shortcuts import get_object_or_404
 from djoser.views import UserViewSet
+from recipe.models import Recipe
 from rest_framework import status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from users.models import Follow, User
 from users.serializers import FollowSerializer, GetFollowSerializer
 
 
-class UserViewSet(UserViewSet):
+class UserViewSet(ServerTimingMixin, UserViewSet):
     """Вьюсет пользователя."""
     queryset = User.objects.all()
     permission_classes = (AllowAny, )
@@ -37,15 +44,52 @@ class UserViewSet(UserViewSet):
         """Возвращает список пользователей,
         на которых подписан автор."""
         user = request.user
-        queryset = User.objects.filter(following__user=user)
+        limit = self.get_recipes_limit(request)
+        queryset = User.objects.filter(following__user=user).annotate(
+            follow_id=F('following__id'),
+            is_subscribed=Value(True, output_field=BooleanField()),
+        )
         pages = self.paginate_queryset(queryset)
-        serializer = GetFollowSerializer(
+        recipes = defaultdict(list)
+        for recipe in Recipe.objects.latest_for_authors(
+            [author.pk for author in pages], limit
+        ).only(
+            'id', 'name', 'image', 'image_variants_ready',
+            'cooking_time', 'author_id',
+        ):
+            recipes[recipe.author_id].append(recipe)
+        for author in pages:
+            author.limited_recipes = recipes[author.pk]
+        serializer = timed(GetFollowSerializer(
             pages,
             many=True,
-            context={'request': request}
-        )
+            context={'request': request, 'recipes_limit': limit}
+        ))
         return self.get_paginated_response(serializer.data)
 
+    def get_cursor_fields(self):
+        """Подписки в режиме курсора идут от новых к старым."""
+        if self.action == 'subscriptions':
+            return ('follow_id', )
+        return ('id', )
+
+    @staticmethod
+    def get_recipes_limit(request):
+        """Проверяет параметр recipes_limit и ограничивает его сверху
+        значением SUBSCRIPTION_RECIPES_LIMIT_MAX."""
+        limit = request.query_params.get('recipes_limit')
+        if limit is None or limit == '':
+            return None
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValidationError(
+                {'recipes_limit': 'Должно быть целым числом.'})
+        if limit < 0:
+            raise ValidationError(
+                {'recipes_limit': 'Не может быть отрицательным.'})
+        return min(limit, settings.SUBSCRIPTION_RECIPES_LIMIT_MAX)
+
     @action(
         methods=['post', 'delete'],
         detail=True,
@@ -73,10 +117,10 @@ class UserViewSet(UserViewSet):
                 return Response(
                     {'errors': 'Нельзя повторно подписаться на пользователя.'},
                     status=status.HTTP_400_BAD_REQUEST)
-            serializer = FollowSerializer(
+            serializer = timed(FollowSerializer(
                 data=data,
                 context={'request': request}
-            )
+            ))
             serializer.is_valid(raise_exception=True)
             serializer.save()
             return Response(